@@ -5,6 +5,9 @@ import time
 from enums import State
 from peer import Peer
 
+# Transactions signed and queued together by submit_bulk()
+BULK_BATCH_LEN = 1000
+
 
 def find_poll(peer, poll_identifier, using_id=True):
     """
@@ -18,13 +21,13 @@ def find_poll(peer, poll_identifier, using_id=True):
         dict: A dictionary describing the poll, with its id, name and options
     """
     poll_field = "poll_id" if using_id else "poll_name"
-    chain = peer.get_chain()
-    for block in chain:
-        for txn in block.txns:
-            txn_data = txn.data
-            # print("LOG find_poll txn_data:", txn_data)
-            if txn_data["transaction_type"] == "create_poll" and txn_data[poll_field] == poll_identifier:
-                return txn_data
+    # The poll index is kept up to date with the chain, so there's no need to walk (and lock) it
+    polls = peer.poll_index.get_view()["polls"]
+    if using_id:
+        return polls.get(poll_identifier)
+    for poll in polls.values():
+        if poll[poll_field] == poll_identifier:
+            return poll
     return None
 
 def get_all_polls(peer):
@@ -37,15 +40,7 @@ def get_all_polls(peer):
     Returns:
         _type_: _description_
     """
-    polls = []
-    chain = peer.get_chain()
-    for block in chain:
-        for txn in block.txns:
-            txn_data = txn.data
-            if txn_data["transaction_type"] == "create_poll":
-                polls.append(txn_data)
-    
-    return polls
+    return list(peer.poll_index.get_view()["polls"].values())
 
 def get_poll_results(peer, poll_id):
     """_summary_
@@ -57,25 +52,10 @@ def get_poll_results(peer, poll_id):
     Returns:
         dict: A map of counts for each option in the poll
     """
-    poll = find_poll(peer, poll_id, True)
-    if not poll:
+    results = peer.poll_index.get_view()["results"].get(poll_id)
+    if results == None:
         return None
-    
-    options = poll["options"]
-    options_count = {option: 0 for option in poll["options"]}
-
-    chain = peer.get_chain()
-    for block in chain:
-        for txn in block.txns:
-            txn_data = txn.data
-            # print(txn_data)
-            if txn_data["poll_id"] == poll_id and txn_data["transaction_type"] == "vote":
-                voted_option = txn_data["vote"]
-                # print(f"voted_option: {voted_option}")
-                # print(f"Found voted option: {voted_option in options}")
-                options_count[voted_option] += 1
-    
-    return options_count
+    return dict(results)
 
     
 def create_poll(peer, poll_name, poll_options):
@@ -85,6 +65,18 @@ def create_poll(peer, poll_name, poll_options):
         peer (Peer): underlying peer object for this client
         poll_name (str): name of poll to create
         poll_options (list): a list of available options for this poll
+    Returns:
+        Transaction: the submitted transaction
+    """
+    return peer.create_txn(create_poll_data(poll_name, poll_options))
+
+def create_poll_data(poll_name, poll_options):
+    """
+    Args:
+        poll_name (str): name of poll to create
+        poll_options (list): a list of available options for this poll
+    Returns:
+        dict: the data of a transaction creating the poll, with a new poll ID
     """
     poll_id = str(uuid.uuid4())
     poll_dict = {
@@ -93,7 +85,7 @@ def create_poll(peer, poll_name, poll_options):
         "poll_name": poll_name,
         "options": poll_options
     }
-    peer.create_txn(poll_dict)
+    return poll_dict
 
 def vote(peer, poll_id, option):
     """
@@ -101,13 +93,67 @@ def vote(peer, poll_id, option):
         peer (Peer): underlying peer object for this client
         poll_id (str): id of poll that this vote is for
         option (str): which option of the poll this vote is for
+    Returns:
+        Transaction: the submitted transaction
+    """
+    return peer.create_txn(vote_data(poll_id, option))
+
+def vote_data(poll_id, option):
+    """
+    Args:
+        poll_id (str): id of poll that this vote is for
+        option (str): which option of the poll this vote is for
+    Returns:
+        dict: the data of a transaction voting for the option
     """
     vote_dict = {
         "transaction_type": "vote",
         "poll_id": poll_id,
         "vote": option
     }
-    peer.create_txn(vote_dict)
+    return vote_dict
+
+def submit_bulk(peer, lines):
+    """
+    Submits many CREATE/VOTE events (same format as the sim file) at once. The transactions are
+    signed in parallel and queued for mining in one go, BULK_BATCH_LEN at a time. Unlike in the sim
+    file, a VOTE can refer to a poll created earlier in the same submission, and nothing is printed
+    per event.
+
+    Args:
+        peer (Peer): underlying peer object for this client
+        lines (iterable): the event lines, e.g. an open file
+    Returns:
+        Transaction[]: the submitted transactions
+    """
+    submitted = []
+    data_dicts = []
+    created = {}  # poll name -> poll ID, for polls created earlier in this submission
+    for line in lines:
+        data_arr = line.strip().split(' ')
+        if data_arr[0] == "CREATE":
+            poll_dict = create_poll_data(data_arr[1], data_arr[2:])
+            created[data_arr[1]] = poll_dict["poll_id"]
+            data_dicts.append(poll_dict)
+        elif data_arr[0] == "VOTE":
+            poll_id = created.get(data_arr[1])
+            if poll_id == None:
+                poll = find_poll(peer, data_arr[1], using_id=False)
+                if poll == None:
+                    print(f"Did not find poll {data_arr[1]}.")
+                    continue
+                poll_id = poll["poll_id"]
+            data_dicts.append(vote_data(poll_id, data_arr[2]))
+        elif data_arr[0] != "":
+            print("Unsupported command type")
+
+        if len(data_dicts) >= BULK_BATCH_LEN:
+            submitted += peer.create_txns(data_dicts)
+            data_dicts = []
+
+    if len(data_dicts) > 0:
+        submitted += peer.create_txns(data_dicts)
+    return submitted
 
 
 def is_int(input_str, rng=None):
@@ -138,29 +184,51 @@ def shutdown(peer):
     
     print("\nStarting shutdown procedure...")
     
-    with peer.state_lock:
-        peer.state = State.SHUTTING_DOWN
-    
     peer.shutdown_event.set() # signal all threads to terminate
+    peer.set_state(State.SHUTTING_DOWN)
+    peer.wake_threads()
     
     # 1. closing tracker connection
     print("Closing connection to tracker...")
     try:
-        with peer.tracker_lock:
-            try:
-                leave_msg = "LEAVE\n"
-                peer.tracker_socket.sendall(leave_msg.encode())
-            except Exception as e:
-                print(f"Failed to send leave message: {e}")
-            
-            peer.tracker_socket.close()
+        # Sends LEAVE, then closes the connection (which stops the tracker thread)
+        peer.tracker_client.close()
     except Exception as e:
         print(f"Error closing tracker connnection: {e}")        
     
-    # 2. closing listening socket
+    try:
+        # Also writes the metrics file one last time
+        peer.metrics.close()
+    except Exception as e:
+        print(f"Error stopping metrics: {e}")
+
+    try:
+        peer.profiler.close()
+    except Exception as e:
+        print(f"Error stopping profiler: {e}")
+
+    try:
+        # Writes out the trace events that are still queued
+        peer.tracer.close()
+    except Exception as e:
+        print(f"Error stopping block tracing: {e}")
+
+    if peer.read_api != None:
+        print("Stopping read API...")
+        try:
+            peer.read_api.close()
+        except Exception as e:
+            print(f"Error stopping read API: {e}")
+
+    # 2. stopping the transport (listening socket, event loop and worker pool)
     print("Closing listenning port...")
     try:
-        peer.listening_sock.close()
+        peer.broadcast_executor.shutdown(wait=False)
+        peer.fork_executor.shutdown(wait=False)
+        peer.signing_executor.shutdown(wait=False)
+        peer.transport.stop()
+        if peer.listening_sock != None:
+            peer.listening_sock.close()
     except Exception as e:
         print(f"Error closing listening socket: {e}")
         
@@ -178,11 +246,28 @@ def shutdown(peer):
         if peer.polling_thread.is_alive():
             print("Warning: polling thread didn't terminate properly!")
 
+    if hasattr(peer, 'tracker_thread') and peer.tracker_thread.is_alive():
+        peer.tracker_thread.join(timeout)
+        if peer.tracker_thread.is_alive():
+            print("Warning: tracker thread didn't terminate properly!")
+
+    if hasattr(peer, 'heartbeat_thread') and peer.heartbeat_thread.is_alive():
+        peer.heartbeat_thread.join(timeout)
+        if peer.heartbeat_thread.is_alive():
+            print("Warning: heartbeat thread didn't terminate properly!")
+
+    if hasattr(peer, 'chain_sync_thread') and peer.chain_sync_thread.is_alive():
+        peer.chain_sync_thread.join(timeout)
+        if peer.chain_sync_thread.is_alive():
+            print("Warning: chain sync thread didn't terminate properly!")
+
     if hasattr(peer, 'mining_thread') and peer.mining_thread.is_alive():
         peer.mining_thread.join(timeout)
         if peer.mining_thread.is_alive():
             print("Warning: mining thread didn't terminate properly!")
     
+    # Writes out the log records still queued
+    peer.log.close()
     peer.log_file.close()
     print("Peer all shut down")
     
@@ -219,6 +304,11 @@ def parse_sim_file(sim_file, peer):
             elif data_arr[0] == "SLEEP":
                 print(f"Sleeping for {str(data_arr[1])} s")
                 time.sleep(float(data_arr[1]))
+            elif data_arr[0] == "BULK":
+                # Opt-in batching: every CREATE/VOTE line of another file, submitted at once
+                with open(data_arr[1], 'r') as bulk_file:
+                    submitted = submit_bulk(peer, bulk_file)
+                print(f"Submitted {len(submitted)} transactions from {data_arr[1]}")
             else:
                 print("Unsupported command type")
 
@@ -0,0 +1,456 @@
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import app
+from logger import WARNING
+from peer import Peer
+from peer_load import rate_schedule, LOAD_POLL_OPTIONS
+from simulator import ChainMonitor, MONITOR_INTERVAL
+from tracker import Tracker
+from tracker_load import percentile
+
+"""
+End-to-end cluster benchmark: a tracker and N peers on loopback, each peer in its own process (so
+each one's peak RSS can be measured), with votes submitted at increasing rates. Every rate is a
+separate run on a fresh cluster, so runs don't affect each other.
+
+Per run it measures, from the time each vote was due:
+    first_inclusion     until the vote was first in a block on any peer's chain (even one that
+                        was later dropped by a fork switch)
+    k_confirmations     until the vote's block, with k - 1 blocks on top of it, was on every
+                        peer's chain (votes near the end of a run may never get k deep, nothing
+                        is mined after them)
+plus the orphaned-block rate (blocks mined during the run that aren't on the final chain), how long
+the peers took to converge on one chain with nothing left to mine after the last vote, and each
+peer's peak RSS. The results are written as json, so runs of different builds can be compared.
+
+Times are time.monotonic(), which is the same clock in every process on one machine. The peers
+report their state to the driver every MONITOR_INTERVAL, which is the resolution of the convergence time.
+
+Usage:
+    python3 benchmark.py {tracker port} {first listening port} {num peers} {difficulty} {rates, e.g. 5,10,20} {duration secs} {results file} [{benchmark file}]
+
+The benchmark file is a json file, every key optional:
+    {
+        "confirmations": 3,       k, for the time to k confirmations
+        "peer_config": {...},     config keys for every peer, as in a peer's config file
+        "arrival": "poisson",     or "constant"
+        "convergence_timeout": 30,
+        "seed": 1
+    }
+
+Run r's peers listen on first port + r * num peers, ..., so a run never waits for the previous
+run's ports to be released. Their logs are written to {port}_log.txt as usual.
+"""
+
+BENCH_ADDR = "127.0.0.1"
+CONFIRMATIONS = 3
+CONVERGENCE_TIMEOUT = 30.0
+SETUP_TIMEOUT = 60.0
+# How long after the load is sent out the first vote is due, so every peer has its schedule in time
+LOAD_START_DELAY = 0.5
+STOP_TIMEOUT = 30.0
+# Only warnings are logged, a benchmark shouldn't be measuring the log writer
+BENCH_PEER_CONFIG = {"log_level": "warning"}
+
+def peak_rss():
+    """
+    Returns:
+        int: this process's peak resident set size, in bytes
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes everywhere else
+    return rss if sys.platform == "darwin" else rss * 1024
+
+def summary(values):
+    values = sorted(values)
+    return {"count": len(values), "p50": percentile(values, 50), "p90": percentile(values, 90),
+        "p99": percentile(values, 99), "max": percentile(values, 100)}
+
+class InclusionMonitor(ChainMonitor):
+    """
+    A ChainMonitor for one peer that also records when each transaction was first in a block on its chain
+    """
+
+    def __init__(self, peer):
+        super().__init__([peer])
+        self.included = {}  # signature hex -> time.monotonic() it was first in a block on the chain
+
+    def saw_block(self, i, block, block_hash, now):
+        super().saw_block(i, block, block_hash, now)
+        for txn in block.txns:
+            self.included.setdefault(txn.signature.hex(), now)
+
+class BenchmarkPeer:
+    """
+    Runs in a peer's process: starts the peer, reports its state on stdout and takes commands on stdin
+    (one json object per line)
+    """
+
+    def __init__(self, tracker_port, listening_port, difficulty, peer_config):
+        # Anything the peer code prints would get mixed up with the reports
+        self.out = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        self.out_lock = threading.Lock()
+
+        self.peer = Peer(BENCH_ADDR, tracker_port, listening_port, difficulty)
+        self.peer.set_configs(peer_config)
+        # The configs that are switched off while the load poll is set up, see run()
+        self.load_configs = {"gossip_fanout": self.peer.gossip_fanout, "tamper_freq": self.peer.tamper_freq,
+            "broadcast_freq": self.peer.broadcast_freq}
+        self.monitor = InclusionMonitor(self.peer)
+        self.due = {}  # signature hex -> time.monotonic() it was due
+        self.load_thread = None
+        self.status_thread = threading.Thread(target=self.report_status, daemon=True)
+
+    def send(self, message):
+        with self.out_lock:
+            self.out.write(json.dumps(message) + "\n")
+            self.out.flush()
+
+    def report_status(self):
+        """
+        Runs on the status thread, sends the peer's state whenever it changes
+        """
+        last = None
+        while not self.monitor.done.wait(MONITOR_INTERVAL):
+            view = self.peer.poll_index.get_view()
+            status = {
+                "tip": str(view["tip_hash"]),
+                "polls": len(view["polls"]),
+                "idle": len(self.peer.txns) == 0 and len(self.peer.pending_txns) == 0,
+                "nodes": len(self.peer.directory.nodes()),
+            }
+            if status != last:
+                self.send({"status": status})
+                last = status
+
+    def run_load(self, start, events):
+        """
+        Runs on the load thread, submits the votes on schedule
+
+        Args:
+            start (float): time.monotonic() the schedule starts at
+            events (list[]): [seconds from the start, transaction data], in time order
+        """
+        i = 0
+        while i < len(events):
+            delay = start + events[i][0] - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            now = time.monotonic() - start
+            batch = []
+            while i < len(events) and events[i][0] <= now:
+                batch.append(events[i])
+                i += 1
+            txns = self.peer.create_txns([data_dict for _, data_dict in batch])
+            for (offset, _), txn in zip(batch, txns):
+                self.due[txn.signature.hex()] = start + offset
+        self.send({"loaded": time.monotonic()})
+
+    def results(self):
+        """
+        Returns:
+            dict: what the peer saw, for the driver to combine with the other peers'
+        """
+        view = self.peer.poll_index.get_view()
+        return {
+            "seen": self.monitor.seen[0],
+            "included": self.monitor.included,
+            "chain": [str(block.hash) for block in self.peer.get_chain()],
+            "txns": dict(view["txns"]),
+            "due": self.due,
+            "forks": {result: self.peer.forks_counter.get((result,)) for result in ["switched", "not_longer", "tip_changed", "failed"]},
+            "peak_rss": peak_rss(),
+        }
+
+    def run(self):
+        self.peer.send_join_message()
+        self.monitor.check()
+        self.monitor.thread.start()
+        self.status_thread.start()
+
+        for line in sys.stdin:
+            command = json.loads(line)
+            if command["cmd"] == "submit":
+                self.peer.create_txns(command["txns"])
+            elif command["cmd"] == "setup":
+                # While the load poll is set up, every block is sent to every peer untampered, so the
+                # poll reaches every peer even with gossip or the stress test configs on
+                for key, value in self.load_configs.items():
+                    setattr(self.peer, key, None if command["on"] else value)
+            elif command["cmd"] == "load":
+                self.load_thread = threading.Thread(target=self.run_load, args=(command["start"], command["events"]))
+                self.load_thread.start()
+            elif command["cmd"] == "stop":
+                break
+
+        if self.load_thread != None:
+            self.load_thread.join()
+        self.monitor.done.set()
+        self.monitor.thread.join()
+        self.status_thread.join()
+        self.monitor.check()
+        self.send({"results": self.results()})
+        app.shutdown(self.peer)
+
+class PeerProcess:
+    """
+    The driver's handle on a peer's process, keeps the latest of what the peer reported
+    """
+
+    def __init__(self, tracker_port, listening_port, difficulty, peer_config):
+        self.listening_port = listening_port
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "peer", str(tracker_port), str(listening_port), str(difficulty), json.dumps(peer_config)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        self.status = None
+        self.loaded = None
+        self.results = None
+        self.exited = False
+        self.thread = threading.Thread(target=self.read_reports, daemon=True)
+        self.thread.start()
+
+    def read_reports(self):
+        for line in self.process.stdout:
+            report = json.loads(line)
+            if "status" in report:
+                self.status = report["status"]
+            elif "loaded" in report:
+                self.loaded = report["loaded"]
+            elif "results" in report:
+                self.results = report["results"]
+        self.exited = True
+
+    def send(self, command):
+        self.process.stdin.write(json.dumps(command) + "\n")
+        self.process.stdin.flush()
+
+class Benchmark:
+    """
+    Runs the cluster at each rate and collects the results
+    """
+
+    def __init__(self, tracker_port, first_port, num_peers, difficulty, config=None):
+        """
+        Args:
+            tracker_port (int): port for the tracker (on loopback)
+            first_port (int): the first run's peers listen on first_port, first_port + 1, ...
+            num_peers (int): number of peers
+            difficulty (int): mining difficulty
+            config (dict | None): confirmations, peer configs, arrivals..., see the module docstring
+        """
+        self.config = config if config != None else {}
+        self.first_port = first_port
+        self.num_peers = num_peers
+        self.difficulty = difficulty
+        self.confirmations = self.config.get("confirmations", CONFIRMATIONS)
+        self.peer_config = dict(BENCH_PEER_CONFIG)
+        self.peer_config.update(self.config.get("peer_config", {}))
+
+        self.tracker = Tracker(tracker_port)
+        self.tracker.log.level = WARNING
+        self.tracker_port = tracker_port
+        self.tracker_thread = threading.Thread(target=self.tracker.listen_for_connections, daemon=True)
+        self.tracker_thread.start()
+        self.runs = 0
+
+    def wait_for(self, condition, timeout, what):
+        """
+        Args:
+            condition (function): returns whether to stop waiting
+            timeout (float): seconds to wait at most
+            what (str): what we're waiting for, for the error
+        Returns:
+            float: time.monotonic() when the condition held
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if condition():
+                return time.monotonic()
+            time.sleep(MONITOR_INTERVAL)
+        raise RuntimeError(f"Timed out waiting for {what}")
+
+    def run(self, rate, duration):
+        """
+        Starts a cluster, submits votes at rate per second for duration seconds, waits for the peers
+        to converge and stops the cluster
+
+        Args:
+            rate (float): votes per second, across the peers
+            duration (float): seconds to submit for
+        Returns:
+            dict: the run's results, see report()
+        """
+        first_port = self.first_port + self.runs * self.num_peers
+        self.runs += 1
+        procs = [PeerProcess(self.tracker_port, first_port + i, self.difficulty, self.peer_config) for i in range(self.num_peers)]
+        try:
+            def all_status(check):
+                return all(proc.status != None and check(proc.status) for proc in procs)
+
+            def converged():
+                return all_status(lambda status: status["idle"] and status["tip"] == procs[0].status["tip"])
+
+            self.wait_for(lambda: all_status(lambda status: status["nodes"] >= self.num_peers - 1), SETUP_TIMEOUT,
+                "every peer to hear about the others from the tracker")
+            for proc in procs:
+                proc.send({"cmd": "setup", "on": True})
+            poll_dict = app.create_poll_data("load", LOAD_POLL_OPTIONS)
+            procs[0].send({"cmd": "submit", "txns": [poll_dict]})
+            self.wait_for(lambda: all_status(lambda status: status["polls"] > 0) and converged(), SETUP_TIMEOUT,
+                "the load poll to be on every peer's chain")
+            for proc in procs:
+                proc.send({"cmd": "setup", "on": False})
+
+            events = rate_schedule(self.num_peers, rate, duration, self.config.get("arrival", "poisson"), self.config.get("seed", 0))
+            start = time.monotonic() + LOAD_START_DELAY
+            for idx, proc in enumerate(procs):
+                proc.send({"cmd": "load", "start": start,
+                    "events": [[offset, app.vote_data(poll_dict["poll_id"], line.split(' ')[2])] for offset, i, line in events if i == idx]})
+            self.wait_for(lambda: all(proc.loaded != None for proc in procs), duration + SETUP_TIMEOUT, "the votes to be submitted")
+            load_end = max(proc.loaded for proc in procs)
+
+            converged_at = None
+            try:
+                converged_at = self.wait_for(converged, self.config.get("convergence_timeout", CONVERGENCE_TIMEOUT), "the peers to converge")
+            except RuntimeError:
+                pass
+        finally:
+            for proc in procs:
+                try:
+                    proc.send({"cmd": "stop"})
+                except OSError:
+                    pass
+            for proc in procs:
+                try:
+                    proc.process.wait(STOP_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    proc.process.kill()
+                proc.thread.join()
+
+        if any(proc.results == None for proc in procs):
+            raise RuntimeError("Not every peer reported its results")
+        return self.report(rate, duration, [proc.results for proc in procs], start, load_end, converged_at)
+
+    def report(self, rate, duration, results, start, load_end, converged_at):
+        """
+        Returns:
+            dict: latency summaries (seconds), orphaned blocks, convergence and memory of a run
+        """
+        final_chain = results[0]["chain"]
+        final_txns = results[0]["txns"]
+        due = {}
+        for peer_results in results:
+            due.update(peer_results["due"])
+
+        first_inclusion = []
+        k_confirmations = []
+        for sig, txn_due in due.items():
+            included = [peer_results["included"][sig] for peer_results in results if sig in peer_results["included"]]
+            if len(included) > 0:
+                first_inclusion.append(min(included) - txn_due)
+            block_id = final_txns.get(sig)
+            if block_id == None or block_id + self.confirmations - 1 >= len(final_chain):
+                continue
+            # The block k - 1 blocks above the vote's, once every peer had it
+            block_hash = final_chain[block_id + self.confirmations - 1]
+            seen = [peer_results["seen"].get(block_hash) for peer_results in results]
+            if all(time_seen != None for time_seen in seen):
+                k_confirmations.append(max(seen) - txn_due)
+
+        final_hashes = set(final_chain)
+        first_seen = {}
+        for peer_results in results:
+            for block_hash, time_seen in peer_results["seen"].items():
+                first_seen[block_hash] = min(time_seen, first_seen.get(block_hash, time_seen))
+        # Blocks from before the load (the genesis block and the load poll's) don't count
+        mined = [block_hash for block_hash, time_seen in first_seen.items() if time_seen >= start]
+        orphaned = len([block_hash for block_hash in mined if block_hash not in final_hashes])
+        rss = [peer_results["peak_rss"] for peer_results in results]
+
+        return {
+            "rate": rate,
+            "duration": duration,
+            "txns": len(due),
+            "included_in_final_chain": len([sig for sig in due if sig in final_txns]),
+            "first_inclusion": summary(first_inclusion),
+            "k_confirmations": summary(k_confirmations),
+            "blocks": len(mined),
+            "orphaned_blocks": orphaned,
+            "orphan_rate": orphaned / len(mined) if len(mined) > 0 else 0.0,
+            "fork_resolutions": {result: sum(peer_results["forks"][result] for peer_results in results) for result in results[0]["forks"]},
+            "converged": converged_at != None,
+            "convergence_time": converged_at - load_end if converged_at != None else None,
+            "peak_rss": {"per_peer": rss, "max": max(rss), "mean": sum(rss) / len(rss)},
+        }
+
+    def describe(self, rates, duration):
+        """
+        Returns:
+            dict: the benchmark's parameters and what it ran on, stored with the results
+        """
+        try:
+            commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+        except OSError:
+            commit = None
+        return {
+            "peers": self.num_peers,
+            "difficulty": self.difficulty,
+            "rates": rates,
+            "duration": duration,
+            "confirmations": self.confirmations,
+            "peer_config": self.peer_config,
+            "arrival": self.config.get("arrival", "poisson"),
+            "seed": self.config.get("seed", 0),
+            "commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        }
+
+def print_run(run, confirmations):
+    print(f"rate {run['rate']:g}/s: {run['txns']} votes, {run['included_in_final_chain']} on the final chain, "
+        f"{run['orphaned_blocks']}/{run['blocks']} blocks orphaned, "
+        f"converged: {run['converged']}" + (f" in {run['convergence_time']:.2f}s" if run['converged'] else ""))
+    for name, latencies in [("first inclusion", run["first_inclusion"]), (f"{confirmations} confirmations", run["k_confirmations"])]:
+        print(f"    {name:<16} p50 {latencies['p50'] * 1000:8.1f}ms  p90 {latencies['p90'] * 1000:8.1f}ms  max {latencies['max'] * 1000:8.1f}ms  ({latencies['count']})")
+    print(f"    peak rss         max {run['peak_rss']['max'] / 2**20:.1f}MiB  mean {run['peak_rss']['mean'] / 2**20:.1f}MiB")
+
+if __name__ == '__main__':
+    if sys.argv[1] == "peer":
+        # A peer's process, started by the driver below
+        BenchmarkPeer(int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]), json.loads(sys.argv[5])).run()
+        sys.exit(0)
+
+    tracker_port = int(sys.argv[1])
+    first_port = int(sys.argv[2])
+    num_peers = int(sys.argv[3])
+    difficulty = int(sys.argv[4])
+    rates = [float(rate) for rate in sys.argv[5].split(',')]
+    duration = float(sys.argv[6])
+    results_file = sys.argv[7]
+    config = None
+    if len(sys.argv) > 8:
+        with open(sys.argv[8], 'r') as f:
+            config = json.load(f)
+
+    bench = Benchmark(tracker_port, first_port, num_peers, difficulty, config)
+    runs = []
+    try:
+        for rate in rates:
+            run = bench.run(rate, duration)
+            print_run(run, bench.confirmations)
+            runs.append(run)
+    finally:
+        with open(results_file, 'w') as f:
+            json.dump({"benchmark": bench.describe(rates, duration), "runs": runs}, f, indent=4)
+        print(f"Results written to {results_file}")
+        bench.tracker.log.close()
@@ -42,18 +42,86 @@ class Block:
 
         return block_dict
     
-    def is_valid(self, difficulty):
+    def to_compact_json(self):
+        """
+        Converts block to the compact block format: the block's fields, but with
+        transactions replaced by their short IDs (salted with the block hash)
+
+        Returns:
+            dict: compact representation of the block
+        """
+        salt = str(self.hash).encode()
+        return {
+            "id": self.id,
+            "short_ids": [txn.short_id(salt) for txn in self.txns],
+            "nonce": self.nonce,
+            "prev_hash": self.prev_hash,
+            "hash": self.hash,
+            "timestamp": self.timestamp
+        }
+
+    @staticmethod
+    def from_compact_json(compact_dict, txns):
+        """
+        Rebuilds a block from its compact format once all of its transactions are known
+
+        Args:
+            compact_dict (dict): compact representation of the block
+            txns (Transaction[]): the block's transactions, in order
+        Returns:
+            Block: the block
+        """
+        return Block(
+            _id = compact_dict["id"],
+            txns = txns,
+            nonce = compact_dict["nonce"],
+            prev_hash = compact_dict["prev_hash"],
+            _hash = compact_dict["hash"],
+            timestamp = compact_dict["timestamp"]
+        )
+
+    def is_valid(self, difficulty, keys=None):
         """
         Verifies whether this block is valid by
             1. recomputing the hash based on the block's contents
             2. checking if the hash starts with the required numebr of zeros (4 in our design)
+            3. checking the signature of every transaction
         
         Args:
             difficulty (int) : number of leading zeros required for a hash
+            keys (dict | None): key registry of the chain the block is for (see Blockchain.keys), used to
+                                verify transactions whose sender is a key fingerprint
             
         Returns:
             bool: True if the block is valid; False if not
         """
+        if not self.has_valid_hash(difficulty):
+            return False
+        
+        for txn in self.txns:
+            public_key_bytes = None
+            if txn.sender_is_fingerprint():
+                if keys == None or txn.sender not in keys:
+                    return False
+                public_key_bytes = keys[txn.sender][0]
+            valid_signature = txn.verify(public_key_bytes)
+
+            if not valid_signature:
+                # print("invalid signature")
+                return False
+
+        return True
+
+    def has_valid_hash(self, difficulty):
+        """
+        Checks the first two conditions of is_valid(): the hash matches the block's contents and has
+        enough leading zeros. Unlike the signatures, this doesn't depend on which chain the block is for.
+
+        Args:
+            difficulty (int) : number of leading zeros required for a hash
+        Returns:
+            bool: True if the hash is valid
+        """
         # This is concatenating the contents of the block to construct the same string used for mining
         block_bytes = self.to_bytes(False)
 
@@ -68,13 +136,6 @@ class Block:
         if not (len(self.hash) < difficulty or self.hash.startswith('0' * difficulty)):
             # print("does  not meet difficulty")
             return False
-        
-        for txn in self.txns:
-            valid_signature = txn.verify()
-
-            if not valid_signature:
-                # print("invalid signature")
-                return False
 
         return True
         
@@ -126,12 +187,12 @@ class Block:
             Block object from message_body (which is in bytes)
         
         Args:
-            message_body (bytes): The byte representation of a block
+            message_body (bytes | memoryview): The byte representation of a block
         """
         
         try:
-            # convert bytes to dict
-            json_str = message_body.decode()
+            # convert bytes to dict (str() also takes a memoryview without copying it to bytes first)
+            json_str = str(message_body, "utf-8")
             block_dict = json.loads(json_str)
 
             
@@ -0,0 +1,128 @@
+import collections
+import json
+import threading
+import time
+
+"""
+Block propagation tracing for the peers.
+
+With tracing on (the trace_blocks config key), a peer records an event whenever it does something
+with a block, written as one json object per line to {port}_trace.jsonl:
+
+    mined       we mined the block and added it to our chain
+    sent        the block (or its announcement, with gossip) was sent to a peer ("to": its listening
+                port, or "error" if sending failed). "t" is when the send completed.
+    received    the transport handed us the block ("sender": the sender's listening port if known,
+                "tag": how it was sent, e.g. NEW, "queued": whether the rcv buffer took it or dropped
+                it as a duplicate/stale block)
+    validated   poll_from_rcv_buffer checked the block ("valid", "verify_s": how long the check took)
+    added       the block was added to our chain ("fork": true if it came with a fork switch)
+    relayed     we handed the block to the broadcast worker to pass it on to our neighbours
+
+Every event carries the peer's ID (its listening port), the block's hash and ID, a time.monotonic()
+timestamp ("t", the same clock in every process on one machine) and the wall clock time ("wall", for
+peers on different machines). trace_collector.py merges the peers' files into per-block timelines.
+
+Recording only appends a tuple to a queue, a background thread turns the events into json and
+writes them. Events beyond TRACE_QUEUE_LEN waiting to be written are dropped, the writer notes how
+many with a "dropped" event ("count").
+"""
+
+TRACE_EVENTS = ("mined", "sent", "received", "validated", "added", "relayed")
+# Events waiting to be written, more than this and new ones are dropped
+TRACE_QUEUE_LEN = 100000
+# Seconds between writes
+TRACE_FLUSH_INTERVAL = 0.5
+
+class BlockTracer:
+    """
+    Records a peer's block events and writes them to a file on a background thread. Records
+    nothing until start() is called.
+    """
+
+    def __init__(self, peer_id):
+        """
+        Args:
+            peer_id (int): the peer's ID in the events, its listening port
+        """
+        self.peer_id = peer_id
+        self.enabled = False
+        self.path = None
+        self.events = collections.deque()
+        self.drop_lock = threading.Lock()
+        self.dropped = 0
+        self.unreported_drops = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def record(self, event, block_hash, block_id, at=None, **fields):
+        """
+        Records an event, if tracing is on
+
+        Args:
+            event (str): one of TRACE_EVENTS
+            block_hash (str): hash of the block
+            block_id (int): ID of the block
+            at (float | None): time.monotonic() the event happened, if it wasn't just now
+            fields: extra fields of the event (e.g. "to" for sent), json serializable
+        """
+        if not self.enabled:
+            return
+        if len(self.events) >= TRACE_QUEUE_LEN:
+            with self.drop_lock:
+                self.dropped += 1
+                self.unreported_drops += 1
+            return
+        now = time.monotonic()
+        wall = time.time()
+        if at != None:
+            wall -= now - at
+            now = at
+        self.events.append((now, wall, event, block_hash, block_id, fields))
+
+    def start(self, path):
+        """
+        Starts recording events and writing them to a file
+
+        Args:
+            path (str): the file to write, truncated first
+        """
+        self.path = path
+        open(self.path, 'w').close()
+        self.enabled = True
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def write_loop(self):
+        """
+        Runs on the writer thread, writes recorded events every TRACE_FLUSH_INTERVAL until close() is called
+        """
+        while not self.stop_event.wait(TRACE_FLUSH_INTERVAL):
+            self.write_events()
+        self.write_events()
+
+    def write_events(self):
+        lines = []
+        with self.drop_lock:
+            unreported_drops = self.unreported_drops
+            self.unreported_drops = 0
+        if unreported_drops > 0:
+            lines.append(json.dumps({"t": time.monotonic(), "wall": time.time(), "peer": self.peer_id, "event": "dropped", "count": unreported_drops}) + "\n")
+        while len(self.events) > 0:
+            t, wall, event, block_hash, block_id, fields = self.events.popleft()
+            record = {"t": t, "wall": wall, "peer": self.peer_id, "event": event, "hash": block_hash, "id": block_id}
+            record.update(fields)
+            lines.append(json.dumps(record) + "\n")
+        if len(lines) > 0:
+            with open(self.path, 'a') as f:
+                f.write("".join(lines))
+
+    def close(self):
+        """
+        Stops recording and writes out everything that was recorded
+        """
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.stop_event.set()
+        self.thread.join()
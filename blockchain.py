@@ -1,4 +1,5 @@
 from block import Block
+from transaction import key_fingerprint
 import json
 
 """
@@ -20,18 +21,72 @@ Transaction format for the polling application
 }
 """
 
+def find_fork_point(chain, locator):
+    """
+    Finds the highest block in a chain that is also in the locator
+
+    Args:
+        chain (Block[]): the chain's blocks
+        locator (iterable): (block id, block hash) tuples, newest first, e.g. a block locator
+    Returns:
+        int: id of the highest common block, or -1 if there is none
+    """
+    for _id, _hash in locator:
+        if 0 <= _id < len(chain) and str(chain[_id].hash) == _hash:
+            return _id
+    return -1
+
+def prefer_chain(candidate, current):
+    """
+    The fork choice rule: the longer chain wins, and of two chains of the same length the one whose
+    tip has the lower hash, so peers split by blocks mined at the same height still settle on one
+
+    Args:
+        candidate (Block[]): blocks of the chain we could switch to
+        current (Block[]): blocks of our chain
+    Returns:
+        bool: whether to switch to the candidate
+    """
+    if len(candidate) != len(current):
+        return len(candidate) > len(current)
+    return len(candidate) > 0 and str(candidate[-1].hash) < str(current[-1].hash)
+
 class Blockchain:
-    def __init__(self, chain=None, difficulty=4):
+    def __init__(self, chain=None, difficulty=4, keys=None):
         """
         This is a helper class for managing the logic specific to the blockchain itself.
 
         Args:
             chain (list | None): A list of Blocks. Used to initialize the blockchain of a peer that has just joined a network that has been mining.
             difficulty (int): the number of zeroes that a hash should start with
+            keys (dict | None): the chain's key registry if it's already known (see copy()), built from the chain if None
         """
         self.chain = chain if chain != None else []
         self.difficulty = difficulty
 
+        # Key registry: a sender's public key is registered by the first block with a transaction
+        # signed with it, later transactions can then refer to the sender by the key's fingerprint
+        self.keys = keys  # fingerprint -> (public key bytes, id of the block that registered it)
+        if self.keys == None:
+            self.keys = {}
+            for block in self.chain:
+                self.register_keys(block)
+
+    def copy(self, length=None):
+        """
+        Copies the chain, or its first length blocks, without rebuilding the key registry (it has
+        an entry per sender, not per block, so copying it is cheap)
+
+        Args:
+            length (int | None): how many blocks to copy, all of them if None
+        Returns:
+            Blockchain: the copy, blocks are shared with this chain
+        """
+        if length == None or length >= len(self.chain):
+            return Blockchain(self.chain[:], self.difficulty, dict(self.keys))
+        keys = {fingerprint: entry for fingerprint, entry in self.keys.items() if entry[1] < length}
+        return Blockchain(self.chain[:length], self.difficulty, keys)
+
     def add_block(self, block):
         """
         Adds a block to the chain
@@ -40,6 +95,47 @@ class Blockchain:
             block (Block): the block to add to the chain
         """
         self.chain.append(block)
+        self.register_keys(block)
+
+    def register_keys(self, block):
+        """
+        Adds the public keys of a block's senders to the key registry
+
+        Args:
+            block (Block): a block on the chain
+        """
+        for txn in block.txns:
+            if not txn.sender_is_fingerprint():
+                fingerprint = key_fingerprint(txn.sender)
+                if fingerprint not in self.keys:
+                    self.keys[fingerprint] = (txn.sender, block.id)
+
+    def sender_keys(self, block):
+        """
+        Copies the key registry entries a block needs to be verified (see Block.is_valid()), so the
+        signatures can be checked without holding the lock for the chain
+
+        Args:
+            block (Block): the block to verify
+        Returns:
+            dict: fingerprint -> registry entry, for the fingerprints the block refers to that are registered
+        """
+        return {txn.sender: self.keys[txn.sender] for txn in block.txns
+            if txn.sender_is_fingerprint() and txn.sender in self.keys}
+
+    def are_senders_registered(self, new_block):
+        """
+        Checks that every sender the block refers to by fingerprint is registered on the chain
+
+        Args:
+            new_block (Block): the block to check
+        Returns:
+            boolean: whether all the keys are known
+        """
+        for txn in new_block.txns:
+            if txn.sender_is_fingerprint() and txn.sender not in self.keys:
+                return False
+        return True
     
     def swap_block(self, new_block, public_key):
         """
@@ -87,6 +183,9 @@ class Blockchain:
         if new_block.id != len(self.chain):
             return False
 
+        if not self.are_senders_registered(new_block):
+            return False
+
         if len(self.chain) == 0:
             return True
 
@@ -150,6 +249,63 @@ class Blockchain:
 
         return latest_block
 
+    def get_locator(self, dense_len=10):
+        """
+        Builds a block locator that describes this chain to another peer: the ids/hashes
+        of the last dense_len blocks, then exponentially further apart, and always the
+        first block. It lets the other peer find the highest block we have in common
+        without us sending the whole chain.
+
+        Args:
+            dense_len (int): number of most recent blocks to include one by one
+        Returns:
+            tuple[]: array of (block id, block hash), newest first
+        """
+        locator = []
+        step = 1
+        i = len(self.chain) - 1
+        while i >= 0:
+            blk = self.chain[i]
+            locator.append((blk.id, str(blk.hash)))
+            if len(locator) >= dense_len:
+                step *= 2
+            i -= step
+
+        if len(locator) > 0 and locator[-1][0] != 0:
+            locator.append((self.chain[0].id, str(self.chain[0].hash)))
+
+        return locator
+
+    @staticmethod
+    def locator_to_bytes(locator):
+        """
+        Serializes a locator for the GET-CHAIN request, format: "{id},{hash} {id},{hash}..."
+
+        Args:
+            locator (tuple[]): array of (block id, block hash)
+        Returns:
+            bytes: serialized locator
+        """
+        return " ".join([f"{_id},{_hash}" for _id, _hash in locator]).encode()
+
+    @staticmethod
+    def locator_from_bytes(locator_bytes):
+        """
+        Reverse of locator_to_bytes()
+
+        Args:
+            locator_bytes (bytes): serialized locator
+        Returns:
+            tuple[]: array of (block id, block hash)
+        """
+        locator = []
+        for entry in locator_bytes.decode().split(' '):
+            if len(entry) == 0:
+                continue
+            pair = entry.split(',')
+            locator.append((int(pair[0]), pair[1]))
+        return locator
+
     def get_block_by_id(self, _id):
 
         # If our chain is long enough and such a block actually exists in our chain, we return that block
@@ -0,0 +1,145 @@
+import struct
+import zlib
+
+"""
+Binary framing used for bulk transfers between peers (e.g. GET-CHAIN responses).
+
+Every frame starts with a fixed 6 byte header:
+    frame type (1 byte) | flags (1 byte) | payload length (4 bytes, big endian)
+
+followed by the payload. If FLAG_ZLIB is set, the payload is zlib compressed.
+
+A BLOCK_BATCH payload carries many blocks, each one as:
+    block length (4 bytes, big endian) | block bytes (Block.to_bytes())
+
+An END frame has an empty payload and marks the end of the stream, so there is
+no need for a (signed) dummy block anymore.
+"""
+
+FRAME_HEADER = struct.Struct("!BBI")
+BLOCK_LEN = struct.Struct("!I")
+
+FRAME_BLOCK_BATCH = 1
+FRAME_END = 2
+
+FLAG_ZLIB = 1
+
+ENCODING_ZLIB = "zlib"
+SUPPORTED_ENCODINGS = [ENCODING_ZLIB]
+
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+MAX_BATCH_BLOCKS = 256
+COMPRESS_MIN_BYTES = 512
+
+def encode_frame(frame_type, payload=b"", compress=False):
+    """
+    Builds a frame
+
+    Args:
+        frame_type (int): one of the FRAME_* types
+        payload (bytes): the frame's payload
+        compress (bool): whether to zlib compress the payload (skipped for small payloads)
+    Returns:
+        bytes: header + payload
+    """
+    flags = 0
+    if compress and len(payload) >= COMPRESS_MIN_BYTES:
+        payload = zlib.compress(payload)
+        flags |= FLAG_ZLIB
+    return FRAME_HEADER.pack(frame_type, flags, len(payload)) + payload
+
+def decode_frame_header(header_bytes):
+    """
+    Parses a frame header
+
+    Args:
+        header_bytes (bytes): FRAME_HEADER.size bytes
+    Returns:
+        tuple: (frame type, flags, payload length)
+    """
+    frame_type, flags, length = FRAME_HEADER.unpack(header_bytes)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {length} bytes exceeds max frame size of {MAX_FRAME_SIZE} bytes")
+    return frame_type, flags, length
+
+def decode_payload(flags, payload):
+    """
+    Undoes the payload encoding given by the frame flags
+
+    Args:
+        flags (int): the frame's flags
+        payload (bytes): the payload as received
+    Returns:
+        bytes: the original payload
+    """
+    if flags & FLAG_ZLIB:
+        decompressor = zlib.decompressobj()
+        payload = decompressor.decompress(payload, MAX_FRAME_SIZE)
+        if decompressor.unconsumed_tail:
+            raise ValueError(f"Decompressed frame exceeds max frame size of {MAX_FRAME_SIZE} bytes")
+    return payload
+
+def encode_block_batch(blocks_bytes):
+    """
+    Builds a BLOCK_BATCH payload
+
+    Args:
+        blocks_bytes (bytes[]): serialized blocks
+    Returns:
+        bytes: the payload
+    """
+    parts = []
+    for block_bytes in blocks_bytes:
+        parts.append(BLOCK_LEN.pack(len(block_bytes)))
+        parts.append(block_bytes)
+    return b"".join(parts)
+
+def decode_block_batch(payload):
+    """
+    Splits a BLOCK_BATCH payload back into serialized blocks
+
+    Args:
+        payload (bytes): the (decompressed) payload
+    Returns:
+        memoryview[]: serialized blocks, as views into payload
+    """
+    view = memoryview(payload)
+    blocks_bytes = []
+    idx = 0
+    while idx < len(view):
+        (block_len,) = BLOCK_LEN.unpack_from(view, idx)
+        idx += BLOCK_LEN.size
+        if idx + block_len > len(view):
+            raise ValueError("Truncated block in batch frame")
+        blocks_bytes.append(view[idx:idx + block_len])
+        idx += block_len
+    return blocks_bytes
+
+def encode_block_stream(blocks_bytes, compress=False):
+    """
+    Packs serialized blocks into a stream of BLOCK_BATCH frames followed by an END frame
+
+    Args:
+        blocks_bytes (bytes[]): serialized blocks, in order
+        compress (bool): whether to zlib compress the batches
+    Returns:
+        bytes: all the frames
+    """
+    frames = []
+    for i in range(0, len(blocks_bytes), MAX_BATCH_BLOCKS):
+        batch = blocks_bytes[i:i + MAX_BATCH_BLOCKS]
+        frames.append(encode_frame(FRAME_BLOCK_BATCH, encode_block_batch(batch), compress))
+    frames.append(encode_frame(FRAME_END))
+    return b"".join(frames)
+
+def encode_chain(blocks, compress=False):
+    """
+    Serializes blocks as a stream of BLOCK_BATCH frames followed by an END frame
+
+    Args:
+        blocks (Block[]): the blocks to send, in order
+        compress (bool): whether to zlib compress the batches
+    Returns:
+        bytes: all the frames
+    """
+    return encode_block_stream([block.to_bytes() for block in blocks], compress)
@@ -0,0 +1,211 @@
+import itertools
+import queue
+import sys
+import threading
+import time
+
+"""
+Asynchronous, leveled logger for the peers and the tracker.
+
+Logging on a hot path (mining, validating received blocks, serving peers) only checks the level and
+puts the record on a bounded queue. A background writer thread formats the records ("%" style, so the
+arguments are only turned into strings if the record is actually written) and writes them in batches.
+When the writer can't keep up, records are dropped and counted instead of slowing the caller down,
+and the writer notes how many were dropped in the log.
+
+High-frequency events can be sampled: log.debug(func, msg, sample=100) writes one record out of every
+100 for that call site.
+
+Arguments are formatted later, on the writer thread, so pass values that won't change in the
+meantime (numbers, strings, tuples), not the chain or a queue.
+"""
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LEVEL_NAMES = {level: name.upper() for name, level in LEVELS.items()}
+
+# Records waiting to be written, more than this and new ones are dropped
+LOG_QUEUE_LEN = 10000
+# Records written per batch
+LOG_BATCH_LEN = 512
+# The file is flushed at least this often (seconds) while there is something to write, and whenever the writer goes idle
+LOG_FLUSH_INTERVAL = 0.5
+# How long close() waits for the writer to catch up
+LOG_CLOSE_TIMEOUT = 3.0
+
+def parse_level(level):
+    """
+    Args:
+        level (str | int): a level name (e.g. "debug") or value (e.g. DEBUG)
+    Returns:
+        int: the level's value
+    """
+    if isinstance(level, int):
+        return level
+    if level.lower() not in LEVELS:
+        raise ValueError(f"Unknown log level {level}, expected one of {list(LEVELS)}")
+    return LEVELS[level.lower()]
+
+class Logger:
+    """
+    Writes "{prefix}{func}: {message}" lines to a file on a background thread. Warnings and errors
+    are marked with their level ("{prefix}WARNING {func}: {message}").
+    """
+
+    def __init__(self, file=None, level=INFO, prefix="LOG ", queue_len=LOG_QUEUE_LEN):
+        """
+        Args:
+            file (file | None): where to write, stdout if None
+            level (str | int): records below this level are skipped, see LEVELS
+            prefix (str): put in front of every line
+            queue_len (int): at most this many records wait to be written, newer ones are dropped
+        """
+        self.file = file if file != None else sys.stdout
+        self.level = parse_level(level)
+        self.prefix = prefix
+        self.queue = queue.Queue(maxsize=queue_len)
+        # (func, msg) -> itertools.count, for sampled call sites (next() on it is atomic)
+        self.sample_counters = {}
+        # Records dropped because the queue was full: total, and since the writer last reported them
+        self.drop_lock = threading.Lock()
+        self.dropped = 0
+        self.unreported_drops = 0
+        self.closed = False
+
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def is_enabled(self, level):
+        """
+        Args:
+            level (int): a level, e.g. DEBUG
+        Returns:
+            bool: whether records at that level are written. Lets callers skip building expensive arguments.
+        """
+        return level >= self.level
+
+    def log(self, level, func, msg, *args, sample=None):
+        """
+        Queues a record to be written, if its level is enabled
+
+        Args:
+            level (int): the record's level
+            func (str): name of the function logging it
+            msg (str): the message, with "%" placeholders if there are args
+            args: values for the placeholders, formatted on the writer thread
+            sample (int | None): only write one out of every sample records from this call site
+        """
+        if level < self.level:
+            return
+        if sample != None and sample > 1:
+            key = (func, msg)
+            counter = self.sample_counters.get(key)
+            if counter == None:
+                counter = self.sample_counters.setdefault(key, itertools.count())
+            if next(counter) % sample != 0:
+                return
+        try:
+            self.queue.put_nowait((level, func, msg, args, sample))
+        except queue.Full:
+            with self.drop_lock:
+                self.dropped += 1
+                self.unreported_drops += 1
+
+    def debug(self, func, msg, *args, sample=None):
+        self.log(DEBUG, func, msg, *args, sample=sample)
+
+    def info(self, func, msg, *args, sample=None):
+        self.log(INFO, func, msg, *args, sample=sample)
+
+    def warning(self, func, msg, *args, sample=None):
+        self.log(WARNING, func, msg, *args, sample=sample)
+
+    def error(self, func, msg, *args, sample=None):
+        self.log(ERROR, func, msg, *args, sample=sample)
+
+    def format_record(self, record):
+        """
+        Args:
+            record (tuple): (level, func, msg, args, sample) as queued by log()
+        Returns:
+            str: the line to write, with its newline
+        """
+        level, func, msg, args, sample = record
+        try:
+            text = msg % args if len(args) > 0 else msg
+        except Exception:
+            # A bad format string shouldn't take the writer down with it
+            text = f"{msg} {args!r}"
+        parts = [self.prefix]
+        if level >= WARNING:
+            parts += [LEVEL_NAMES.get(level, str(level)), " "]
+        parts += [func, ": ", text]
+        if sample != None and sample > 1:
+            parts.append(f" (1 in {sample})")
+        parts.append("\n")
+        return "".join(parts)
+
+    def write_loop(self):
+        """
+        Runs on the writer thread, writes queued records in batches until close() is called
+        """
+        last_flush = time.monotonic()
+        while True:
+            try:
+                batch = [self.queue.get(timeout=LOG_FLUSH_INTERVAL)]
+            except queue.Empty:
+                self.flush()
+                last_flush = time.monotonic()
+                continue
+            while len(batch) < LOG_BATCH_LEN:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = []
+            with self.drop_lock:
+                unreported_drops = self.unreported_drops
+                self.unreported_drops = 0
+            if unreported_drops > 0:
+                lines.append(f"{self.prefix}WARNING Logger: dropped {unreported_drops} log records, the queue was full\n")
+            stop = False
+            for record in batch:
+                # close() queues None once everything before it is written
+                if record == None:
+                    stop = True
+                    break
+                lines.append(self.format_record(record))
+
+            try:
+                self.file.write("".join(lines))
+                if stop or self.queue.empty() or time.monotonic() - last_flush >= LOG_FLUSH_INTERVAL:
+                    self.flush()
+                    last_flush = time.monotonic()
+            except ValueError:
+                # The file was closed under us
+                return
+            if stop:
+                return
+
+    def flush(self):
+        try:
+            self.file.flush()
+        except ValueError:
+            pass
+
+    def close(self):
+        """
+        Writes out everything that's queued and stops the writer thread. Doesn't close the file.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.queue.put(None, timeout=LOG_CLOSE_TIMEOUT)
+        except queue.Full:
+            pass
+        self.thread.join(LOG_CLOSE_TIMEOUT)
@@ -0,0 +1,252 @@
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+Metrics registry for the peers and the tracker: counters, gauges and latency histograms,
+dumped in the Prometheus text format (https://prometheus.io/docs/instrumenting/exposition_formats/).
+
+A registry can be served over HTTP on localhost ("GET /metrics") and/or written to a file
+every few seconds, see MetricsRegistry.serve() and MetricsRegistry.write_periodically().
+
+Metrics can have labels (e.g. the reason a block was rejected). Label values are passed as a
+tuple in the order of the metric's label names.
+"""
+
+METRICS_ADDR = "127.0.0.1"
+METRICS_FILE_INTERVAL = 5.0
+# Seconds, from a fast signature check up to a slow chain download
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_labels(label_names, label_values, extra=None):
+    """
+    Args:
+        label_names (str[]): the metric's label names
+        label_values (tuple): a value for each label name
+        extra (tuple | None): one more (name, value) pair, e.g. a histogram bucket's "le"
+    Returns:
+        str: "{name="value",...}", empty if there are no labels
+    """
+    pairs = list(zip(label_names, label_values))
+    if extra != None:
+        pairs.append(extra)
+    if len(pairs) == 0:
+        return ""
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+class Metric:
+    """
+    Base class, a metric's values by label values
+    """
+    metric_type = None
+
+    def __init__(self, name, help_text, label_names=(), function=None):
+        """
+        Args:
+            name (str): the metric's name
+            help_text (str): what the metric measures
+            label_names (str[]): names of the metric's labels
+            function (function | None): for a value kept elsewhere (e.g. a queue's length), called whenever
+                the metrics are dumped. Returns the value, or {label values: value} for a metric with labels.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.function = function
+        self.lock = threading.Lock()
+        self.values = {}  # label values -> value
+
+    def samples(self):
+        """
+        Returns:
+            tuple[]: (name suffix, label values, extra label, value) for every sample to dump
+        """
+        if self.function != None:
+            values = self.function()
+            if not isinstance(values, dict):
+                values = {(): values}
+            return [("", label_values, None, value) for label_values, value in values.items()]
+        with self.lock:
+            return [("", label_values, None, value) for label_values, value in self.values.items()]
+
+    def to_prometheus(self):
+        """
+        Returns:
+            str: the metric's HELP, TYPE and sample lines
+        """
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        for suffix, label_values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(self.label_names, label_values, extra)} {value}")
+        return "\n".join(lines) + "\n"
+
+class Counter(Metric):
+    """
+    A count that only goes up, e.g. blocks mined
+    """
+    metric_type = "counter"
+
+    def inc(self, label_values=(), amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def get(self, label_values=()):
+        with self.lock:
+            return self.values.get(label_values, 0)
+
+class Gauge(Metric):
+    """
+    A value that goes up and down, e.g. the mempool size
+    """
+    metric_type = "gauge"
+
+    def set(self, value, label_values=()):
+        with self.lock:
+            self.values[label_values] = value
+
+class Histogram(Metric):
+    """
+    Counts observations (e.g. latencies in seconds) in buckets, with their sum and count
+    """
+    metric_type = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, label_values=()):
+        with self.lock:
+            counts = self.values.get(label_values)
+            if counts == None:
+                # One count per bucket plus +Inf, then the sum
+                counts = [0] * (len(self.buckets) + 1) + [0.0]
+                self.values[label_values] = counts
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for label_values, counts in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    samples.append(("_bucket", label_values, ("le", bound), cumulative))
+                samples.append(("_sum", label_values, None, counts[-1]))
+                samples.append(("_count", label_values, None, cumulative))
+        return samples
+
+class MetricsRegistry:
+    """
+    The metrics of a peer or the tracker
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}  # name -> Metric, in registration order
+        self.httpd = None
+        self.stop_event = threading.Event()
+
+    def register(self, metric):
+        """
+        Args:
+            metric (Metric): the metric to add, its name must be unique in the registry
+        Returns:
+            Metric: the metric
+        """
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, label_names=(), function=None):
+        return self.register(Counter(name, help_text, label_names, function))
+
+    def gauge(self, name, help_text, label_names=(), function=None):
+        return self.register(Gauge(name, help_text, label_names, function))
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, label_names, buckets))
+
+    def to_prometheus(self):
+        """
+        Returns:
+            str: every metric in the Prometheus text format
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "".join(metric.to_prometheus() for metric in metrics)
+
+    def serve(self, port):
+        """
+        Serves the metrics at "GET /metrics" on localhost, on a background thread
+
+        Args:
+            port (int): port to listen on
+        Returns:
+            threading.Thread: the server thread
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((METRICS_ADDR, port), Handler)
+        self.httpd.daemon_threads = True
+        thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def write_file(self, path):
+        """
+        Writes the metrics to a file, replacing it in one go so readers never see half of it
+
+        Args:
+            path (str): the file to write
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def write_periodically(self, path, interval=METRICS_FILE_INTERVAL):
+        """
+        Writes the metrics to a file every interval seconds (and once more on close()), on a background thread
+
+        Args:
+            path (str): the file to write
+            interval (float): seconds between writes
+        Returns:
+            threading.Thread: the writer thread
+        """
+        def write_loop():
+            while not self.stop_event.wait(interval):
+                self.write_file(path)
+            self.write_file(path)
+
+        thread = threading.Thread(target=write_loop, daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        """
+        Stops serving the metrics and writing them to a file
+        """
+        self.stop_event.set()
+        if self.httpd != None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
@@ -3,24 +3,50 @@ import socket
 import threading
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives import serialization
-from blockchain import Blockchain
-from socket_helper import SocketHelper
+from blockchain import Blockchain, find_fork_point, prefer_chain
 from block import Block
+from peer_transport import PeerTransport
+from tracker_client import TrackerClient
+from rcv_queue import ReceiveQueue
+from peer_directory import PeerDirectory, FULL_SNAPSHOT, SAMPLE_UNIFORM, SAMPLE_LATENCY, weighted_sample
+from poll_index import PollIndex
+from read_api import ReadApiServer
+from metrics import MetricsRegistry
+from logger import Logger, parse_level
+from profiler import Profiler, TimedLock
+from block_trace import BlockTracer
+import framing
 import time
-from collections import deque
+import random
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from enums import State
-from transaction import Transaction
+from transaction import Transaction, key_fingerprint
 import json
 
-MAX_QUEUED_CONNECTIONS = 5
+MAX_QUEUED_CONNECTIONS = 100
+BROADCAST_TIMEOUT = 3.0
+BROADCAST_STATS_LEN = 100
+GOSSIP_FANOUT = 3
+SEEN_BLOCKS_LEN = 4096
+BLOCK_CACHE_LEN = 256
+RECENT_TXNS_LEN = 1024
+HEARTBEAT_INTERVAL = 2.0
+HEARTBEAT_RTTS_LEN = 100
+PEER_SAMPLE_TTL = 10.0
+LATENCY_EWMA_WEIGHT = 0.3
+SIGNING_WORKERS = 4
+CHAIN_SYNC_INTERVAL = 2.0
+# Blocks that have to be on top of the one that registered our key before our transactions refer to us by fingerprint
+KEY_REFERENCE_DEPTH = 3
 
 class Peer:
-    def __init__(self, tracker_addr, tracker_port, listening_port, difficulty=4, debug=False):
+    def __init__(self, tracker_addr, tracker_port, listening_port, difficulty=4, debug=False, network=None):
         """
         The Peer is responsible for the core blockchain logic -- mining, adding new blocks to the chain,
         handling forking, etc. Upon intitialization, it starts a few different threads: a mining thread,
-        a thread to listen for new connections and serve/receive blocks, and a thread to process received
-        blocks.
+        an event loop thread (see PeerTransport) that serves/receives blocks for many connections at once,
+        and a thread to process received blocks.
 
         Args:
             tracker_addr (str): ip address of the tracker
@@ -28,16 +54,63 @@ class Peer:
             listening_port (int): this peer's port to listen for requests from
             difficulty (int): how many 0's the hash needs to start with to be consider valid
             debug (boolean): debug flag that allows some checks to be bypassed for unit-testing
+            network (TcpNetwork | None): what peer to peer connections are made over (see PeerTransport), TCP
+                on listening_port if None. The simulator passes its in-memory network.
         """
         self.listening_port = listening_port
         self.tracker_addr = tracker_addr
         self.tracker_port = tracker_port
-        self.tracker_lock = threading.Lock()
-
-        self.send_lock = threading.Lock()
-
-        self.rcv_buffer_lock = threading.Lock()
-        self.rcv_buffer = deque()
+        # Local copy of the tracker's peer directory, kept up to date by pushes, see peer_directory.py
+        self.directory = PeerDirectory()
+
+        # With peer_sample_size set, we keep a random sample of that many peers (refreshed from the
+        # tracker every PEER_SAMPLE_TTL seconds) instead of the whole directory, so our cost doesn't
+        # grow with the network. sample_weighting is one of peer_directory.SAMPLE_WEIGHTINGS.
+        self.peer_sample_size = None
+        self.sample_weighting = SAMPLE_UNIFORM
+        self.peer_sample = []
+        self.peer_sample_time = None
+        # (IP address, listening port) -> moving average of how long sending a block to the peer took
+        self.peer_latency = {}
+
+        # Heartbeats to the tracker, so it can tell when we hang or get cut off. None disables them.
+        self.heartbeat_interval = HEARTBEAT_INTERVAL
+        self.heartbeat_seq = 0
+        self.heartbeat_lock = threading.Lock()
+        self.heartbeats_sent = OrderedDict()  # seq -> time.monotonic() it was sent, waiting for a PONG
+        self.heartbeat_rtts = deque(maxlen=HEARTBEAT_RTTS_LEN)
+
+        # Broadcasts are handed to a single worker so the mining thread never waits on the network,
+        # while blocks still go out in the order they were mined
+        self.broadcast_executor = ThreadPoolExecutor(max_workers=1)
+        self.broadcast_timeout = BROADCAST_TIMEOUT
+        self.broadcast_stats = deque(maxlen=BROADCAST_STATS_LEN)
+
+        # Blocks are gossiped: announced to gossip_fanout random neighbours, who fetch the ones they
+        # haven't seen and relay them after validating. None means send every block to every peer.
+        self.gossip_fanout = GOSSIP_FANOUT
+        self.seen_lock = threading.Lock()
+        self.seen_blocks = OrderedDict()  # hash -> None, oldest first
+        self.block_cache = OrderedDict()  # hash -> block bytes, for serving GET-BLOCKS
+
+        # With compact blocks, new blocks are pushed as short transaction IDs and receivers rebuild them
+        # from transactions they already have: pending ones, plus recently seen ones that are not on our chain
+        self.compact_blocks = False
+        self.recent_txns = OrderedDict()  # signature hex -> Transaction, oldest first
+
+        # Fork resolution runs in the background, one at a time. The newest fork block that arrives
+        # while one is running is resolved next (both are only changed with the blockchain lock held).
+        self.fork_executor = ThreadPoolExecutor(max_workers=1)
+        self.fork_in_progress = threading.Event()
+        self.deferred_fork = None  # (peer IP, miner's ID, peer port, block ID)
+        # Gossip passes every block on only once, so every chain_sync_interval seconds we also ask a
+        # random neighbour for whatever it has beyond our chain, to catch up on blocks we missed.
+        # None turns it off.
+        self.chain_sync_interval = CHAIN_SYNC_INTERVAL
+        self.chain_sync_thread = threading.Thread(target=self.sync_chain)
+
+        # Bounded, drops duplicate/stale blocks before they get validated, see ReceiveQueue
+        self.rcv_buffer = ReceiveQueue()
 
         self.state_lock = threading.Lock()
         self.state = State.IDLE
@@ -45,18 +118,38 @@ class Peer:
         self.debug = debug
 
         self.log_file = open(f"{self.listening_port}_log.txt", "w")
+        # Log records are written to the log file by a background thread, see logger.py. The level
+        # can be set with the log_level config key.
+        self.log = Logger(self.log_file)
+
+        # On-demand profiling of the mining, listener and rcv buffer threads, memory snapshots and lock
+        # wait times, triggered over a control port on localhost (profile_port), see profiler.py
+        self.profiler = Profiler(str(self.listening_port))
+        self.profile_port = None
+
+        # Propagation events of every block we mine, send, receive, validate, add or relay, written to
+        # {port}_trace.jsonl with the trace_blocks config key, see block_trace.py and trace_collector.py
+        self.tracer = BlockTracer(self.listening_port)
+        self.trace_blocks = False
 
         self.shutdown_event = threading.Event()
 
-        self.listening_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.listening_sock.bind(('', listening_port))
-        self.listening_thread = threading.Thread(target=self.process_peer_connections, args=(self.listening_sock,))
+        self.listening_sock = None
+        if network == None:
+            self.listening_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listening_sock.bind(('', listening_port))
+        self.transport = PeerTransport(self, self.listening_sock, log=self.log, network=network)
+        self.listening_thread = self.transport.thread
+        self.transport.start()
+        self.profiler.add_loop("listener", self.transport.loop)
 
         self.polling_thread = threading.Thread(target=self.poll_from_rcv_buffer)
 
-        self.tracker_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.tracker_socket.connect((tracker_addr, tracker_port))
-        self.tracker_socket_helper = SocketHelper(self.tracker_socket)
+        # Requests to the tracker can be in flight from several threads at once, its tracker thread
+        # reads everything the tracker sends and hands directory pushes/heartbeat replies to us
+        self.tracker_client = TrackerClient(tracker_addr, tracker_port, self.receive_tracker_push, self.log)
+        self.tracker_thread = self.tracker_client.thread
+        self.heartbeat_thread = threading.Thread(target=self.send_heartbeats)
 
         self.private_key = rsa.generate_private_key(
             public_exponent=65537,
@@ -64,22 +157,46 @@ class Peer:
         )
 
         self.public_key = self.private_key.public_key()
+        # Our ID for the tracker and other peers, and our transactions' sender once our key is on the chain
+        self.fingerprint = key_fingerprint(self.public_key_to_bytes())
+        self.end_of_chain_msg = None
 
         self.blockchain = Blockchain()
-        self.blockchain_lock = threading.Lock()
+        self.blockchain_lock = self.profiler.add_lock("blockchain", TimedLock())
+        # Polls/votes/transactions on our chain, updated with it and read without the blockchain lock
+        self.poll_index = PollIndex()
+        # Local HTTP/JSON read API served from the poll index, see read_api.py. None disables it.
+        self.read_api_port = None
+        self.read_api = None
 
         self.txns = deque()
-        self.txn_lock = threading.Lock()
+        self.txn_lock = self.profiler.add_lock("txn", TimedLock())
+        # Signatures (hex) of our transactions that aren't on our chain yet: queued or being mined
+        self.pending_txns = set()
+        # Bulk submissions are signed in parallel (the signing itself runs outside the GIL)
+        self.signing_executor = ThreadPoolExecutor(max_workers=SIGNING_WORKERS)
+        # The mining thread waits on this until there is a transaction to mine and mining is allowed
+        self.txn_cond = threading.Condition(self.txn_lock)
 
         self.difficulty = difficulty
 
         self.mining_thread = threading.Thread(target=self.mine)
+        self.profiler.add_thread("mining")
+        self.profiler.add_thread("rcv_buffer")
+        self.profiler.add_lock("tracker", self.tracker_client.send_lock)
         
         self.tamper_freq = None
         self.tamper_type = None
         self.broadcast_freq = None
         self.curr_step = 0
 
+        # Counters, gauges and latency histograms of the hot paths, see metrics.py. They can be served
+        # on a local port (metrics_port) and/or written to a file (metrics_file) in the Prometheus format.
+        self.metrics = MetricsRegistry()
+        self.metrics_port = None
+        self.metrics_file = None
+        self.register_metrics()
+
 
     def set_configs_from_file(self, config_file):
         """
@@ -88,17 +205,112 @@ class Peer:
         Args:
             config_file (str): name of the configuration json file
         """
-        config_data = None
         with open(config_file, 'r') as f:
-            config_data = json.load(f)
-            if "tamper_freq" in config_data:
-                self.tamper_freq = config_data["tamper_freq"]
-                # print("LOG set_configs_from_file: Block tamper frequency (for testing resiliency to bad data):", str(self.tamper_freq), file=self.log_file)
-            if "broadcast_freq" in config_data:
-                self.broadcast_freq = config_data["broadcast_freq"]
-                # print("LOG set_configs_from_file: Block broadcast frequency (for testing forks):", str(self.broadcast_freq), file=self.log_file)
-            if "tamper_type" in config_data:
-                self.tamper_type = config_data["tamper_type"]
+            self.set_configs(json.load(f))
+
+    def set_configs(self, config_data):
+        """
+        Sets configs from a dictionary, with the same keys as a config file (see set_configs_from_file)
+
+        Args:
+            config_data (dict): config key -> value
+        """
+        if "tamper_freq" in config_data:
+            self.tamper_freq = config_data["tamper_freq"]
+            # self.log.info("set_configs", "Block tamper frequency (for testing resiliency to bad data): %s", self.tamper_freq)
+        if "broadcast_freq" in config_data:
+            self.broadcast_freq = config_data["broadcast_freq"]
+            # self.log.info("set_configs", "Block broadcast frequency (for testing forks): %s", self.broadcast_freq)
+        if "tamper_type" in config_data:
+            self.tamper_type = config_data["tamper_type"]
+        if "gossip_fanout" in config_data:
+            self.gossip_fanout = config_data["gossip_fanout"]
+        if "compact_blocks" in config_data:
+            self.compact_blocks = config_data["compact_blocks"]
+        if "peer_sample_size" in config_data:
+            self.peer_sample_size = config_data["peer_sample_size"]
+        if "sample_weighting" in config_data:
+            self.sample_weighting = config_data["sample_weighting"]
+        if "heartbeat_interval" in config_data:
+            self.heartbeat_interval = config_data["heartbeat_interval"]
+        if "chain_sync_interval" in config_data:
+            self.chain_sync_interval = config_data["chain_sync_interval"]
+        if "read_api_port" in config_data:
+            self.read_api_port = config_data["read_api_port"]
+        if "metrics_port" in config_data:
+            self.metrics_port = config_data["metrics_port"]
+        if "metrics_file" in config_data:
+            self.metrics_file = config_data["metrics_file"]
+        if "profile_port" in config_data:
+            self.profile_port = config_data["profile_port"]
+        if "trace_blocks" in config_data:
+            self.trace_blocks = config_data["trace_blocks"]
+        if "log_level" in config_data:
+            self.log.level = parse_level(config_data["log_level"])
+
+    def register_metrics(self):
+        """
+        Creates the peer's metrics. Values that are already kept elsewhere (queue lengths, the receive
+        queue's and tracker client's counters) are read from there whenever the metrics are dumped.
+        """
+        metrics = self.metrics
+        self.hashes_counter = metrics.counter("peer_hashes_total", "Block hashes computed while mining")
+        self.hash_rate_gauge = metrics.gauge("peer_hash_rate", "Hashes per second over the last round of mining")
+        self.blocks_mined_counter = metrics.counter("peer_blocks_mined_total", "Blocks we mined and added to our chain")
+        self.blocks_accepted_counter = metrics.counter("peer_blocks_accepted_total", "Blocks from other peers added to our chain")
+        self.blocks_rejected_counter = metrics.counter("peer_blocks_rejected_total",
+            "Blocks (received or mined) that didn't make it onto our chain, by reason", ["reason"])
+        self.forks_counter = metrics.counter("peer_fork_resolutions_total", "Fork resolutions, by outcome", ["result"])
+        self.fork_histogram = metrics.histogram("peer_fork_resolution_seconds", "Time taken to resolve a fork")
+        self.chain_syncs_counter = metrics.counter("peer_chain_syncs_total", "Periodic chain syncs with a random neighbour, by outcome", ["result"])
+        self.download_bytes_counter = metrics.counter("peer_download_bytes_total",
+            "Bytes of block frames downloaded from peers, by request (chain or announced blocks)", ["request"])
+        self.download_histogram = metrics.histogram("peer_chain_download_seconds",
+            "Time taken to download a chain (or the part of it beyond ours) from a peer")
+        self.verify_histogram = metrics.histogram("peer_block_verify_seconds", "Time taken to check a block's hash and signatures")
+        self.broadcast_histogram = metrics.histogram("peer_broadcast_seconds", "Time from handing a block off until it reached a peer")
+        self.heartbeat_histogram = metrics.histogram("peer_heartbeat_rtt_seconds", "Round trip time of heartbeats to the tracker")
+
+        metrics.gauge("peer_chain_height", "ID of the block at the tip of our chain", function=lambda: self.poll_index.get_view()["height"])
+        metrics.gauge("peer_mempool_size", "Transactions waiting to be mined", function=lambda: len(self.txns))
+        metrics.gauge("peer_rcv_buffer_depth", "Received blocks waiting to be validated", function=lambda: len(self.rcv_buffer))
+        metrics.counter("peer_rcv_buffer_dropped_total", "Received blocks dropped before validation, by reason", ["reason"],
+            function=lambda: {(key[len("dropped_"):],): count for key, count in self.rcv_buffer.stats().items() if key.startswith("dropped_")})
+        metrics.gauge("peer_directory_size", "Peers in our copy of the tracker's directory", function=lambda: len(self.directory))
+        metrics.counter("peer_port_cache_lookups_total", "Peer port lookups, by whether the tracker client had them cached", ["result"],
+            function=lambda: {("hit",): self.tracker_client.port_cache_hits, ("miss",): self.tracker_client.port_cache_misses})
+        metrics.counter("peer_lock_wait_seconds_total", "Time threads spent waiting for the peer's locks, by lock", ["lock"],
+            function=lambda: {(name,): stats["wait_time"] for name, stats in self.profiler.lock_stats().items()})
+        metrics.counter("peer_lock_contended_total", "Lock acquisitions that had to wait, by lock", ["lock"],
+            function=lambda: {(name,): stats["contended"] for name, stats in self.profiler.lock_stats().items()})
+
+    def get_state(self):
+        """
+        Returns:
+            State: the peer's current state
+        """
+        with self.state_lock:
+            return self.state
+
+    def set_state(self, state):
+        """
+        Changes the peer's state and wakes up the mining thread so it can react to it
+
+        Args:
+            state (State): the new state
+        """
+        with self.state_lock:
+            self.state = state
+        with self.txn_cond:
+            self.txn_cond.notify_all()
+
+    def wake_threads(self):
+        """
+        Wakes up the threads that are waiting for work, so they notice the shutdown event
+        """
+        self.rcv_buffer.close()
+        with self.txn_cond:
+            self.txn_cond.notify_all()
 
     def public_key_to_bytes(self):
         """
@@ -113,66 +325,224 @@ class Peer:
         )
         return public_key_bytes
 
-    def process_peer_connections(self, listening_sock):
+    def receive_block(self, block, tag, peer_ip_addr, peer_port=None):
         """
-        Listens for peer connections and serves any requests. In particular,
-        puts blocks sent by other peers on a rcv buffer that another thread pulls
-        from to try and add blocks to the chain. Also serves requests for a particular block
-        on the chain.
+        Called by the transport for every block sent by (or fetched from) other peers. Puts the block
+        on a rcv buffer that another thread pulls from to try and add blocks to the chain.
 
         Args:
-            listening_sock (socket): "server"-side socket for other peers to connect to
+            block (Block): the received block
+            tag (string): the type of block being sent (e.g. existing or new)
+            peer_ip_addr (str): IP address of the sending peer
+            peer_port (int | None): listening port of the sending peer, if known
         """
+        block_hash = str(block.hash)
+        self.mark_blocks_seen([block_hash])
+
+        queued = self.rcv_buffer.put({"type":"BLOCK", "tag":tag, "payload":block, "peer_ip_addr": peer_ip_addr, "peer_port": peer_port})
+        self.tracer.record("received", block_hash, block.id, sender=peer_port, tag=tag, queued=queued)
+        if not queued:
+            self.log.debug("receive_block", "dropped block %d (duplicate, stale or queue full)", block.id, sample=10)
+
+    def mark_blocks_seen(self, hashes):
+        """
+        Records block hashes as seen so they aren't fetched or relayed again.
+        Only the most recent SEEN_BLOCKS_LEN hashes are remembered.
+
+        Args:
+            hashes (str[]): block hashes
+        Returns:
+            str[]: the hashes that had not been seen before
+        """
+        unseen = []
+        with self.seen_lock:
+            for _hash in hashes:
+                if _hash in self.seen_blocks:
+                    continue
+                unseen.append(_hash)
+                self.seen_blocks[_hash] = None
+                if len(self.seen_blocks) > SEEN_BLOCKS_LEN:
+                    self.seen_blocks.popitem(last=False)
+        return unseen
+
+    def receive_inventory(self, hashes, peer_ip_addr, peer_port):
+        """
+        Called by the transport when a peer announces blocks. Marks the hashes we
+        haven't seen as seen (so no other announcement triggers a second fetch).
+
+        Args:
+            hashes (str[]): announced block hashes
+            peer_ip_addr (str): IP address of the announcing peer
+            peer_port (int): listening port of the announcing peer
+        Returns:
+            str[]: the hashes to fetch from the announcing peer
+        """
+        wanted = self.mark_blocks_seen(hashes)
+        self.log.debug("receive_inventory", "%s:%s announced %d blocks, fetching %d", peer_ip_addr, peer_port, len(hashes), len(wanted), sample=10)
+        return wanted
+
+    def forget_hashes(self, hashes):
+        """
+        Called by the transport when fetching announced blocks failed, so that
+        the next announcement of them is fetched again.
+
+        Args:
+            hashes (str[]): block hashes
+        """
+        with self.seen_lock:
+            for _hash in hashes:
+                self.seen_blocks.pop(_hash, None)
+
+    def cache_block(self, block_hash, block_bytes):
+        """
+        Keeps the serialized block we announced around so peers can fetch it.
+        Only the most recent BLOCK_CACHE_LEN blocks are kept.
+
+        Args:
+            block_hash (str): hash the block was announced with
+            block_bytes (bytes): serialized block
+        """
+        with self.seen_lock:
+            self.block_cache[block_hash] = block_bytes
+            if len(self.block_cache) > BLOCK_CACHE_LEN:
+                self.block_cache.popitem(last=False)
+
+    def remember_txns(self, txns):
+        """
+        Keeps transactions that aren't on our chain (e.g. from blocks dropped by a fork switch)
+        around so compact blocks that include them can be rebuilt without fetching them.
+        Only the most recent RECENT_TXNS_LEN transactions are kept.
+
+        Args:
+            txns (Transaction[]): the transactions
+        """
+        with self.seen_lock:
+            for txn in txns:
+                self.recent_txns[txn.signature.hex()] = txn
+                if len(self.recent_txns) > RECENT_TXNS_LEN:
+                    self.recent_txns.popitem(last=False)
+
+    def receive_compact_block(self, compact, peer_ip_addr, peer_port):
+        """
+        Called by the transport (on a worker thread) when a peer pushes a compact block. Looks up
+        the block's short transaction IDs among the transactions we already have, which means
+        hashing every one of them with the block's salt.
+
+        Args:
+            compact (dict): compact representation of the block, see Block.to_compact_json()
+            peer_ip_addr (str): IP address of the sending peer
+            peer_port (int): listening port of the sending peer
+        Returns:
+            Transaction[] | None: the block's transactions, None for the ones we don't have.
+                                  None if we've already seen this block
+        """
+        if len(self.mark_blocks_seen([str(compact["hash"])])) == 0:
+            return None
+
+        salt = str(compact["hash"]).encode()
+        with self.txn_lock:
+            candidates = list(self.txns)
+        with self.seen_lock:
+            candidates.extend(self.recent_txns.values())
+        known = {txn.short_id(salt): txn for txn in candidates}
+
+        txns = [known.get(short_id) for short_id in compact["short_ids"]]
+        missing = len([txn for txn in txns if txn == None])
+        self.log.debug("receive_compact_block", "block %d from %s:%s, missing %d of %d transactions", compact['id'], peer_ip_addr, peer_port, missing, len(txns))
+        return txns
+
+    def finish_compact_block(self, compact, txns, peer_ip_addr, peer_port):
+        """
+        Called by the transport once every transaction of a compact block is known.
+
+        Args:
+            compact (dict): compact representation of the block
+            txns (Transaction[]): the block's transactions, in order
+            peer_ip_addr (str): IP address of the sending peer
+            peer_port (int): listening port of the sending peer
+        """
+        self.receive_block(Block.from_compact_json(compact, txns), "NEW", peer_ip_addr, peer_port)
+
+    def get_block_txns(self, block_hash, indexes):
+        """
+        Called by the transport (on a worker thread) to serve a GET-BLOCK-TXNS request,
+        using the blocks we announced.
+
+        Args:
+            block_hash (str): hash of the block
+            indexes (int[]): indexes of the requested transactions in the block
+        Returns:
+            Transaction[]: the requested transactions, empty if we don't have the block
+        """
+        with self.seen_lock:
+            block_bytes = self.block_cache.get(block_hash)
+        if block_bytes == None:
+            return []
+
+        block = Block.from_bytes(block_bytes)
+        return [block.txns[i] for i in indexes if 0 <= i < len(block.txns)]
+
+    def serialize_blocks(self, hashes, encodings):
+        """
+        Called by the transport (on a worker thread) to serve a GET-BLOCKS request.
+        Blocks that aren't in the cache are left out.
+
+        Args:
+            hashes (str[]): requested block hashes
+            encodings (str[]): payload encodings both sides support
+        Returns:
+            bytes: batch frames followed by an END frame
+        """
+        with self.seen_lock:
+            blocks_bytes = [self.block_cache[_hash] for _hash in hashes if _hash in self.block_cache]
+        return framing.encode_block_stream(blocks_bytes, framing.ENCODING_ZLIB in encodings)
+
+    def serialize_chain(self, locator=None, encodings=None):
+        """
+        Called by the transport (on a worker thread) to serve a GET-CHAIN request. Only a
+        snapshot of the chain is taken under the blockchain lock, the serialization itself
+        happens without holding it.
+
+        Args:
+            locator (tuple[] | None): the requester's block locator. If given, only the blocks
+                                      after the highest common block are sent
+            encodings (str[] | None): if given, the chain is sent as binary frames and these are
+                                      the payload encodings both sides support (e.g. zlib)
+        Returns:
+            bytes: batch frames followed by an END frame, or for older requesters every block
+                   as a "BLOCK {len} EXIST {port}" message followed by the end of chain block
+        """
+        with self.blockchain_lock:
+            chain = self.blockchain.chain[:]
+
+        start = 0
+        if locator:
+            start = find_fork_point(chain, locator) + 1
+
+        self.log.info("serialize_chain", "serving chain of length %d from block %d", len(chain), start)
+
+        if encodings != None:
+            return framing.encode_chain(chain[start:], framing.ENCODING_ZLIB in encodings)
+
+        msgs = [self.block_to_message(block, "EXIST") for block in chain[start:]]
+        msgs.append(self.get_end_of_chain_message())
+        return b"".join(msgs)
+
+    def get_end_of_chain_message(self):
+        """
+        Builds the dummy block with an ID of -1 that older requesters expect at the end of a
+        GET-CHAIN response. It only needs to be signed once, so it is cached.
+
+        Returns:
+            bytes: the end of chain BLOCK message
+        """
+        if self.end_of_chain_msg == None:
+            fake_txn = Transaction(b"", time.time(), {})
+            fake_txn.sign(self.private_key)
+            end_block = Block(-1, [fake_txn], 0, 0, 0, time.time())
+            self.end_of_chain_msg = self.block_to_message(end_block, "EXIST")
+        return self.end_of_chain_msg
 
-        listening_sock.listen(MAX_QUEUED_CONNECTIONS)
-        # set a timeout so we can check for shutdown periodically
-        listening_sock.settimeout(1.0)
-        
-        while not self.shutdown_event.is_set():            
-            try:
-                peer_socket, addr = listening_sock.accept()
-                peer_socket_helper = SocketHelper(peer_socket)
-                print("LOG process_peer_connections: Connected to new peer.", file=self.log_file)
-                header = peer_socket_helper.get_data_until_newline().decode()
-                header_arr = header.split(' ')
-                print("LOG process_peer_connections: found header", header_arr, file=self.log_file)
-                if header_arr[0] == "BLOCK":
-                    block_len = int(header_arr[1])
-                    block_encoded = peer_socket_helper.get_n_bytes_of_data(block_len)
-                    block_builder = Block()
-                    block = block_builder.from_bytes(block_encoded)
-
-                    self.rcv_buffer_lock.acquire()
-                    self.rcv_buffer.append({"type":"BLOCK", "tag":header_arr[2], "payload":block, "peer_ip_addr": addr[0]})
-                    self.rcv_buffer_lock.release()
-                elif header_arr[0] == "GET-CHAIN":
-                    with self.blockchain_lock:
-                        for _id in range(len(self.blockchain.chain)):
-                            exist_block = self.blockchain.get_block_by_id(_id)
-                            self.send_block_to_peer(exist_block, "EXIST", peer_socket)
-
-                        fake_txn = Transaction(b"", time.time(), {})
-                        fake_txn.sign(self.private_key)
-                        end_block = Block(-1, [fake_txn], 0, 0, 0, time.time())
-
-                        self.send_block_to_peer(end_block, "EXIST", peer_socket)
-
-                        print("LOG process_peer_connections: finished sending chain of length", len(self.blockchain.chain), file=self.log_file)
-                else:
-                    print("LOG process_peer_connections: Unsupported header type", file=self.log_file)
-                
-            except socket.timeout:
-                # if just a timeout, continue and check check shutdown flag
-                continue
-            except Exception as e:
-                print(f"LOG process_peer_connections: Error in process_peer_connections (may be expected if closing): {e}", file=self.log_file)
-            finally:
-                try:
-                    peer_socket.close()
-                except:
-                    pass
-        print("LOG process_peer_connections: Listening thread terminated", file=self.log_file)
-        
     def poll_from_rcv_buffer(self):
         """
         Continuously listens for received blocks off the rcv buffer and tries to add them to the node's current chain.
@@ -180,167 +550,309 @@ class Peer:
         if it is valid and longer.
         """
         while not self.shutdown_event.is_set():
-            # To avoid throttling the CPU
-            time.sleep(0.001)
-
-            data = None
-            self.rcv_buffer_lock.acquire()
-            if len(self.rcv_buffer) > 0:
-                data = self.rcv_buffer.popleft()
-
-            self.rcv_buffer_lock.release()
+            self.profiler.checkpoint("rcv_buffer")
+            # Blocks until a block comes in, or the buffer is closed on shutdown (or for a moment while profiling)
+            data = self.rcv_buffer.get(self.profiler.wait_timeout())
 
             if data == None:
                 continue
 
             if data["type"] == "BLOCK":
-                print(f"LOG poll_from_rcv_buffer: received block (id={data['payload'].id}) data: ", data, file=self.log_file)
-
                 block = data["payload"]
                 _id = block.id
+                block_hash = str(block.hash)
+                self.log.debug("poll_from_rcv_buffer", "received %s block %d from %s:%s", data["tag"], _id, data["peer_ip_addr"], data["peer_port"])
 
-                if not block.is_valid(self.difficulty):
-                    print("LOG poll_from_rcv_buffer: received invalid block, discarding", file=self.log_file)
+                # Only the key registry entries the block needs are copied under the lock, the
+                # signatures are checked without it
+                with self.blockchain_lock:
+                    keys = self.blockchain.sender_keys(block)
+                verify_start = time.monotonic()
+                if not self.verify_block(block, keys):
+                    # A sender we only know by fingerprint may have registered its key on a branch we
+                    # don't have, but such blocks can't be checked and are cheap to make up, so they
+                    # are dropped too rather than sent to fork resolution. If that branch wins, the
+                    # chain sync (see sync_chain) brings it to us, validated in full.
+                    unknown_sender = any(txn.sender_is_fingerprint() and txn.sender not in keys for txn in block.txns)
+                    self.log.warning("poll_from_rcv_buffer", "received invalid block %d (unknown sender: %s), discarding", _id, unknown_sender)
+                    self.blocks_rejected_counter.inc(("unknown_sender" if unknown_sender else "invalid",))
+                    self.tracer.record("validated", block_hash, _id, valid=False, verify_s=time.monotonic() - verify_start)
                     continue
+                self.tracer.record("validated", block_hash, _id, valid=True, verify_s=time.monotonic() - verify_start)
 
                 with self.blockchain_lock:
                     latest_block = self.blockchain.get_latest_block()
 
                     # Hash matches and the block ID is the next expected one
                     if self.blockchain.can_add_block_to_chain(block):
-                        print(f"LOG poll_from_rcv_buffer: adding block {block.id} to chain", file=self.log_file)
+                        self.log.debug("poll_from_rcv_buffer", "adding block %d to chain", block.id)
                         self.blockchain.add_block(block)
-                        chain = [f"id: {blk.id}" for blk in self.blockchain.chain]
-                        print(f"LOG poll_from_rcv_buffer: added block, current state of blockchain: {chain}", file=self.log_file)
+                        self.rcv_buffer.set_tip(block.id)
+                        self.poll_index.update(self.blockchain.chain)
+                        self.blocks_accepted_counter.inc()
+                        self.tracer.record("added", block_hash, _id)
+                        self.log.info("poll_from_rcv_buffer", "added block %d, chain height %d", block.id, len(self.blockchain.chain) - 1)
                     
-                    # If the incoming block is valid and has more work done, potential fork
-                    elif _id >= len(self.blockchain.chain):
-                        print(f"LOG poll_from_rcv_buffer: Detected fork (new id: {str(_id)}, chain len: {len(self.blockchain.chain)}), resolving", file=self.log_file)
+                    # If the incoming block is valid and has more work done (or ties with our tip and
+                    # has the lower hash, see prefer_chain), potential fork
+                    elif _id >= len(self.blockchain.chain) or (_id == latest_block.id and block_hash < str(latest_block.hash)):
+                        self.log.info("poll_from_rcv_buffer", "Detected fork (new id: %d, chain len: %d), resolving", _id, len(self.blockchain.chain))
                         # Forking logic :)
+                        # Only one resolution runs at a time. The one in flight will most likely pick
+                        # up whatever this block is part of, if not it's resolved once that's done.
+                        if self.fork_in_progress.is_set():
+                            self.log.debug("poll_from_rcv_buffer", "fork resolution already in progress, deferring")
+                            if self.deferred_fork == None or _id > self.deferred_fork[3]:
+                                if self.deferred_fork != None:
+                                    self.blocks_rejected_counter.inc(("fork_in_progress",))
+                                self.deferred_fork = (data["peer_ip_addr"], block.txns[0].sender_fingerprint(), data["peer_port"], _id)
+                            else:
+                                self.blocks_rejected_counter.inc(("fork_in_progress",))
+
                         # Set state to wait-mode where all we are looking for are
                         # get block responses
-                        with self.state_lock:
-                            # avoid state changes during shutdown (same below)
-                            if self.shutdown_event.is_set():
-                                break
-                            self.state = State.WAITING_FOR_CHAIN
-
-                        peer_ip_addr = data["peer_ip_addr"]
-                        peer_chain = self.get_chain_from_peer(peer_ip_addr, block.txns[0].sender)
-
-                        # peer's chain is longer, so we switch to it
-                        if peer_chain != None and len(peer_chain.chain) > len(self.blockchain.chain): 
-                            self.blockchain = peer_chain
-                        with self.state_lock:
-                            if self.shutdown_event.is_set():
-                                break
-                            self.state = State.MINING
-                        
-                        chain = [f"id: {blk.id}" for blk in self.blockchain.chain]
-                        print(f"LOG poll_from_rcv_buffer: current state of blockchain: {chain}", file=self.log_file)
+                        # avoid state changes during shutdown
+                        elif not self.shutdown_event.is_set():
+                            self.set_state(State.WAITING_FOR_CHAIN)
+
+                            # Resolve the fork in the background on a snapshot of our chain so
+                            # we don't hold the blockchain lock over the network
+                            self.fork_in_progress.set()
+                            snapshot = self.blockchain.copy()
+                            self.fork_executor.submit(self.resolve_fork, data["peer_ip_addr"], block.txns[0].sender_fingerprint(), snapshot, data["peer_port"])
                     else:
-                        print("LOG poll_from_rcv_buffer: Could not add block to chain and did not detect a fork, discarding", file=self.log_file)
+                        self.log.debug("poll_from_rcv_buffer", "Could not add block %d to chain and did not detect a fork, discarding", _id)
+                        self.blocks_rejected_counter.inc(("not_extending",))
+
+                # Every valid block is passed on, not only the ones we added: one that lost the race
+                # for a height here (or that we're still resolving a fork for) may be on the chain
+                # other peers end up with, and they only hear about it through us
+                self.relay_block(block, (data["peer_ip_addr"], data["peer_port"]))
             else:
-                print("LOG poll_from_rcv_buffer: got unsupported data type, ignoring", file=self.log_file)
+                self.log.warning("poll_from_rcv_buffer", "got unsupported data type, ignoring")
 
-    def get_port_from_peer_id(self, peer_pub_id):
+    def resolve_fork(self, peer_ip_addr, peer_pub_id, snapshot, peer_port=None, sync=False):
         """
-        Retrieves the port of a peer from the tracker
+        Runs on the fork worker. Downloads the peer's chain on top of a snapshot of ours,
+        then swaps it in only if it wins over ours (see prefer_chain) and our tip is still the snapshot's tip
+        (i.e. nothing was added to or replaced on our chain in the meantime).
 
         Args:
-            peer_pub_id (bytes): the public ID of the peer
-        Returns:
-            int: listening port of the peer
+            peer_ip_addr (str): IP address of the peer that sent the block
+            peer_pub_id (bytes | None): ID (key fingerprint) of the block's miner, used to look up the port if peer_port isn't known
+            snapshot (Blockchain): copy of our chain from when the fork was detected
+            peer_port (int | None): listening port of the peer that sent the block
+            sync (bool): whether this is a periodic chain sync (see sync_chain) rather than a fork we detected
         """
-        msg = ["GET-PEER", " ", str(len(peer_pub_id)), "\n"]
-        msg_bytes = "".join(msg).encode() + peer_pub_id
-        self.tracker_lock.acquire()
+        start = time.perf_counter()
+        result = "not_longer"
+        try:
+            peer_chain = self.get_chain_from_peer(peer_ip_addr, peer_pub_id, snapshot, peer_port)
+            snapshot_tip = snapshot.get_latest_block()
 
-        self.tracker_socket.sendall(msg_bytes)
-        header_bytes = self.tracker_socket_helper.get_data_until_newline()
-        header = header_bytes.decode()
+            with self.blockchain_lock:
+                # peer's chain is longer (or as long, with a lower tip hash), so we switch to it
+                if peer_chain != None and prefer_chain(peer_chain.chain, self.blockchain.chain):
+                    if self.blockchain.get_latest_block() is snapshot_tip and len(self.blockchain.chain) == len(snapshot.chain):
+                        # Blocks that aren't part of the new chain are dropped, but their transactions
+                        # may well be in the blocks that replace them
+                        fork_id = find_fork_point(peer_chain.chain, ((blk.id, str(blk.hash)) for blk in reversed(snapshot.chain)))
+                        for blk in snapshot.chain[fork_id + 1:]:
+                            self.remember_txns(blk.txns)
+
+                        self.blockchain = peer_chain
+                        self.rcv_buffer.set_tip(len(peer_chain.chain) - 1)
+                        self.poll_index.update(peer_chain.chain)
+                        for blk in peer_chain.chain[fork_id + 1:]:
+                            self.tracer.record("added", str(blk.hash), blk.id, fork=True)
+                        # Let our neighbours know about the new tip so they can switch too
+                        self.relay_block(peer_chain.get_latest_block(), (peer_ip_addr, peer_port))
+                        result = "switched"
+                    else:
+                        self.log.info("resolve_fork", "chain tip changed while resolving, not switching")
+                        result = "tip_changed"
 
-        if header != "PEER-PORT":
-            print("LOG get_port_from_peer_id: Invalid header, expected PEER-PORT", file=self.log_file)
-            self.tracker_lock.release()
-            return None
+                self.log.info("resolve_fork", "%s, chain height %d", result, len(self.blockchain.chain) - 1)
+        except Exception as e:
+            self.log.error("resolve_fork", "failed to resolve fork: %s", e)
+            result = "failed"
+        finally:
+            if sync:
+                self.chain_syncs_counter.inc((result,))
+            else:
+                self.forks_counter.inc((result,))
+                self.fork_histogram.observe(time.perf_counter() - start)
+            if not self.resolve_deferred_fork() and not self.shutdown_event.is_set():
+                self.set_state(State.MINING)
 
-        port = self.tracker_socket_helper.get_data_until_newline()
-        print("LOG get_port_from_peer_id: got port", port, file=self.log_file)
+    def resolve_deferred_fork(self):
+        """
+        Runs on the fork worker when a resolution is done. Resolves the newest fork block that
+        arrived in the meantime next, if it's still ahead of our chain.
+
+        Returns:
+            bool: True if another resolution was started, False if fork resolution is over
+        """
+        with self.blockchain_lock:
+            deferred = self.deferred_fork
+            self.deferred_fork = None
+            if deferred != None and deferred[3] >= len(self.blockchain.chain) and not self.shutdown_event.is_set():
+                self.log.info("resolve_deferred_fork", "resolving fork block %d that arrived during the last resolution", deferred[3])
+                try:
+                    self.fork_executor.submit(self.resolve_fork, deferred[0], deferred[1], self.blockchain.copy(), deferred[2])
+                    return True
+                except RuntimeError:
+                    # The executor was shut down
+                    pass
+            elif deferred != None:
+                self.blocks_rejected_counter.inc(("fork_in_progress",))
+            self.fork_in_progress.clear()
+            return False
 
-        self.tracker_lock.release()
+    def sync_chain(self):
+        """
+        Runs on the chain sync thread. About every chain_sync_interval seconds (at random, so the peers
+        don't all sync at once) asks a random neighbour for what it has beyond our chain, the same way
+        a fork is resolved. A peer that missed blocks (e.g. it was partitioned off, or a block's
+        announcements didn't reach it) catches up this way even if nothing new is mined.
+        """
+        while not self.shutdown_event.wait(self.chain_sync_interval * random.uniform(0.5, 1.5)):
+            try:
+                nodes = self.get_known_nodes()
+            except Exception as e:
+                self.log.warning("sync_chain", "Error getting peers to sync with: %s", e)
+                continue
+            if len(nodes) == 0:
+                continue
+            node = random.choice(nodes)
 
-        if int(port) == -1:
-            return None
+            with self.blockchain_lock:
+                # A resolution that's running gets us a newer chain anyway
+                if self.fork_in_progress.is_set():
+                    continue
+                self.fork_in_progress.set()
+                snapshot = self.blockchain.copy()
+            self.log.debug("sync_chain", "syncing with %s:%s", node[0], node[1])
+            try:
+                self.fork_executor.submit(self.resolve_fork, node[0], None, snapshot, node[1], True)
+            except RuntimeError:
+                # The executor was shut down
+                with self.blockchain_lock:
+                    self.fork_in_progress.clear()
+                break
+
+    def get_port_from_peer_id(self, peer_pub_id):
+        """
+        Retrieves the port of a peer from the tracker
 
-        return int(port)
+        Args:
+            peer_pub_id (bytes): the public ID of the peer
+        Returns:
+            int: listening port of the peer (None if the tracker doesn't know it)
+        """
+        port = self.tracker_client.get_port(peer_pub_id)
+        self.log.info("get_port_from_peer_id", "got port %s", port)
+        return port
 
-    def get_chain_from_peer(self, peer_addr, peer_pub_id):
+    def get_chain_from_peer(self, peer_addr, peer_pub_id, base_chain=None, listening_port=None):
         """
         Retrieves the chain from a peer given a peer's IP address and public ID.
-        It uses the peer's public ID to get the peer's listening port from the tracker
-        so it knows where to connect to.
+        If the peer's listening port isn't known, it uses the peer's public ID to get
+        it from the tracker so it knows where to connect to.
+
+        If base_chain is given, its locator is sent along so the peer only sends the blocks
+        after our highest common block, and those are grafted onto base_chain.
 
         Args:
             peer_addr (string): IP address of the peer
             peer_pub_id (bytes): public ID of the peer
+            base_chain (Blockchain | None): our own (already validated) chain
+            listening_port (int | None): the peer's listening port, if known
         Returns:
             Blockchain: the peer's blockchain
         """
-        curr_id = 0
-        peer_chain = Blockchain()
-
-        bad_chain = False
-
-        listening_port = self.get_port_from_peer_id(peer_pub_id)
-
-        dest_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        dest_socket.connect((peer_addr, listening_port))
-        print("LOG get_chain_from_peer: Connected to peer.", file=self.log_file)
-
-        msg = ["GET-CHAIN", "\n"]
-        msg_bytes = "".join(msg).encode()
-
-        print("LOG get_chain_from_peer: Requesting block ID", str(curr_id), file=self.log_file)
+        looked_up = listening_port == None
+        if looked_up:
+            listening_port = self.get_port_from_peer_id(peer_pub_id)
+        if listening_port == None:
+            return None
 
-        dest_socket.sendall(msg_bytes)
+        locator = base_chain.get_locator() if base_chain != None else None
+        self.log.info("get_chain_from_peer", "Requesting chain")
+        blocks = self.transport.request_chain(peer_addr, listening_port, locator)
+        if blocks == None and looked_up:
+            # The port we had cached may be stale
+            self.tracker_client.invalidate_port(peer_pub_id)
+        peer_chain = self.build_candidate_chain(blocks, base_chain)
 
-        dest_socket_helper = SocketHelper(dest_socket)
+        if peer_chain != None:
+            self.log.info("get_chain_from_peer", "Got chain with length %d", len(peer_chain.chain))
+        else:
+            self.log.info("get_chain_from_peer", "Found bad chain or nothing beyond ours")
 
-        while True:
-            header = dest_socket_helper.get_data_until_newline().decode()
+        return peer_chain
 
-            if header == None:
-                bad_chain = True
-                break
+    def build_candidate_chain(self, blocks, base_chain=None):
+        """
+        Validates a list of blocks received from a peer and builds a chain out of them.
+        The per-block checks (hash, difficulty, signatures) are independent of each other,
+        so they run on the transport's worker pool; linking the blocks is done in order after.
 
-            header_arr = header.split(' ')
-            block_len = int(header_arr[1])
+        If the blocks don't start at the first block, they are the suffix after the highest
+        block the peer had in common with base_chain. The prefix of base_chain up to that point
+        has already been validated, so only the suffix is checked and then grafted onto it.
 
-            block_encoded = dest_socket_helper.get_n_bytes_of_data(block_len)
-            block_builder = Block()
-            block = block_builder.from_bytes(block_encoded)
+        Args:
+            blocks (Block[] | None): blocks received from the peer, in order
+            base_chain (Blockchain | None): our own chain to graft a suffix onto
+        Returns:
+            Blockchain | None: the candidate chain, or None if any block is bad
+        """
+        if blocks == None or len(blocks) == 0:
+            return None
 
-            if block.id == -1:
-                print("LOG get_chain_from_peer: Found end of chain.", file=self.log_file)
-                break
-            elif self.debug or (block.is_valid(difficulty=self.difficulty) and peer_chain.can_add_block_to_chain(block)):
-                print("LOG get_chain_from_peer: Added block to candidate chain", file=self.log_file)
+        peer_chain = Blockchain()
+        fork_id = blocks[0].id
+        if fork_id > 0:
+            if base_chain == None or fork_id > len(base_chain.chain):
+                return None
+            # The prefix's keys are already registered on base_chain
+            peer_chain = base_chain.copy(fork_id)
+
+        if self.debug:
+            valid = [True] * len(blocks)
+        else:
+            # Signatures of senders referred to by fingerprint are checked against the keys registered
+            # by the candidate chain. That the key was registered by an earlier block is checked when linking.
+            keys = dict(peer_chain.keys)
+            for block in blocks:
+                for txn in block.txns:
+                    if not txn.sender_is_fingerprint():
+                        keys.setdefault(key_fingerprint(txn.sender), (txn.sender, block.id))
+            valid = self.transport.run_in_workers(lambda blk: self.verify_block(blk, keys), blocks)
+
+        for block, block_valid in zip(blocks, valid):
+            if self.debug or (block_valid and peer_chain.can_add_block_to_chain(block)):
                 peer_chain.add_block(block)
             else:
-                print("LOG get_chain_from_peer: Found bad chain", file=self.log_file)
-                bad_chain = True
-                break
-
-        if not bad_chain:
-            print("LOG get_chain_from_peer: Got chain with length", len(peer_chain.chain), file=self.log_file)
+                return None
 
-        dest_socket.close()
+        return peer_chain
 
-        if bad_chain:
-            return None
+    def verify_block(self, block, keys):
+        """
+        Checks a block's hash and signatures (see Block.is_valid()) and records how long it took
 
-        return peer_chain
+        Args:
+            block (Block): the block to check
+            keys (dict): key registry of the chain the block is for
+        Returns:
+            bool: whether the block is valid
+        """
+        start = time.perf_counter()
+        valid = block.is_valid(self.difficulty, keys)
+        self.verify_histogram.observe(time.perf_counter() - start)
+        return valid
 
     def send_join_message(self):
         """
@@ -354,111 +866,244 @@ class Peer:
 
         After registration, it allows mining to start.
         """
-        join_msg = "".join(["JOIN\n", str(self.listening_port), "\n"])
-        self.tracker_socket.sendall(join_msg.encode())
-
-        id_bytes = "".join(["ID", " ", str(len(self.public_key_to_bytes())), "\n"]).encode()
-        id_bytes += self.public_key_to_bytes()
-        self.tracker_socket.sendall(id_bytes)
+        sample = None
+        if self.peer_sample_size != None:
+            # Only get a sample of the peers, which are also the ones we download the chain from
+            sample = (self.peer_sample_size, self.sample_weighting)
 
         # pick up the active peer list and get chain from all peers
-        header_bytes = self.tracker_socket_helper.get_data_until_newline()
-        header = header_bytes.decode()
-
-        if header != "PEERS":
-            print("Invalid header, expected PEERS")
+        nodes_bytes = self.tracker_client.register(self.listening_port, self.fingerprint, sample)
+        if nodes_bytes == None:
             return None
 
-        nodes_bytes = self.tracker_socket_helper.get_data_until_newline()
         nodes_serialized = nodes_bytes.decode()
         nodes = self.parse_serialized_nodes(nodes_serialized)
 
+        # Get a snapshot of the directory, later changes are pushed to us
+        if self.peer_sample_size != None:
+            self.peer_sample = nodes
+            self.peer_sample_time = time.monotonic()
+        else:
+            self.tracker_client.send(f"SYNC {FULL_SNAPSHOT}\n".encode())
+        if self.heartbeat_interval != None:
+            self.heartbeat_thread.start()
 
         # set our chain to the longest chain currently present in the network
         best_chain = Blockchain()
 
         for node in nodes:
-            curr_id = 0
-            peer_chain = Blockchain()
-            bad_chain = False
-
-            # Request chain from peer
-            dest_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            dest_socket.connect((node[0], node[1]))
-            print("LOG send_join_message: Connected to peer.", file=self.log_file)
+            # Once we have a candidate, only ask the other peers for what they have beyond it
+            self.log.info("send_join_message", "Requesting chain")
+            blocks = self.transport.request_chain(node[0], node[1], best_chain.get_locator())
+            peer_chain = self.build_candidate_chain(blocks, best_chain)
+
+            if peer_chain == None:
+                self.log.info("send_join_message", "Found bad chain or nothing beyond our candidate")
+            elif prefer_chain(peer_chain.chain, best_chain.chain):
+                best_chain = peer_chain
 
-            msg = ["GET-CHAIN", "\n"]
-            msg_bytes = "".join(msg).encode()
+        with self.blockchain_lock:
+            self.blockchain = best_chain
+            self.rcv_buffer.set_tip(len(best_chain.chain) - 1)
+            self.poll_index.update(best_chain.chain)
 
-            print("LOG send_join_message: Requesting chain", file=self.log_file)
+        if self.metrics_port != None:
+            self.metrics.serve(self.metrics_port)
+        if self.metrics_file != None:
+            self.metrics.write_periodically(self.metrics_file)
 
-            dest_socket.sendall(msg_bytes)
+        if self.profile_port != None:
+            self.profiler.serve(self.profile_port)
 
-            dest_socket_helper = SocketHelper(dest_socket)
-            while True:
-                header = dest_socket_helper.get_data_until_newline().decode()
+        if self.trace_blocks:
+            self.tracer.start(f"{self.listening_port}_trace.jsonl")
 
-                header_arr = header.split(' ')
-                block_len = int(header_arr[1])
+        if self.read_api_port != None:
+            self.read_api = ReadApiServer(self.poll_index, self.read_api_port, self.log, self.is_txn_pending)
+            self.read_api.start()
 
-                block_encoded = dest_socket_helper.get_n_bytes_of_data(block_len)
-                block_builder = Block()
-                block = block_builder.from_bytes(block_encoded)
+        self.polling_thread.start()
+        self.transport.serve(MAX_QUEUED_CONNECTIONS)
+        self.mining_thread.start()
+        if self.chain_sync_interval != None:
+            self.chain_sync_thread.start()
 
-                if block.id == -1:
-                    print("LOG send_join_message: Found end of chain.", file=self.log_file)
-                    break
+        self.set_state(State.MINING)
 
-                elif self.debug or (block.is_valid(difficulty=self.difficulty) and peer_chain.can_add_block_to_chain(block)):
-                    print("LOG send_join_message: Added block to candidate chain", file=self.log_file)
-                    peer_chain.add_block(block)
-                else:
-                    print("LOG send_join_message: Found bad chain", file=self.log_file)
-                    bad_chain = True
-                    break
+    def request_nodes_from_tracker(self):
+        """
+        Gets a list of all the nodes from the tracker in serialized form
 
-            dest_socket.close()
+        Returns:
+            str: string representing the nodes from the tracker
+        """
+        header = "".join(["LIST", " ", str(len(self.fingerprint))])
+        nodes = self.tracker_client.request(header, "PEERS", self.fingerprint)
+        if nodes == None:
+            self.log.warning("request_nodes_from_tracker", "Invalid header, expected PEERS")
+            return None
 
-            if not bad_chain and len(peer_chain.chain) > len(best_chain.chain):
-                best_chain = peer_chain
+        return nodes.decode()
 
-        with self.blockchain_lock:
-            self.blockchain = best_chain
+    def get_known_nodes(self):
+        """
+        Gets the peers to send blocks to from our copy of the tracker's directory. Falls back to
+        asking the tracker for the full list if we don't have a directory yet (e.g. the tracker
+        doesn't support SYNC).
 
-        self.polling_thread.start()
-        self.listening_thread.start()
-        self.mining_thread.start()
+        Returns:
+            tuple[]: array of tuples with format (Peer IP Address, Peer listening port)
+        """
+        if self.peer_sample_size != None:
+            return self.get_sampled_nodes()
+        if self.directory.is_synced():
+            return self.directory.nodes()
+        return self.parse_serialized_nodes(self.request_nodes_from_tracker())
 
-        with self.state_lock:
-            self.state = State.MINING
+    def get_sampled_nodes(self):
+        """
+        Gets our random sample of peers, asking the tracker for a new one if it expired
 
-    def request_nodes_from_tracker(self):
+        Returns:
+            tuple[]: array of tuples with format (Peer IP Address, Peer listening port)
         """
-        Gets a list of all the nodes from the tracker in serialized form
+        # A short sample (e.g. we were one of the first peers) is refreshed sooner
+        ttl = PEER_SAMPLE_TTL if len(self.peer_sample) >= self.peer_sample_size else PEER_SAMPLE_TTL / 10
+        if self.peer_sample_time == None or time.monotonic() - self.peer_sample_time > ttl:
+            header = ["SAMPLE", " ", str(self.peer_sample_size), " ", self.sample_weighting, " ",
+                str(len(self.fingerprint))]
+            nodes = self.tracker_client.request("".join(header), "PEERS", self.fingerprint)
+            if nodes != None:
+                self.peer_sample = self.parse_serialized_nodes(nodes.decode())
+                self.peer_sample_time = time.monotonic()
+                self.log.debug("get_sampled_nodes", "new sample of %d peers", len(self.peer_sample))
+        return self.peer_sample
+
+    def choose_neighbours(self, nodes, fanout):
+        """
+        Picks fanout of the nodes to send a block to: uniformly at random, or with SAMPLE_LATENCY
+        preferring the ones that took us the least time to send to
 
+        Args:
+            nodes (tuple[]): (IP address, listening port) of the candidates
+            fanout (int | None): how many to pick, None for all of them
         Returns:
-            str: string representing the nodes from the tracker
+            tuple[]: the picked nodes
         """
-        peer_request = "LIST\n"
-        self.tracker_lock.acquire()
+        if fanout == None or len(nodes) <= fanout:
+            return nodes
+        if self.sample_weighting != SAMPLE_LATENCY or len(self.peer_latency) == 0:
+            return random.sample(nodes, fanout)
 
-        peer_bytes = "".join(["LIST", " ", str(len(self.public_key_to_bytes())), "\n"]).encode()
-        peer_bytes += self.public_key_to_bytes()
+        # Peers we haven't sent to yet are given the average latency
+        average = sum(self.peer_latency.values()) / len(self.peer_latency)
+        weights = [1 / max(self.peer_latency.get(node, average), 1e-4) for node in nodes]
+        return weighted_sample(nodes, weights, fanout)
+
+    def record_peer_latency(self, node, latency):
+        """
+        Updates the moving average of how long it takes to send a block to a peer
 
-        self.tracker_socket.sendall(peer_bytes)
+        Args:
+            node (tuple): (IP address, listening port) of the peer
+            latency (float): seconds it took, the broadcast timeout if it failed
+        """
+        old = self.peer_latency.get(node)
+        if old == None:
+            self.peer_latency[node] = latency
+        else:
+            self.peer_latency[node] = (1 - LATENCY_EWMA_WEIGHT) * old + LATENCY_EWMA_WEIGHT * latency
 
-        header_bytes = self.tracker_socket_helper.get_data_until_newline()
-        header = header_bytes.decode()
+    def receive_tracker_push(self, header, body_bytes):
+        """
+        Handles a message the tracker sent us without us asking: DIRECTORY pushes are applied to our
+        directory (syncing again if we missed any), PONGs are replies to our heartbeats. Called from
+        the tracker thread.
 
-        if header != "PEERS":
-            print("Invalid header, expected PEERS")
-            self.tracker_lock.release()
-            return None
+        Args:
+            header (str): the message's header
+            body_bytes (bytes): the message's body
+        """
+        if header == "PONG":
+            self.receive_heartbeat_reply(int(body_bytes))
+        elif header.startswith("DIRECTORY"):
+            body = body_bytes.decode()
+            if not self.directory.apply(header, body):
+                self.log.info("receive_tracker_push", "missed directory changes, syncing again")
+                self.tracker_client.send(f"SYNC {self.directory.version}\n".encode())
+                return
+
+            self.log.debug("receive_tracker_push", "directory at %s, %d peers", header.split(' ')[2], len(self.directory))
+            # A peer that left may come back on another port
+            if header.split(' ')[1] == str(FULL_SNAPSHOT) or any(item.startswith("-") for item in body.split(' ')):
+                self.tracker_client.clear_port_cache()
+        else:
+            self.log.warning("receive_tracker_push", "unexpected message %s from the tracker", header)
+
+    def send_heartbeats(self):
+        """
+        Sends a heartbeat to the tracker every heartbeat_interval seconds until shutdown
+        """
+        while not self.shutdown_event.wait(self.heartbeat_interval):
+            if self.tracker_client.closed:
+                break
 
-        nodes = self.tracker_socket_helper.get_data_until_newline()
+            with self.heartbeat_lock:
+                self.heartbeat_seq += 1
+                self.heartbeats_sent[self.heartbeat_seq] = time.monotonic()
+                # Heartbeats that never got a reply
+                while len(self.heartbeats_sent) > HEARTBEAT_RTTS_LEN:
+                    self.heartbeats_sent.popitem(last=False)
 
-        self.tracker_lock.release()
-        return nodes.decode()
+            try:
+                self.tracker_client.send(f"PING {self.heartbeat_seq} {self.heartbeat_interval}\n".encode())
+            except OSError as e:
+                if not self.shutdown_event.is_set():
+                    self.log.warning("send_heartbeats", "Error sending heartbeat: %s", e)
+                break
+
+    def receive_heartbeat_reply(self, seq):
+        """
+        Records the round trip time of a heartbeat
+
+        Args:
+            seq (int): sequence number of the heartbeat
+        """
+        with self.heartbeat_lock:
+            sent = self.heartbeats_sent.pop(seq, None)
+            if sent == None:
+                return
+            rtt = time.monotonic() - sent
+            self.heartbeat_rtts.append(rtt)
+        self.heartbeat_histogram.observe(rtt)
+        self.log.debug("receive_heartbeat_reply", "heartbeat rtt %.2f ms", rtt * 1000, sample=10)
+
+    def get_heartbeat_stats(self):
+        """
+        Returns:
+            dict: how many heartbeats were sent and round trip times (in seconds) of the recent ones
+        """
+        with self.heartbeat_lock:
+            rtts = list(self.heartbeat_rtts)
+        return {
+            "sent": self.heartbeat_seq,
+            "rtt_samples": len(rtts),
+            "last_rtt_s": rtts[-1] if len(rtts) > 0 else None,
+            "avg_rtt_s": sum(rtts) / len(rtts) if len(rtts) > 0 else None,
+            "max_rtt_s": max(rtts) if len(rtts) > 0 else None
+        }
+
+    def get_tracker_stats(self):
+        """
+        Asks the tracker for its membership and liveness counters (e.g. how many peers it evicted)
+
+        Returns:
+            dict | None: the tracker's stats, None if the tracker didn't answer
+        """
+        stats = self.tracker_client.request("STATS", "STATS")
+        if stats == None:
+            return None
+        return json.loads(stats)
 
     def parse_serialized_nodes(self, node_str):
         """
@@ -480,103 +1125,222 @@ class Peer:
             node_arr.append( (pair[0], int(pair[1])) )
         return node_arr
 
-    def send_block_to_peer(self, block, tag, peer_socket):
+    def block_to_message(self, block, tag):
         """
-        Sends a block to a peer
+        Serializes a block into a BLOCK message, with our listening port so the receiver knows
+        where to get more from us (e.g. when the block makes it resolve a fork)
 
         Args:
             block (Block): the block to be sent
             tag (string): the type of block being sent (e.g. existing or new)
-            peer_socket (socket): the socket for the connection to othe ther peer
+        Returns:
+            bytes: the full message
         """
         block_bytes = block.to_bytes()
-        block_msg_header = ["BLOCK", " ", str(len(block_bytes)), " ", tag, "\n"]
+        block_msg_header = ["BLOCK", " ", str(len(block_bytes)), " ", tag, " ", str(self.listening_port), "\n"]
         header_bytes = "".join(block_msg_header).encode()
-        all_bytes = header_bytes + block_bytes
-        peer_socket.sendall(all_bytes)
+        return header_bytes + block_bytes
+
+    def compact_block_to_message(self, block):
+        """
+        Serializes a block into a CMPCTBLOCK message: the block's fields plus short transaction IDs
+
+        Args:
+            block (Block): the block to be sent
+        Returns:
+            bytes: the full message
+        """
+        compact_bytes = json.dumps(block.to_compact_json()).encode()
+        return f"CMPCTBLOCK {len(compact_bytes)} {self.listening_port}\n".encode() + compact_bytes
+
+    def send_block_to_peer(self, block, tag, peer_socket, compact=False):
+        """
+        Sends a block to a peer
+
+        Args:
+            block (Block): the block to be sent
+            tag (string): the type of block being sent (e.g. existing or new)
+            peer_socket (socket): the socket for the connection to othe ther peer
+            compact (bool): send a compact block (new blocks only) instead of the full block
+        """
+        if compact:
+            peer_socket.sendall(self.compact_block_to_message(block))
+        else:
+            peer_socket.sendall(self.block_to_message(block, tag))
 
     def broadcast_block_to_all_peers(self, block):
         """
-        Broadcasts a block to all of the node's peers
+        Broadcasts a block to all of the node's peers. The block is serialized right away
+        (the caller may modify the block afterwards) and the rest is done on the broadcast worker.
 
         Args:
             Block: the block to be broadcast
+        Returns:
+            Future | None: future for the broadcast stats, None if the peer is shutting down
         """
-        print(f"LOG broadcast_block_to_all_peers: broadcasting block {block.id}", file=self.log_file)
+        self.log.debug("broadcast_block_to_all_peers", "broadcasting block %d", block.id)
         
         # don't broadcast during shutdown
         if self.shutdown_event.is_set():
+            return None
+
+        start = time.monotonic()
+        if self.gossip_fanout != None:
+            compact_msg = self.compact_block_to_message(block) if self.compact_blocks else None
+            return self.broadcast_executor.submit(self.announce_block, block.id, str(block.hash), block.to_bytes(), start, None, compact_msg)
+
+        block_msg = self.block_to_message(block, "NEW")
+        return self.broadcast_executor.submit(self.send_block_message_to_peers, block.id, block_msg, start, None, None, str(block.hash))
+
+    def relay_block(self, block, exclude=None):
+        """
+        Relays a block we validated to our neighbours (gossip only), whether or not it made it onto our chain.
+
+        Args:
+            block (Block): the block to relay
+            exclude (tuple | None): (IP address, listening port) of the peer we got it from
+        """
+        if self.gossip_fanout == None or self.shutdown_event.is_set():
             return
+        self.tracer.record("relayed", str(block.hash), block.id)
+        compact_msg = self.compact_block_to_message(block) if self.compact_blocks else None
+        self.broadcast_executor.submit(self.announce_block, block.id, str(block.hash), block.to_bytes(), time.monotonic(), exclude, compact_msg)
 
-        # Get list of nodes to broadcast to
-        nodes_serialized = self.request_nodes_from_tracker()
-        nodes = self.parse_serialized_nodes(nodes_serialized)
+    def inventory_to_message(self, hashes):
+        """
+        Serializes an INV message announcing block hashes
+
+        Args:
+            hashes (str[]): block hashes
+        Returns:
+            bytes: the full message
+        """
+        hashes_bytes = " ".join(hashes).encode()
+        return f"INV {len(hashes_bytes)} {self.listening_port}\n".encode() + hashes_bytes
+
+    def announce_block(self, block_id, block_hash, block_bytes, start, exclude=None, compact_msg=None):
+        """
+        Caches a serialized block so it can be fetched and announces it to
+        gossip_fanout random neighbours, either with an INV or by pushing a compact block.
+
+        Args:
+            block_id (int): id of the block, for logging
+            block_hash (str): hash to announce the block with
+            block_bytes (bytes): the serialized block
+            start (float): time.monotonic() timestamp of when the block was handed off
+            exclude (tuple | None): (IP address, listening port) of a peer not to announce to
+            compact_msg (bytes | None): CMPCTBLOCK message to push instead of an INV
+        Returns:
+            dict: broadcast stats
+        """
+        self.cache_block(block_hash, block_bytes)
+        self.mark_blocks_seen([block_hash])
+        msg = compact_msg if compact_msg != None else self.inventory_to_message([block_hash])
+        return self.send_block_message_to_peers(block_id, msg, start, self.gossip_fanout, exclude, block_hash)
 
-        self.send_lock.acquire()
+    def send_block_message_to_peers(self, block_id, block_msg, start, fanout=None, exclude=None, block_hash=None):
+        """
+        Sends a serialized block (or announcement) to the peers the tracker knows of, concurrently,
+        and records how long it took to reach the first and the last peer.
 
+        Args:
+            block_id (int): id of the block, for logging
+            block_msg (bytes): the serialized BLOCK/INV message
+            start (float): time.monotonic() timestamp of when the block was handed off
+            fanout (int | None): only send to this many randomly picked peers, None for all of them
+            exclude (tuple | None): (IP address, listening port) of a peer not to send to
+            block_hash (str | None): hash of the block, for tracing
+        Returns:
+            dict: broadcast stats
+        """
+        stats = {"block_id": block_id, "peers": 0, "reached": 0, "first_peer_s": None, "last_peer_s": None}
         try:
-            for node in nodes:
-                try:
-                    dest_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    dest_socket.connect((node[0], node[1]))
-                    
-                    self.send_block_to_peer(block, "NEW", dest_socket)
-
-                    dest_socket.close()
-                except Exception as e:
-                    print(f"Error connecting to peer at {node[0]}:{node[1]}: {e}")
-                    try:
-                        dest_socket.close() # still gotta trying closing it
-                    except:
-                        pass
+            # Get list of nodes to broadcast to
+            nodes = self.get_known_nodes()
+            nodes = [node for node in nodes if node != exclude]
+            nodes = self.choose_neighbours(nodes, fanout)
+            results = self.transport.broadcast(nodes, block_msg, start, self.broadcast_timeout)
         except Exception as e:
-            print(f"Error during broadcast: {e}")
-        finally:
-            self.send_lock.release()
+            self.log.error("broadcast_block_to_all_peers", "Error during broadcast: %s", e)
+            return stats
+
+        latencies = []
+        for addr, port, latency, err in results:
+            if err != None:
+                self.log.warning("broadcast_block_to_all_peers", "Error connecting to peer at %s:%s: %s", addr, port, err)
+                self.record_peer_latency((addr, port), self.broadcast_timeout)
+                self.tracer.record("sent", block_hash, block_id, to=port, error=str(err))
+            else:
+                self.tracer.record("sent", block_hash, block_id, at=start + latency, to=port)
+                latencies.append(latency)
+                self.record_peer_latency((addr, port), latency)
+                self.broadcast_histogram.observe(latency)
+
+        stats["peers"] = len(results)
+        stats["reached"] = len(latencies)
+        if len(latencies) > 0:
+            stats["first_peer_s"] = min(latencies)
+            stats["last_peer_s"] = max(latencies)
+        self.broadcast_stats.append(stats)
+
+        self.log.debug("broadcast_block_to_all_peers", "broadcast stats %s", stats)
+        return stats
     
     def mine(self):
         """
-        Persistently mine for a block that contains a single transaction. Constantly
-        sniffs for a transaction to mine off a queue of pending transactions.
+        Persistently mine for a block that contains a single transaction. Sleeps until
+        there is a transaction to mine on the queue of pending transactions.
         """
         nonce = 0
         current_txn = None
         mine_id = 0
 
         while not self.shutdown_event.is_set():
-            time.sleep(0.001)
-            with self.state_lock:
-                if self.state != State.MINING:
-                    continue
+            self.profiler.checkpoint("mining")
+            with self.txn_cond:
+                # Sleep until there's something to mine and we're allowed to mine it
+                while not self.shutdown_event.is_set() and (self.get_state() != State.MINING or (len(self.txns) == 0 and not current_txn)):
+                    self.txn_cond.wait(self.profiler.wait_timeout())
+                    self.profiler.checkpoint("mining")
 
-            with self.txn_lock:
-                # No transactions to mine
-                if len(self.txns) == 0 and not current_txn:
-                    continue
+                if self.shutdown_event.is_set():
+                    break
 
                 # If no transaction is currently being mined,
                 # see if there's anything on the transaction queue
                 if not current_txn:
                     current_txn = self.txns.popleft()
-                    current_txn.timestamp = time.time()
-                    current_txn.sign(self.private_key)
             
             with self.blockchain_lock:
                 latest_block = self.blockchain.get_latest_block()
                 prev_hash = 0 if not latest_block else latest_block.hash
                 mine_id = 0 if not latest_block else latest_block.id + 1
+                mining_on = latest_block
+
+                # Transactions are mined as they were signed. One that refers to us by fingerprint can't go
+                # on a chain that doesn't have our key, which only happens if a fork switch dropped the
+                # block that registered it (see create_txns)
+                if current_txn.sender_is_fingerprint() and current_txn.sender not in self.blockchain.keys:
+                    self.log.warning("mine", "our key isn't registered on our chain anymore, dropping transaction")
+                    self.drop_pending_txns([current_txn])
+                    self.blocks_rejected_counter.inc(("sender_unregistered",))
+                    current_txn = None
+                    nonce = 0
+                    continue
             
             timestamp = time.time()
+            hashes = 0
+            hash_start = time.perf_counter()
             for _ in range(100):
                 if self.shutdown_event.is_set():
                     break
 
-                # If we discover that someone else already mined the block with our target id,
-                # then restart the mining process by adding it back to the first spot of the
-                # transaction mining queue
+                # If we discover that someone else already mined the block with our target id (or we
+                # switched to a chain of the same length), then restart the mining process by adding
+                # it back to the first spot of the transaction mining queue
                 with self.blockchain_lock:
                     latest_block = self.blockchain.get_latest_block()
-                    if latest_block and latest_block.id >= mine_id:
+                    if latest_block is not mining_on:
                         with self.txn_lock:
                             self.txns.appendleft(current_txn)
                         current_txn = None
@@ -585,29 +1349,39 @@ class Peer:
 
                 new_block = Block.mine(mine_id, [current_txn], prev_hash, nonce, timestamp, self.difficulty)
                 nonce += 1
+                hashes += 1
                 if new_block:
-                    print(f"LOG mine: found a new block {new_block.id}", file=self.log_file)
+                    self.log.debug("mine", "found a new block %d", new_block.id)
                     with self.blockchain_lock:
                         if self.blockchain.is_new_block_repeat_poll(new_block):
-                            print("LOG mine: rejecting poll creation block due to poll already existing in the chain", file=self.log_file)
+                            self.log.info("mine", "rejecting poll creation block due to poll already existing in the chain")
+                            self.drop_pending_txns([current_txn])
+                            self.blocks_rejected_counter.inc(("repeat_poll",))
                         elif self.blockchain.is_new_block_vote_for_nonexistent_poll(new_block):
-                            print("LOG mine: rejecting vote due to poll not existing on the chain")
+                            self.log.info("mine", "rejecting vote due to poll not existing on the chain")
+                            self.drop_pending_txns([current_txn])
+                            self.blocks_rejected_counter.inc(("vote_for_unknown_poll",))
                         else:
                             latest_block = self.blockchain.get_latest_block()
-                            if not latest_block or (latest_block.id+1 == mine_id):
-                                print("LOG mine: found valid block, adding to chain", file=self.log_file)
+                            if latest_block is mining_on:
+                                self.log.debug("mine", "found valid block, adding to chain")
                                 self.blockchain.add_block(new_block)
+                                self.rcv_buffer.set_tip(new_block.id)
+                                self.poll_index.update(self.blockchain.chain)
+                                self.drop_pending_txns(new_block.txns)
+                                self.blocks_mined_counter.inc()
+                                self.tracer.record("mined", str(new_block.hash), new_block.id)
 
                                 # Broadcast frequency determines how often a block is broadcast. For testing only
                                 if self.broadcast_freq == None or self.curr_step % self.broadcast_freq == 0:
-                                    print("LOG mine: broadcasting block to all peers", file=self.log_file)
+                                    self.log.debug("mine", "broadcasting block to all peers")
 
                                     # Tamper with the outgoing block, for testing modified block scenarios (and is only for testing)
                                     tampered = False
                                     if self.tamper_freq != None and self.curr_step % self.tamper_freq == 0:
                                         tampered = True
-                                        print("LOG mine: tampering with block (for testing)", file=self.log_file)
-                                        print("LOG mine: tamper type:", self.tamper_type, file=self.log_file)
+                                        self.log.info("mine", "tampering with block (for testing)")
+                                        self.log.info("mine", "tamper type: %s", self.tamper_type)
                                         tmp = None
                                         if self.tamper_type == None or self.tamper_type == "hash":
                                             tmp = new_block.hash
@@ -620,12 +1394,12 @@ class Peer:
                                             new_block.txns[0].data["poll_id"] = "ID_THAT_YOU_WILL_REALLY_IMPROBABILISTICALLY_ENTER_ON_ACCIDENT"
                                         elif self.tamper_type == "chain":
                                             if len(self.blockchain.chain) < 2:
-                                                print("LOG mine: skipping tampering with chain due to chain being too small", file=self.log_file)
+                                                self.log.info("mine", "skipping tampering with chain due to chain being too small")
                                             else:
                                                 self.blockchain.chain[1].hash = 38294329432
                                         else:
                                             tmp = new_block.hash
-                                            print("LOG mine: unsupported tamper type, defaulting to hash", file=self.log_file)
+                                            self.log.info("mine", "unsupported tamper type, defaulting to hash")
                                             new_block.hash = 12345
 
                                     # Broadcast the newly mined block to all peers
@@ -649,28 +1423,96 @@ class Peer:
                                 if self.broadcast_freq != None or self.tamper_freq != None:
                                     self.curr_step += 1
 
-                                chain_str = [f"id: {blk.id}" for blk in self.blockchain.chain]
-                                print(f"LOG mine: current state of blockchain: {chain_str}", file=self.log_file)
+                                self.log.info("mine", "mined block %d, chain height %d", new_block.id, len(self.blockchain.chain) - 1)
                             else:
                                 with self.txn_lock:
                                     self.txns.appendleft(current_txn)
+                                self.blocks_rejected_counter.inc(("mined_stale",))
                     current_txn = None
                     nonce = 0
                     break
 
+            self.hashes_counter.inc(amount=hashes)
+            elapsed = time.perf_counter() - hash_start
+            if hashes > 0 and elapsed > 0:
+                self.hash_rate_gauge.set(hashes / elapsed)
+
     def create_txn(self, data_dict):
         """
         Creates a transaction using the dictionary specified by data_dict
 
         Args:
             data_dict (dict): Some data that the user wants to send as part of a transaction
+        Returns:
+            Transaction: the signed transaction, queued for mining
+        """
+        return self.create_txns([data_dict])[0]
+
+    def create_txns(self, data_dicts):
+        """
+        Creates a transaction for each dictionary in data_dicts, signs them on the signing workers
+        and queues them for mining all at once
+
+        Args:
+            data_dicts (dict[]): data for each transaction, in the order they should be mined
+        Returns:
+            Transaction[]: the signed transactions
+        """
+        # Refer to ourselves by fingerprint if a block on our chain has our key, with enough blocks on top
+        # that a fork switch is unlikely to drop it: the sender can't change once the transaction is signed
+        with self.blockchain_lock:
+            entry = self.blockchain.keys.get(self.fingerprint)
+            registered = entry != None and len(self.blockchain.chain) - 1 - entry[1] >= KEY_REFERENCE_DEPTH
+        sender = self.fingerprint if registered else self.public_key_to_bytes()
+        txns = [Transaction(sender, time.time(), data_dict) for data_dict in data_dicts]
+
+        if len(txns) == 1:
+            txns[0].sign(self.private_key)
+        else:
+            chunk_len = -(-len(txns) // SIGNING_WORKERS)
+            futures = [self.signing_executor.submit(self.sign_txns, txns[i:i + chunk_len]) for i in range(0, len(txns), chunk_len)]
+            for future in futures:
+                future.result()
+
+        with self.txn_cond:
+            if len(txns) == 1:
+                self.log.info("create_txn", "submitted mining job %s", dict(data_dicts[0]))
+            else:
+                self.log.info("create_txns", "submitted %d mining jobs", len(txns))
+            self.txns.extend(txns)
+            self.pending_txns.update(txn.signature.hex() for txn in txns)
+            self.txn_cond.notify()
+        return txns
+
+    def sign_txns(self, txns):
+        """
+        Runs on a signing worker, signs transactions with our key
+
+        Args:
+            txns (Transaction[]): the transactions to sign
+        """
+        for txn in txns:
+            txn.sign(self.private_key)
+
+    def drop_pending_txns(self, txns):
+        """
+        Stops reporting our transactions as pending, once they're on the chain or were rejected
+
+        Args:
+            txns (Transaction[]): the transactions
         """
-        public_key_bytes = self.public_key_to_bytes()
-        txn = Transaction(public_key_bytes, time.time(), data_dict)
-        txn.sign(self.private_key)
         with self.txn_lock:
-            print(f"LOG create_txn: submitted mining job {data_dict}", file=self.log_file)
-            self.txns.append(txn)
+            for txn in txns:
+                self.pending_txns.discard(txn.signature.hex())
+
+    def is_txn_pending(self, signature_hex):
+        """
+        Args:
+            signature_hex (str): hex of a transaction's signature
+        Returns:
+            bool: whether it's one of our transactions that is waiting to be mined
+        """
+        return signature_hex in self.pending_txns
 
     def get_chain(self):
         """
@@ -688,9 +1530,8 @@ class Peer:
         Notifies the tracker that this peer is leaving the network
         """
         try:
-            with self.tracker_lock:
-                leave_msg = "LEAVE\n"
-                self.tracker_socket.sendall(leave_msg.encode())
-                print("Sent LEAVE msg to tracker")
+            leave_msg = "LEAVE\n"
+            self.tracker_client.send(leave_msg.encode())
+            self.log.info("send_leave_message", "Sent LEAVE msg to tracker")
         except Exception as e:
-            print(f"Error sending LEAVE message: {e}")
+            self.log.error("send_leave_message", "Error sending LEAVE message: %s", e)
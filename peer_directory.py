@@ -0,0 +1,175 @@
+import heapq
+import random
+import threading
+
+"""
+Versioned peer directory shared between the tracker and the peers.
+
+The tracker gives every registration a member ID and bumps its directory version on
+every JOIN/LEAVE. Peers keep a local copy of the directory and only ever ask for (or get
+pushed) what changed since the version they have, instead of the whole peer list.
+
+Wire format (tracker -> peer):
+    DIRECTORY {from version} {to version}\\n{item} {item} ...\\n
+
+A from version of -1 means a full snapshot, the items are then "{member ID}:{IP address},{Port}"
+("~{member ID}:{IP address},{Port}" for a suspect peer).
+Otherwise the items are the changes between the two versions, in order:
+    +{member ID}:{IP address},{Port}    a peer joined (or is no longer suspect)
+    ~{member ID}:{IP address},{Port}    a peer missed heartbeats and is suspect
+    -{member ID}                        a peer left or was evicted
+
+Suspect peers stay in the directory but aren't handed out by nodes().
+
+Peers ask for changes with "SYNC {version}\\n" (-1 for a full snapshot), which also subscribes
+them to DIRECTORY pushes for every later change.
+
+In large networks a peer can ask for a random sample of k peers instead of keeping the whole
+directory ("SAMPLE {k} {weighting} {no of ID bytes}\n{ID}", answered like LIST), see SAMPLE_WEIGHTINGS.
+"""
+
+FULL_SNAPSHOT = -1
+
+# "uniform": every peer is as likely to be picked
+# "fresh": peers the tracker heard from recently are more likely to be picked
+# "latency": picked uniformly by the tracker, the peer then prefers the ones it measured to be fast
+SAMPLE_UNIFORM = "uniform"
+SAMPLE_FRESH = "fresh"
+SAMPLE_LATENCY = "latency"
+SAMPLE_WEIGHTINGS = [SAMPLE_UNIFORM, SAMPLE_FRESH, SAMPLE_LATENCY]
+
+def directory_header(from_version, to_version):
+    """
+    Args:
+        from_version (int): version the items apply to, FULL_SNAPSHOT for a snapshot
+        to_version (int): version after applying the items
+    Returns:
+        str: the DIRECTORY header line, without the newline
+    """
+    return f"DIRECTORY {from_version} {to_version}"
+
+def member_item(member_id, entry):
+    """
+    Args:
+        member_id (int): the tracker's ID for the registration
+        entry (str): "{IP address},{Port}"
+    Returns:
+        str: a snapshot item
+    """
+    return f"{member_id}:{entry}"
+
+def parse_member(item):
+    """
+    Args:
+        item (str): "{member ID}:{IP address},{Port}"
+    Returns:
+        tuple: (member ID, (IP address, Port))
+    """
+    member_id, entry = item.split(':', 1)
+    addr, port = entry.rsplit(',', 1)
+    return int(member_id), (addr, int(port))
+
+def item_member_id(item):
+    """
+    Args:
+        item (str): a snapshot or change item
+    Returns:
+        int: the member ID the item is about
+    """
+    return int(item.lstrip("+~-").split(':', 1)[0])
+
+def weighted_sample(items, weights, k):
+    """
+    Picks k distinct items at random, each with probability proportional to its weight
+    (Efraimidis-Spirakis: the k items with the largest random()^(1/weight)).
+
+    Args:
+        items (list): the items to pick from
+        weights (float[]): a positive weight per item
+        k (int): how many items to pick
+    Returns:
+        list: the picked items, all of them if there are no more than k
+    """
+    if len(items) <= k:
+        return list(items)
+    keyed = ((random.random() ** (1 / weight), idx) for idx, weight in enumerate(weights))
+    return [items[idx] for _, idx in heapq.nlargest(k, keyed)]
+
+class PeerDirectory:
+    """
+    A peer's local copy of the tracker's directory, kept up to date from DIRECTORY messages
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = FULL_SNAPSHOT
+        self.members = {}  # member ID -> (IP address, listening port)
+        self.suspects = set()  # member IDs
+
+    def is_synced(self):
+        """
+        Returns:
+            bool: whether we got a snapshot from the tracker yet
+        """
+        with self.lock:
+            return self.version != FULL_SNAPSHOT
+
+    def apply(self, header, body):
+        """
+        Applies a DIRECTORY message
+
+        Args:
+            header (str): the DIRECTORY header line
+            body (str): the items line
+        Returns:
+            bool: False if the changes don't start at our version (we missed some), so we need to sync again
+        """
+        _, from_version, to_version = header.split(' ')
+        from_version = int(from_version)
+        to_version = int(to_version)
+        items = body.split(' ') if len(body) > 0 else []
+
+        with self.lock:
+            if from_version == FULL_SNAPSHOT:
+                self.members = {}
+                self.suspects = set()
+                for item in items:
+                    if item[0] == '~':
+                        member_id, node = parse_member(item[1:])
+                        self.suspects.add(member_id)
+                    else:
+                        member_id, node = parse_member(item)
+                    self.members[member_id] = node
+            elif from_version == self.version:
+                for item in items:
+                    if item[0] == '-':
+                        member_id = int(item[1:])
+                        self.members.pop(member_id, None)
+                        self.suspects.discard(member_id)
+                        continue
+
+                    member_id, node = parse_member(item[1:])
+                    self.members[member_id] = node
+                    if item[0] == '~':
+                        self.suspects.add(member_id)
+                    else:
+                        self.suspects.discard(member_id)
+            elif to_version <= self.version:
+                # Changes we already have
+                return True
+            else:
+                return False
+            self.version = to_version
+            return True
+
+    def nodes(self):
+        """
+        Returns:
+            tuple[]: (IP address, listening port) of every known peer that isn't suspect
+        """
+        with self.lock:
+            return [node for member_id, node in self.members.items() if member_id not in self.suspects]
+
+    def __len__(self):
+        with self.lock:
+            return len(self.members)
@@ -0,0 +1,282 @@
+import random
+import sys
+import threading
+import time
+
+import app
+from peer import Peer
+from tracker_load import percentile
+
+"""
+Load generator and sim file replay for peers.
+
+Starts peers in this process (registered with a running tracker, like app.py would), submits
+transactions to them on a schedule, and reports how long each transaction took from its scheduled
+submit time until it was on the chain of every driven peer, plus the sustained throughput.
+
+The schedule is computed before the run starts, so a run is repeatable: latencies are measured from
+the time a transaction was due, not from when the driver got around to submitting it, so a driver
+that falls behind shows up in the latencies instead of hiding them.
+
+Usage:
+    python3 peer_load.py {tracker addr} {tracker port} {first listening port} {difficulty} rate {num peers} {txns per sec} {duration secs} {poisson|constant} {seed}
+    python3 peer_load.py {tracker addr} {tracker port} {first listening port} {difficulty} replay {speed} {sim file} [{sim file} ...]
+
+rate: creates a poll, waits until every peer has it, then votes on it at txns per sec across the peers
+(round robin) for duration seconds. Arrivals are spaced evenly (constant) or exponentially (poisson,
+seeded so the schedule is the same every run).
+
+replay: peer i replays the i-th sim file (CREATE/VOTE/SLEEP, see app.parse_sim_file) with every SLEEP
+shortened speed times. A VOTE names its poll, which is looked up when the vote is due.
+"""
+
+# How often outstanding transactions are checked against the peers' chains
+CONFIRM_POLL_INTERVAL = 0.005
+# How long to wait for the last transactions to be confirmed after the last one was submitted
+DRAIN_TIMEOUT = 60.0
+LOAD_POLL_OPTIONS = ["a", "b", "c"]
+
+def rate_schedule(num_peers, rate, duration, arrival, seed):
+    """
+    Args:
+        num_peers (int): number of peers to spread the transactions over
+        rate (float): transactions per second
+        duration (float): seconds to submit for
+        arrival (str): "poisson" or "constant"
+        seed (int): seed for the arrival times and votes
+    Returns:
+        tuple[]: (seconds from the start, peer index, event line), in time order
+    """
+    rng = random.Random(seed)
+    events = []
+    offset = 0.0
+    while True:
+        offset += rng.expovariate(rate) if arrival == "poisson" else 1 / rate
+        if offset >= duration:
+            return events
+        option = rng.choice(LOAD_POLL_OPTIONS)
+        events.append((offset, len(events) % num_peers, f"VOTE load {option}"))
+
+def replay_schedule(sim_files, speed):
+    """
+    Args:
+        sim_files (str[]): one sim file per peer
+        speed (float): how many times faster than the SLEEPs say to replay
+    Returns:
+        tuple[]: (seconds from the start, peer index, event line), in time order
+    """
+    events = []
+    for idx, sim_file in enumerate(sim_files):
+        offset = 0.0
+        with open(sim_file, 'r') as f:
+            for line in f:
+                data_arr = line.strip().split(' ')
+                if data_arr[0] == "SLEEP":
+                    offset += float(data_arr[1]) / speed
+                elif data_arr[0] in ["CREATE", "VOTE"]:
+                    events.append((offset, idx, line.strip()))
+    # Stable, so every peer's events stay in file order
+    events.sort(key=lambda event: event[0])
+    return events
+
+class LoadDriver:
+    """
+    Submits scheduled events to the peers and tracks when their transactions are confirmed
+    """
+
+    def __init__(self, peers):
+        self.peers = peers
+        self.created = {}  # poll name -> poll ID, for polls created by this run
+        self.lock = threading.Lock()
+        self.outstanding = {}  # signature hex -> (time.perf_counter() it was due, index of the submitting peer)
+        self.confirm_latencies = []
+        self.submit_latencies = []
+        self.lost = 0  # rejected by the miner, or dropped from the chain by a fork switch
+        self.skipped = 0  # votes for polls no peer knew about when they were due
+        self.last_confirmed = None
+        self.done = threading.Event()
+        self.monitor_thread = threading.Thread(target=self.watch_confirmations)
+
+    def event_data(self, peer, line):
+        """
+        Args:
+            peer (Peer): the peer the event is submitted to
+            line (str): a CREATE or VOTE line
+        Returns:
+            dict | None: the transaction data, None for a vote on a poll we can't find
+        """
+        data_arr = line.split(' ')
+        if data_arr[0] == "CREATE":
+            poll_dict = app.create_poll_data(data_arr[1], data_arr[2:])
+            self.created[data_arr[1]] = poll_dict["poll_id"]
+            return poll_dict
+
+        # Like app.parse_sim_file, votes go to the poll on the peer's chain. Only if it isn't there (yet)
+        # do they go to the poll this run created.
+        poll = app.find_poll(peer, data_arr[1], using_id=False)
+        poll_id = poll["poll_id"] if poll != None else self.created.get(data_arr[1])
+        if poll_id == None:
+            return None
+        return app.vote_data(poll_id, data_arr[2])
+
+    def run(self, events):
+        """
+        Submits the events on schedule, then waits for their transactions to be confirmed
+
+        Args:
+            events (tuple[]): (seconds from the start, peer index, event line), in time order
+        Returns:
+            float: seconds from the start until the last confirmation (or the drain timeout)
+        """
+        self.monitor_thread.start()
+        start = time.perf_counter()
+        i = 0
+        while i < len(events):
+            delay = start + events[i][0] - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            # Everything that's due by now goes out in one batch per peer
+            now = time.perf_counter() - start
+            batches = {}
+            while i < len(events) and events[i][0] <= now:
+                offset, idx, line = events[i]
+                data_dict = self.event_data(self.peers[idx], line)
+                if data_dict == None:
+                    self.skipped += 1
+                else:
+                    batches.setdefault(idx, []).append((start + offset, data_dict))
+                i += 1
+
+            for idx, batch in batches.items():
+                submit_start = time.perf_counter()
+                txns = self.peers[idx].create_txns([data_dict for _, data_dict in batch])
+                submitted = time.perf_counter()
+                with self.lock:
+                    for (due, _), txn in zip(batch, txns):
+                        self.outstanding[txn.signature.hex()] = (due, idx)
+                        self.submit_latencies.append((submitted - submit_start) / len(batch))
+
+        deadline = time.perf_counter() + DRAIN_TIMEOUT
+        while time.perf_counter() < deadline:
+            with self.lock:
+                if len(self.outstanding) == 0:
+                    break
+            time.sleep(CONFIRM_POLL_INTERVAL)
+        self.done.set()
+        self.monitor_thread.join()
+
+        end = self.last_confirmed if self.last_confirmed != None else time.perf_counter()
+        return end - start
+
+    def watch_confirmations(self):
+        """
+        Runs on the monitor thread, records when outstanding transactions are on every peer's chain
+        """
+        while not self.done.is_set():
+            time.sleep(CONFIRM_POLL_INTERVAL)
+            views = [peer.poll_index.get_view() for peer in self.peers]
+            with self.lock:
+                outstanding = list(self.outstanding.items())
+            now = time.perf_counter()
+
+            for sig, (due, idx) in outstanding:
+                if all(sig in view["txns"] for view in views):
+                    with self.lock:
+                        del self.outstanding[sig]
+                        self.confirm_latencies.append(now - due)
+                        self.last_confirmed = now
+                elif not self.peers[idx].is_txn_pending(sig) and sig not in self.peers[idx].poll_index.get_view()["txns"]:
+                    with self.lock:
+                        del self.outstanding[sig]
+                        self.lost += 1
+
+    def report(self, elapsed):
+        print(f"{'':<9} {'count':>9} {'per sec':>10} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for name, latencies in [("submit", self.submit_latencies), ("confirm", self.confirm_latencies)]:
+            latencies.sort()
+            print(f"{name:<9} {len(latencies):>9} {len(latencies) / elapsed:>10.1f}"
+                f" {percentile(latencies, 50) * 1000:>8.2f} {percentile(latencies, 90) * 1000:>8.2f}"
+                f" {percentile(latencies, 99) * 1000:>8.2f} {percentile(latencies, 100) * 1000:>8.2f}")
+        print(f"sustained throughput: {len(self.confirm_latencies) / elapsed:.1f} txns/s over {elapsed:.2f}s")
+        print(f"unconfirmed: {len(self.outstanding)}, lost: {self.lost}, skipped: {self.skipped}")
+
+def start_peers(tracker_addr, tracker_port, first_port, num_peers, difficulty):
+    peers = []
+    for i in range(num_peers):
+        peer = Peer(tracker_addr, tracker_port, first_port + i, difficulty)
+        peer.send_join_message()
+        peers.append(peer)
+    return peers
+
+def wait_for_directory(peers, timeout=DRAIN_TIMEOUT):
+    """
+    Waits until every peer knows all the other peers, so the first blocks reach everyone. Peers with
+    peer_sample_size set only keep a sample of the others (refreshed while it's short), so for them
+    that's a full sample.
+
+    Returns:
+        bool: whether all the peers knew enough of the others in time
+    """
+    def knows_enough(peer):
+        if peer.peer_sample_size == None:
+            return len(peer.directory.nodes()) >= len(peers) - 1
+        return len(peer.get_known_nodes()) >= min(peer.peer_sample_size, len(peers) - 1)
+
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if all(knows_enough(peer) for peer in peers):
+            return True
+        time.sleep(CONFIRM_POLL_INTERVAL)
+    return False
+
+def wait_for_poll(peers, poll_id, timeout=DRAIN_TIMEOUT):
+    """
+    Returns:
+        bool: whether the poll made it onto every peer's chain in time
+    """
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if all(poll_id in peer.poll_index.get_view()["polls"] for peer in peers):
+            return True
+        time.sleep(CONFIRM_POLL_INTERVAL)
+    return False
+
+if __name__ == '__main__':
+    tracker_addr = sys.argv[1]
+    tracker_port = int(sys.argv[2])
+    first_port = int(sys.argv[3])
+    difficulty = int(sys.argv[4])
+    mode = sys.argv[5]
+
+    if mode == "rate":
+        num_peers = int(sys.argv[6])
+        events = rate_schedule(num_peers, float(sys.argv[7]), float(sys.argv[8]), sys.argv[9], int(sys.argv[10]))
+    elif mode == "replay":
+        sim_files = sys.argv[7:]
+        num_peers = len(sim_files)
+        events = replay_schedule(sim_files, float(sys.argv[6]))
+    else:
+        print(f"Unsupported mode {mode}, expected rate or replay")
+        sys.exit(1)
+
+    peers = start_peers(tracker_addr, tracker_port, first_port, num_peers, difficulty)
+    driver = LoadDriver(peers)
+    try:
+        if not wait_for_directory(peers):
+            print("Not every peer heard about the others from the tracker")
+            sys.exit(1)
+
+        if mode == "rate":
+            poll = app.create_poll(peers[0], "load", LOAD_POLL_OPTIONS)
+            driver.created["load"] = poll.data["poll_id"]
+            if not wait_for_poll(peers, poll.data["poll_id"]):
+                print("The load poll didn't make it onto every peer's chain")
+                sys.exit(1)
+
+        print(f"Submitting {len(events)} transactions to {num_peers} peers")
+        elapsed = driver.run(events)
+        driver.report(elapsed)
+    finally:
+        for peer in peers:
+            app.shutdown(peer)
@@ -0,0 +1,451 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from block import Block
+from blockchain import Blockchain
+from transaction import Transaction
+import framing
+from logger import Logger
+
+READ_TIMEOUT = 10.0
+CONNECT_TIMEOUT = 3.0
+SEND_TIMEOUT = 5.0
+MAX_WORKERS = 4
+
+def decode_block_batch_frame(flags, payload):
+    """
+    Decompresses a BLOCK_BATCH frame payload and rebuilds its blocks, run on the worker pool.
+
+    Args:
+        flags (int): the frame's flags
+        payload (bytes): the frame's payload as received
+    Returns:
+        Block[]: the blocks in the frame
+    """
+    payload = framing.decode_payload(flags, payload)
+    return [Block.from_bytes(block_bytes) for block_bytes in framing.decode_block_batch(payload)]
+
+class TcpNetwork:
+    """
+    The network PeerTransport connects to other peers over by default: TCP, via asyncio streams.
+    Another network (e.g. the simulator's in-memory one, see simulator.py) only has to provide
+    the same two coroutines.
+    """
+
+    async def start_server(self, handler, listening_sock, listening_port, backlog):
+        """
+        Args:
+            handler (coroutine function): called with (reader, writer) for every inbound connection
+            listening_sock (socket): the bound listening socket
+            listening_port (int): the port it's bound to
+            backlog (int): size of the kernel's accept queue
+        Returns:
+            asyncio.Server: the server, with a close() method
+        """
+        return await asyncio.start_server(handler, sock=listening_sock, backlog=backlog)
+
+    async def open_connection(self, addr, port, local_port):
+        """
+        Args:
+            addr (str): IP address of the peer to connect to
+            port (int): its listening port
+            local_port (int): our listening port
+        Returns:
+            tuple: (asyncio.StreamReader, asyncio.StreamWriter)
+        """
+        return await asyncio.open_connection(addr, port)
+
+class PeerTransport:
+    """
+    Event-loop based transport for peer to peer traffic.
+
+    A single asyncio loop runs on its own thread and multiplexes every inbound and
+    outbound peer connection, so a slow GET-CHAIN client or a peer that never finishes
+    its header no longer stalls other connections. Anything CPU heavy (decoding blocks,
+    serializing the chain, validating candidate chains) is pushed onto a worker pool so
+    the loop itself only moves bytes.
+
+    The wire format is the same as before:
+        "BLOCK {no of block bytes} {tag} {listening port}\\n{block bytes}" and "GET-CHAIN\\n"
+    (the listening port was added later, BLOCK messages without it are still accepted)
+    plus a GET-CHAIN that carries a block locator so only the missing suffix is sent back:
+        "GET-CHAIN {no of locator bytes}\\n{locator bytes}"
+    and one that also asks for the chain as binary frames (see framing.py), listing the
+    payload encodings the requester supports (currently only zlib):
+        "GET-CHAIN {no of locator bytes} FRAMES {encoding},{encoding}...\\n{locator bytes}"
+
+    Blocks are relayed by gossip with two more requests. A peer announces the hashes of
+    blocks it has with an inventory message (including its listening port so it can be
+    asked for them), and the receiver fetches the ones it hasn't seen yet (answered with
+    frames, like GET-CHAIN):
+        "INV {no of hash bytes} {listening port}\\n{hash} {hash}..."
+        "GET-BLOCKS {no of hash bytes} {encoding},{encoding}...\\n{hash} {hash}..."
+
+    With compact blocks turned on, new blocks are pushed as the block's fields plus short
+    transaction IDs instead. The receiver rebuilds the block from transactions it already
+    has and only asks the sender for the ones it's missing:
+        "CMPCTBLOCK {no of bytes} {listening port}\\n{compact block json}"
+        "GET-BLOCK-TXNS {no of bytes}\\n{"hash": block hash, "indexes": [missing txn indexes]}"
+    answered with "BLOCK-TXNS {no of bytes}\\n{json array of transactions}".
+
+    The transport does not know anything about the blockchain itself, it calls back
+    into the peer with:
+        peer.receive_block(block, tag, peer_ip_addr, peer_port) -- for an inbound block
+        peer.serialize_chain(locator, encodings)    -- bytes to answer a GET-CHAIN request
+        peer.receive_inventory(hashes, peer_ip_addr, peer_port) -- hashes we should fetch
+        peer.forget_hashes(hashes)                  -- fetching those hashes failed
+        peer.serialize_blocks(hashes, encodings)    -- bytes to answer a GET-BLOCKS request
+        peer.receive_compact_block(compact, peer_ip_addr, peer_port) -- known txns of a compact block
+        peer.finish_compact_block(compact, txns, peer_ip_addr, peer_port) -- all txns are in
+        peer.get_block_txns(block_hash, indexes)    -- transactions to answer GET-BLOCK-TXNS
+    """
+
+    def __init__(self, peer, listening_sock, max_workers=MAX_WORKERS, read_timeout=READ_TIMEOUT,
+                 connect_timeout=CONNECT_TIMEOUT, log=None, network=None):
+        """
+        Args:
+            peer (Peer): the peer whose callbacks serve inbound requests
+            listening_sock (socket | None): bound "server"-side socket for other peers to connect to, None if the network doesn't use one
+            max_workers (int): number of worker threads for CPU heavy work
+            read_timeout (float): seconds a connection may take to send its next header/body
+            connect_timeout (float): seconds to wait when connecting to another peer
+            log (Logger | None): where to log, a Logger on stdout if None
+            network (TcpNetwork | None): what connections are made over, TCP if None
+        """
+        self.peer = peer
+        self.listening_sock = listening_sock
+        self.read_timeout = read_timeout
+        self.connect_timeout = connect_timeout
+        self.log = log if log != None else Logger()
+        self.network = network if network != None else TcpNetwork()
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, daemon=True)
+        self.server = None
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        self.log.info("PeerTransport", "event loop terminated")
+
+    def start(self):
+        """
+        Starts the event loop thread. Outbound calls can be made once this returns,
+        inbound connections are only accepted after serve() is called.
+        """
+        self.thread.start()
+
+    def serve(self, backlog=100):
+        """
+        Starts accepting peer connections on the listening socket.
+
+        Args:
+            backlog (int): size of the kernel's accept queue
+        """
+        async def start_server():
+            self.server = await self.network.start_server(
+                self._handle_connection, self.listening_sock, self.peer.listening_port, backlog)
+
+        self.submit(start_server()).result()
+
+    def stop(self):
+        """
+        Stops accepting connections, stops the event loop and the worker pool.
+        """
+        if not self.thread.is_alive():
+            return
+
+        async def close_server():
+            if self.server != None:
+                self.server.close()
+
+        try:
+            self.submit(close_server()).result(self.connect_timeout)
+        except Exception as e:
+            self.log.warning("PeerTransport", "error closing server: %s", e)
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=False)
+
+    def submit(self, coro):
+        """
+        Schedules a coroutine on the event loop from any other thread.
+
+        Args:
+            coro (coroutine): the coroutine to run
+        Returns:
+            concurrent.futures.Future: future for the coroutine's result
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run_in_workers(self, fn, items):
+        """
+        Runs fn over every item on the worker pool, used for CPU heavy work
+        such as block validation. Blocks the calling thread until all results are in.
+
+        Args:
+            fn (function): function to apply
+            items (list): inputs to fn
+        Returns:
+            list: fn(item) for every item, in order
+        """
+        return list(self.executor.map(fn, items))
+
+    async def _read_header(self, reader):
+        header_bytes = await asyncio.wait_for(reader.readline(), self.read_timeout)
+        if not header_bytes or not header_bytes.endswith(b'\n'):
+            return None
+        return header_bytes[:-1].decode()
+
+    async def _read_block(self, reader, block_len):
+        block_encoded = await asyncio.wait_for(reader.readexactly(block_len), self.read_timeout)
+        return await self.loop.run_in_executor(self.executor, Block.from_bytes, block_encoded)
+
+    async def _read_hashes(self, reader, hashes_len):
+        hashes_bytes = await asyncio.wait_for(reader.readexactly(hashes_len), self.read_timeout)
+        return [_hash for _hash in hashes_bytes.decode().split(' ') if len(_hash) > 0]
+
+    async def _read_json(self, reader, json_len):
+        json_bytes = await asyncio.wait_for(reader.readexactly(json_len), self.read_timeout)
+        return json.loads(json_bytes)
+
+    async def _read_block_frames(self, reader, request):
+        """
+        Reads BLOCK_BATCH frames until the END frame.
+
+        Args:
+            reader (asyncio.StreamReader): the connection to read from
+            request (str): "chain" or "blocks", what the blocks were requested with (for the peer's metrics)
+        Returns:
+            Block[] | None: the blocks in order, or None on an unexpected frame
+        """
+        blocks = []
+        while True:
+            header_bytes = await asyncio.wait_for(reader.readexactly(framing.FRAME_HEADER.size), self.read_timeout)
+            frame_type, flags, length = framing.decode_frame_header(header_bytes)
+            payload = await asyncio.wait_for(reader.readexactly(length), self.read_timeout)
+            self.peer.download_bytes_counter.inc((request,), len(header_bytes) + length)
+
+            if frame_type == framing.FRAME_END:
+                return blocks
+            elif frame_type == framing.FRAME_BLOCK_BATCH:
+                blocks.extend(await self.loop.run_in_executor(self.executor, decode_block_batch_frame, flags, payload))
+            else:
+                self.log.warning("PeerTransport", "unexpected frame type %s", frame_type)
+                return None
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Serves exactly one request on an inbound connection, like the old listening thread did,
+        except that many of these run at the same time.
+        """
+        addr = writer.get_extra_info('peername')
+        try:
+            header = await self._read_header(reader)
+            if header == None:
+                return
+            header_arr = header.split(' ')
+            self.log.debug("process_peer_connections", "found header %s", header_arr)
+
+            if header_arr[0] == "BLOCK":
+                block = await self._read_block(reader, int(header_arr[1]))
+                peer_port = int(header_arr[3]) if len(header_arr) > 3 else None
+                self.peer.receive_block(block, header_arr[2], addr[0], peer_port)
+            elif header_arr[0] == "INV":
+                hashes = await self._read_hashes(reader, int(header_arr[1]))
+                peer_port = int(header_arr[2])
+                wanted = self.peer.receive_inventory(hashes, addr[0], peer_port)
+                if len(wanted) > 0:
+                    # Fetch on a new connection so this one (and the announcer) isn't held up
+                    self.loop.create_task(self._fetch_blocks(addr[0], peer_port, wanted))
+            elif header_arr[0] == "CMPCTBLOCK":
+                compact = await self._read_json(reader, int(header_arr[1]))
+                peer_port = int(header_arr[2])
+                # Hashes our whole mempool, so it's done on a worker
+                txns = await self.loop.run_in_executor(self.executor, self.peer.receive_compact_block, compact, addr[0], peer_port)
+                if txns != None:
+                    self.loop.create_task(self._complete_compact_block(addr[0], peer_port, compact, txns))
+            elif header_arr[0] == "GET-BLOCK-TXNS":
+                request = await self._read_json(reader, int(header_arr[1]))
+                txns = await self.loop.run_in_executor(self.executor, self.peer.get_block_txns, request["hash"], request["indexes"])
+                txns_bytes = json.dumps([txn.to_json() for txn in txns]).encode()
+                writer.write(f"BLOCK-TXNS {len(txns_bytes)}\n".encode() + txns_bytes)
+                await asyncio.wait_for(writer.drain(), self.read_timeout)
+            elif header_arr[0] == "GET-BLOCKS":
+                hashes = await self._read_hashes(reader, int(header_arr[1]))
+                requested = header_arr[2].split(',') if len(header_arr) > 2 else []
+                encodings = [enc for enc in requested if enc in framing.SUPPORTED_ENCODINGS]
+                blocks_bytes = await self.loop.run_in_executor(self.executor, self.peer.serialize_blocks, hashes, encodings)
+                writer.write(blocks_bytes)
+                await asyncio.wait_for(writer.drain(), self.read_timeout)
+            elif header_arr[0] == "GET-CHAIN":
+                locator = None
+                if len(header_arr) > 1:
+                    locator_bytes = await asyncio.wait_for(reader.readexactly(int(header_arr[1])), self.read_timeout)
+                    locator = Blockchain.locator_from_bytes(locator_bytes)
+
+                # None means the requester wants the old BLOCK messages instead of frames
+                encodings = None
+                if len(header_arr) > 2 and header_arr[2] == "FRAMES":
+                    requested = header_arr[3].split(',') if len(header_arr) > 3 else []
+                    encodings = [enc for enc in requested if enc in framing.SUPPORTED_ENCODINGS]
+
+                chain_bytes = await self.loop.run_in_executor(self.executor, self.peer.serialize_chain, locator, encodings)
+                writer.write(chain_bytes)
+                await asyncio.wait_for(writer.drain(), self.read_timeout)
+            else:
+                self.log.warning("process_peer_connections", "Unsupported header type")
+        except asyncio.TimeoutError:
+            self.log.info("process_peer_connections", "peer at %s timed out, dropping connection", addr)
+        except Exception as e:
+            self.log.warning("process_peer_connections", "Error serving peer at %s: %s", addr, e)
+        finally:
+            writer.close()
+
+    async def _open_connection(self, addr, port):
+        return await self.network.open_connection(addr, port, self.peer.listening_port)
+
+    async def _send(self, addr, port, data):
+        reader, writer = await asyncio.wait_for(self._open_connection(addr, port), self.connect_timeout)
+        try:
+            writer.write(data)
+            await asyncio.wait_for(writer.drain(), self.read_timeout)
+        finally:
+            writer.close()
+
+    def send_message(self, addr, port, data):
+        """
+        Opens a connection to a peer, sends data and closes the connection.
+        Raises on connection errors or timeouts.
+
+        Args:
+            addr (str): IP address of the peer
+            port (int): listening port of the peer
+            data (bytes): the full message
+        """
+        self.submit(self._send(addr, port, data)).result()
+
+    async def _timed_send(self, addr, port, data, start, timeout):
+        try:
+            await asyncio.wait_for(self._send(addr, port, data), timeout)
+            return (addr, port, time.monotonic() - start, None)
+        except Exception as e:
+            return (addr, port, None, e)
+
+    async def _broadcast(self, nodes, data, start, timeout):
+        return await asyncio.gather(*[self._timed_send(node[0], node[1], data, start, timeout) for node in nodes])
+
+    def broadcast(self, nodes, data, start=None, timeout=SEND_TIMEOUT):
+        """
+        Sends the same message to every node concurrently. Each peer gets its own timeout
+        (covering connect + send), so one unreachable peer can't hold up the others.
+
+        Args:
+            nodes (tuple[]): array of (Peer IP Address, Peer listening port)
+            data (bytes): the full message
+            start (float): time.monotonic() timestamp latencies are measured from, defaults to now
+            timeout (float): per peer timeout in seconds
+        Returns:
+            tuple[]: (addr, port, seconds to reach the peer or None, exception or None) per node
+        """
+        if start == None:
+            start = time.monotonic()
+        return self.submit(self._broadcast(nodes, data, start, timeout)).result()
+
+    async def _request_chain(self, addr, port, locator):
+        reader, writer = await asyncio.wait_for(self._open_connection(addr, port), self.connect_timeout)
+        try:
+            locator_bytes = Blockchain.locator_to_bytes(locator) if locator else b""
+            encodings = ",".join(framing.SUPPORTED_ENCODINGS)
+            writer.write(f"GET-CHAIN {len(locator_bytes)} FRAMES {encodings}\n".encode() + locator_bytes)
+            await writer.drain()
+            return await self._read_block_frames(reader, "chain")
+        finally:
+            writer.close()
+
+    def request_chain(self, addr, port, locator=None):
+        """
+        Requests the chain from a peer. Without a locator the full chain is sent, with one
+        the peer only sends the blocks after the highest block it has in common with us.
+
+        Args:
+            addr (str): IP address of the peer
+            port (int): listening port of the peer
+            locator (tuple[] | None): our block locator, see Blockchain.get_locator()
+        Returns:
+            Block[] | None: the peer's blocks in order, or None if the transfer broke off
+        """
+        start = time.perf_counter()
+        try:
+            blocks = self.submit(self._request_chain(addr, port, locator)).result()
+            self.peer.download_histogram.observe(time.perf_counter() - start)
+            return blocks
+        except Exception as e:
+            self.log.warning("request_chain", "failed to get chain from %s:%s: %s", addr, port, e)
+            return None
+
+    async def _fetch_blocks(self, addr, port, hashes):
+        """
+        Fetches announced blocks from the peer that announced them and hands them to the peer.
+        """
+        try:
+            reader, writer = await asyncio.wait_for(self._open_connection(addr, port), self.connect_timeout)
+            try:
+                hashes_bytes = " ".join(hashes).encode()
+                encodings = ",".join(framing.SUPPORTED_ENCODINGS)
+                writer.write(f"GET-BLOCKS {len(hashes_bytes)} {encodings}\n".encode() + hashes_bytes)
+                await writer.drain()
+                blocks = await self._read_block_frames(reader, "blocks")
+            finally:
+                writer.close()
+        except Exception as e:
+            self.log.warning("PeerTransport", "failed to fetch blocks from %s:%s: %s", addr, port, e)
+            blocks = None
+
+        if blocks == None:
+            self.peer.forget_hashes(hashes)
+            return
+
+        fetched = set()
+        for block in blocks:
+            fetched.add(str(block.hash))
+            self.peer.receive_block(block, "NEW", addr, port)
+
+        # Let the hashes the peer didn't have be announced again
+        missing = [_hash for _hash in hashes if _hash not in fetched]
+        if len(missing) > 0:
+            self.peer.forget_hashes(missing)
+
+    async def _complete_compact_block(self, addr, port, compact, txns):
+        """
+        Fetches the transactions of a compact block that we don't have from the peer
+        that sent it, then hands the rebuilt block to the peer.
+        """
+        missing = [i for i in range(len(txns)) if txns[i] == None]
+        if len(missing) > 0:
+            try:
+                reader, writer = await asyncio.wait_for(self._open_connection(addr, port), self.connect_timeout)
+                try:
+                    request_bytes = json.dumps({"hash": compact["hash"], "indexes": missing}).encode()
+                    writer.write(f"GET-BLOCK-TXNS {len(request_bytes)}\n".encode() + request_bytes)
+                    await writer.drain()
+                    header = await self._read_header(reader)
+                    if header == None or header.split(' ')[0] != "BLOCK-TXNS":
+                        raise ValueError(f"unexpected response {header}")
+                    txn_dicts = await self._read_json(reader, int(header.split(' ')[1]))
+                finally:
+                    writer.close()
+                if len(txn_dicts) != len(missing):
+                    raise ValueError(f"asked for {len(missing)} transactions, got {len(txn_dicts)}")
+            except Exception as e:
+                self.log.warning("PeerTransport", "failed to fetch block transactions from %s:%s: %s", addr, port, e)
+                self.peer.forget_hashes([str(compact["hash"])])
+                return
+
+            for i, txn_dict in zip(missing, txn_dicts):
+                txns[i] = Transaction.from_json(txn_dict)
+
+        self.peer.finish_compact_block(compact, txns, addr, port)
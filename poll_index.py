@@ -0,0 +1,225 @@
+import weakref
+from collections.abc import Mapping
+
+"""
+In-memory index of the polls, votes and transactions on a peer's chain, for the read API.
+
+The peer updates the index whenever its chain changes (a block is added or the chain is swapped
+for a longer one), while it holds the blockchain lock. Every update publishes a new, immutable
+view of the index, so readers just grab the current view without taking any lock and never
+slow down mining or block processing.
+
+Publishing a view doesn't copy anything either. The polls and results dicts are copied on write
+instead: the first change an update makes to a published dict (or to a poll's counts) copies it,
+so views share everything the update didn't touch. The block each transaction is in is looked up
+in a map that's only added to while views may read it (see TxnBlocks), so an update costs the same
+however many transactions and polls are on the chain.
+"""
+
+class TxnBlocks(Mapping):
+    """
+    A view's transaction signature hex -> block ID map. Reads the index's placements (the blocks a
+    transaction was added in) and checks them against the view's chain, instead of copying them.
+    """
+
+    def __init__(self, placements, blocks, height, fork_count):
+        """
+        Args:
+            placements (dict): signature hex -> ((block ID, Block), ...), nothing this view can see is removed
+            blocks (Block[]): the index's blocks, only appended to (a fork switch starts a new list)
+            height (int): ID of the view's tip, later blocks aren't part of the view
+            fork_count (int): how many fork switches the index had gone through when the view was made
+        """
+        self.placements = placements
+        self.blocks = blocks
+        self.height = height
+        self.fork_count = fork_count
+
+    def __getitem__(self, signature_hex):
+        for block_id, block in self.placements.get(signature_hex, ()):
+            if block_id <= self.height and self.blocks[block_id] is block:
+                return block_id
+        raise KeyError(signature_hex)
+
+    def __iter__(self):
+        for block in self.blocks[:self.height + 1]:
+            for txn in block.txns:
+                if txn.signature != None:
+                    yield txn.signature.hex()
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+class PollIndex:
+    """
+    Polls, vote counts and the block each transaction is in, kept up to date incrementally:
+    blocks added to the end of the chain are applied, blocks dropped by a fork switch are unapplied.
+    """
+
+    def __init__(self):
+        # Only touched by update(), which the peer calls while holding the blockchain lock
+        self.blocks = []  # the blocks the index was built from, in chain order
+        self.polls = {}  # poll ID -> poll data, plus the ID of the block that created it
+        self.results = {}  # poll ID -> {option: vote count}
+        # Which of the above the current update already copied (see the module docstring)
+        self.copied_polls = False
+        self.copied_results = False
+        self.copied_counts = set()  # poll IDs
+        # Transaction signature hex -> ((block ID, Block), ...) for every block it was added in, also
+        # ones dropped by a fork switch while views from before it are still around, see TxnBlocks
+        self.placements = {}
+        self.fork_count = 0
+        self.dropped = []  # (fork count before the switch, blocks it dropped), oldest first
+        # View number -> the view's TxnBlocks, for the views someone still holds (TxnBlocks is a
+        # Mapping, so it's unhashable and can't go in a WeakSet)
+        self.live_txn_blocks = weakref.WeakValueDictionary()
+        self.view_count = 0
+
+        # Published by update(), read without a lock (replacing the reference is atomic)
+        self.view = self.make_view()
+
+    def make_view(self):
+        """
+        Returns:
+            dict: an immutable snapshot of the index, with the chain's height and tip hash,
+                  the polls, their results and the transactions' block IDs (a read-only mapping)
+        """
+        tip = self.blocks[-1] if len(self.blocks) > 0 else None
+        height = tip.id if tip != None else -1
+        txn_blocks = TxnBlocks(self.placements, self.blocks, height, self.fork_count)
+        self.live_txn_blocks[self.view_count] = txn_blocks
+        self.view_count += 1
+        # Published as they are, the next update copies them before changing them
+        self.copied_polls = False
+        self.copied_results = False
+        self.copied_counts = set()
+        return {
+            "height": height,
+            "tip_hash": str(tip.hash) if tip != None else "",
+            "polls": self.polls,
+            "results": self.results,
+            "txns": txn_blocks,
+        }
+
+    def update(self, chain):
+        """
+        Brings the index in line with the chain and publishes a new view if it changed.
+        Must be called with the blockchain lock held.
+
+        Args:
+            chain (Block[]): the peer's chain
+        """
+        # Blocks we indexed that are still on the chain (they're the same objects after a fork switch)
+        fork = min(len(chain), len(self.blocks))
+        while fork > 0 and chain[fork - 1] is not self.blocks[fork - 1]:
+            fork -= 1
+        if fork == len(self.blocks) and fork == len(chain):
+            return
+
+        for block in reversed(self.blocks[fork:]):
+            self.apply_block(block, -1)
+        if fork < len(self.blocks):
+            # Older views still read the old list, and the dropped blocks' placements until they're gone
+            self.dropped.append((self.fork_count, self.blocks[fork:]))
+            self.fork_count += 1
+            self.blocks = self.blocks[:fork]
+        for block in chain[fork:]:
+            self.apply_block(block, 1)
+            self.blocks.append(block)
+
+        self.view = self.make_view()
+        self.prune_placements()
+
+    def prune_placements(self):
+        """
+        Drops the placements of blocks that fork switches dropped, once no view from before the
+        switch is left
+        """
+        oldest = min((txn_blocks.fork_count for txn_blocks in self.live_txn_blocks.values()), default=self.fork_count)
+        while len(self.dropped) > 0 and self.dropped[0][0] < oldest:
+            for block in self.dropped.pop(0)[1]:
+                # A later fork switch may have brought the block back
+                if block.id < len(self.blocks) and self.blocks[block.id] is block:
+                    continue
+                for txn in block.txns:
+                    if txn.signature == None:
+                        continue
+                    signature_hex = txn.signature.hex()
+                    placements = tuple(placement for placement in self.placements.get(signature_hex, ()) if placement[1] is not block)
+                    if len(placements) > 0:
+                        self.placements[signature_hex] = placements
+                    else:
+                        self.placements.pop(signature_hex, None)
+
+    def writable_polls(self):
+        """
+        Returns:
+            dict: the polls, copied first if the current view has them
+        """
+        if not self.copied_polls:
+            self.polls = dict(self.polls)
+            self.copied_polls = True
+        return self.polls
+
+    def writable_results(self, poll_id=None):
+        """
+        Args:
+            poll_id (str | None): the poll whose counts are about to change, if any
+        Returns:
+            dict: the results, or the poll's counts if poll_id is given, copied first if the current view has them
+        """
+        if not self.copied_results:
+            self.results = dict(self.results)
+            self.copied_results = True
+        if poll_id == None:
+            return self.results
+        if poll_id not in self.copied_counts:
+            self.results[poll_id] = dict(self.results[poll_id])
+            self.copied_counts.add(poll_id)
+        return self.results[poll_id]
+
+    def apply_block(self, block, direction):
+        """
+        Adds a block's transactions to the index, or removes them
+
+        Args:
+            block (Block): a block on the chain
+            direction (int): 1 to add the block, -1 to remove it
+        """
+        txns = block.txns if direction == 1 else reversed(block.txns)
+        for txn in txns:
+            txn_data = txn.data if isinstance(txn.data, dict) else {}
+            txn_type = txn_data.get("transaction_type")
+            poll_id = txn_data.get("poll_id")
+
+            if txn_type == "create_poll":
+                if direction == 1:
+                    self.writable_polls()[poll_id] = {
+                        "poll_id": poll_id,
+                        "poll_name": txn_data.get("poll_name"),
+                        "options": txn_data.get("options", []),
+                        "block_id": block.id,
+                    }
+                    self.writable_results()[poll_id] = {option: 0 for option in txn_data.get("options", [])}
+                    self.copied_counts.add(poll_id)
+                elif self.polls.get(poll_id, {}).get("block_id") == block.id:
+                    del self.writable_polls()[poll_id]
+                    del self.writable_results()[poll_id]
+            elif txn_type == "vote":
+                counts = self.results.get(poll_id)
+                if counts != None and txn_data.get("vote") in counts:
+                    self.writable_results(poll_id)[txn_data["vote"]] += direction
+
+            if txn.signature != None and direction == 1:
+                signature_hex = txn.signature.hex()
+                placements = self.placements.get(signature_hex, ())
+                if not any(placed is block for _, placed in placements):
+                    # A new tuple, so a reader never sees one half updated
+                    self.placements[signature_hex] = placements + ((block.id, block),)
+
+    def get_view(self):
+        """
+        Returns:
+            dict: the current view of the index, see make_view(). Nothing in it may be modified.
+        """
+        return self.view
@@ -0,0 +1,405 @@
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+"""
+On-demand profiling of a running peer, over a control port on localhost.
+
+Endpoints (GET, plain text responses):
+    /profile?seconds=N        turns on cProfile in the mining, listener and rcv buffer threads for N seconds,
+                              then answers with each thread's top functions and the lock waits in that window.
+                              Each thread's full stats are also dumped to "{prefix}_profile_{thread}.prof" (see pstats).
+    /memory/start?frames=N    starts tracemalloc, keeping N frames per allocation
+    /memory/snapshot?top=N    takes a snapshot (dumped to "{prefix}_memory_{n}.snapshot"), answers with the
+                              lines that allocated the most, and what grew the most since the previous snapshot
+    /memory/stop              stops tracemalloc
+    /locks                    time spent waiting for the peer's locks since it started
+
+cProfile only sees the thread it was turned on in, so the profiled threads turn it on and off
+themselves: they call Profiler.checkpoint() in their loops (which does nothing unless a profile is
+being taken), and the listener's event loop gets the checkpoint scheduled on it. A thread that is
+blocked the whole time (e.g. waiting for a transaction to mine) is reported as idle.
+
+Usage:
+    python3 profiler.py {control port} {path}, e.g. python3 profiler.py 9300 /profile?seconds=10
+"""
+
+PROFILE_ADDR = "127.0.0.1"
+# While a profile is being taken, profiled threads that wait for work wake up this often to check whether it's over
+PROFILE_CHECK_INTERVAL = 0.25
+# Functions listed per thread in a profile, and lines listed per memory snapshot
+PROFILE_TOP_LEN = 25
+MEMORY_TOP_LEN = 25
+TRACEMALLOC_FRAMES = 10
+
+class TimedLock:
+    """
+    A threading.Lock that keeps track of how long threads waited for it. An uncontended acquire
+    costs one extra non-blocking try, only a contended one is timed. Works with threading.Condition:
+    it implements the hooks Condition would otherwise emulate with acquire(False) probes, so checking
+    who owns the lock isn't counted as an acquisition.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.owner = None  # thread ID of the holder, for Condition
+        # Only updated while holding the lock, so they need no lock of their own
+        self.acquisitions = 0
+        self.contended = 0  # acquisitions that had to wait
+        self.wait_time = 0.0  # seconds
+        self.max_wait = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self.lock.acquire(False):
+            self.owner = threading.get_ident()
+            self.acquisitions += 1
+            return True
+        if not blocking:
+            return False
+
+        start = time.perf_counter()
+        acquired = self.lock.acquire(True, timeout)
+        if acquired:
+            waited = time.perf_counter() - start
+            self.owner = threading.get_ident()
+            self.acquisitions += 1
+            self.contended += 1
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+        return acquired
+
+    def release(self):
+        self.owner = None
+        self.lock.release()
+
+    def _is_owned(self):
+        # Used by threading.Condition (wait, notify) to check the caller holds the lock
+        return self.owner == threading.get_ident()
+
+    def _release_save(self):
+        # Used by threading.Condition.wait() to let go of the lock while waiting
+        self.release()
+
+    def _acquire_restore(self, state):
+        # Used by threading.Condition.wait() to take the lock back after waiting, which is a real
+        # acquisition (and usually a contended one: the notifying thread still holds it)
+        self.acquire()
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+    def stats(self):
+        """
+        Returns:
+            dict: acquisitions, contended acquisitions, total and longest wait (seconds)
+        """
+        return {"acquisitions": self.acquisitions, "contended": self.contended, "wait_time": self.wait_time, "max_wait": self.max_wait}
+
+class Profiler:
+    """
+    The profiling hooks of a peer: the threads that can be profiled, the locks whose waits are
+    timed, and the control port to trigger a profile or a memory snapshot on
+    """
+
+    def __init__(self, prefix):
+        """
+        Args:
+            prefix (str): put in front of the names of dumped files, e.g. the peer's port
+        """
+        self.prefix = prefix
+        self.locks = {}  # name -> TimedLock
+        self.threads = []  # names of the threads that call checkpoint()
+        self.loops = {}  # name -> asyncio event loop, for threads that run one
+
+        # Only one profile at a time. The session is {"deadline", "stopping", "running": {thread name:
+        # cProfile.Profile}, "finished": {thread name: cProfile.Profile}}, None when no profile is being taken.
+        self.profile_lock = threading.Lock()
+        self.session_cond = threading.Condition()
+        self.session = None
+
+        self.memory_lock = threading.Lock()
+        self.snapshot = None  # the last tracemalloc snapshot
+        self.snapshot_count = 0
+        self.httpd = None
+
+    def add_lock(self, name, lock):
+        """
+        Args:
+            name (str): the lock's name in reports
+            lock (TimedLock): the lock
+        Returns:
+            TimedLock: the lock
+        """
+        self.locks[name] = lock
+        return lock
+
+    def add_thread(self, name):
+        """
+        Args:
+            name (str): a thread that calls checkpoint(name) in its loop
+        """
+        self.threads.append(name)
+
+    def add_loop(self, name, loop):
+        """
+        Args:
+            name (str): the thread running the loop
+            loop (asyncio.AbstractEventLoop): the loop, checkpoints are scheduled on it
+        """
+        self.loops[name] = loop
+
+    def checkpoint(self, name):
+        """
+        Called by a profiled thread from its loop: turns cProfile on in the thread when a profile
+        starts, and off when it's over
+
+        Args:
+            name (str): the calling thread's name
+        """
+        session = self.session
+        if session == None:
+            return
+
+        with self.session_cond:
+            profile = session["running"].get(name)
+            if profile == None:
+                if session["stopping"] or name in session["finished"] or time.monotonic() >= session["deadline"]:
+                    return
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError:
+                    # Another profiler (e.g. a debugger) is active in this interpreter
+                    session["finished"][name] = None
+                    return
+                session["running"][name] = profile
+            elif session["stopping"] or time.monotonic() >= session["deadline"]:
+                profile.disable()
+                del session["running"][name]
+                session["finished"][name] = profile
+                if session["stopping"] and len(session["running"]) == 0 and self.session is session:
+                    # The last thread of a profile that has already been reported
+                    self.session = None
+                self.session_cond.notify_all()
+
+    def wait_timeout(self):
+        """
+        Returns:
+            float | None: how long a profiled thread should wait for work at most before its next
+                checkpoint, None (no limit) when no profile is being taken
+        """
+        return PROFILE_CHECK_INTERVAL if self.session != None else None
+
+    def lock_stats(self):
+        """
+        Returns:
+            dict: lock name -> TimedLock.stats()
+        """
+        return {name: lock.stats() for name, lock in self.locks.items()}
+
+    def format_lock_stats(self, stats, before=None):
+        """
+        Args:
+            stats (dict): lock_stats()
+            before (dict | None): lock_stats() from earlier, to report only what happened since (except the longest wait)
+        Returns:
+            str: a line per lock
+        """
+        lines = [f"{'lock':<12} {'acquired':>10} {'contended':>10} {'wait ms':>10} {'max ms':>8}"]
+        for name, lock_stats in stats.items():
+            prev = before[name] if before != None else {"acquisitions": 0, "contended": 0, "wait_time": 0.0}
+            lines.append(f"{name:<12} {lock_stats['acquisitions'] - prev['acquisitions']:>10}"
+                f" {lock_stats['contended'] - prev['contended']:>10}"
+                f" {(lock_stats['wait_time'] - prev['wait_time']) * 1000:>10.2f} {lock_stats['max_wait'] * 1000:>8.2f}")
+        return "\n".join(lines) + "\n"
+
+    def profile(self, seconds, top=PROFILE_TOP_LEN):
+        """
+        Profiles the threads for a while, blocks until it's done
+
+        Args:
+            seconds (float): how long to profile
+            top (int): functions to list per thread
+        Returns:
+            str | None: the report, None if a profile is already being taken
+        """
+        if not self.profile_lock.acquire(False):
+            return None
+        try:
+            if self.session != None:
+                # A thread from the last profile still hasn't stopped
+                return None
+            locks_before = self.lock_stats()
+            with self.session_cond:
+                self.session = {"deadline": time.monotonic() + seconds, "stopping": False, "running": {}, "finished": {}}
+                session = self.session
+            for name, loop in self.loops.items():
+                loop.call_soon_threadsafe(self.checkpoint, name)
+
+            time.sleep(seconds)
+
+            with self.session_cond:
+                session["stopping"] = True
+            for name, loop in self.loops.items():
+                loop.call_soon_threadsafe(self.checkpoint, name)
+            with self.session_cond:
+                # Threads in the middle of something (or blocked without a timeout) get a little longer to stop
+                self.session_cond.wait_for(lambda: len(session["running"]) == 0, PROFILE_CHECK_INTERVAL * 4)
+                still_running = list(session["running"])
+                finished = dict(session["finished"])
+                if len(still_running) == 0:
+                    self.session = None
+            locks_after = self.lock_stats()
+        finally:
+            self.profile_lock.release()
+
+        report = [f"profile of {seconds}s\n"]
+        for name in self.threads + list(self.loops):
+            report.append(f"\n=== thread {name} ===\n")
+            if name in still_running:
+                report.append("still busy, stats will be missing until it reaches a checkpoint\n")
+            elif name not in finished:
+                report.append("idle (blocked for the whole profile)\n")
+            elif finished[name] == None:
+                report.append("not profiled, another profiler is active\n")
+            else:
+                path = f"{self.prefix}_profile_{name}.prof"
+                out = io.StringIO()
+                stats = pstats.Stats(finished[name], stream=out)
+                stats.dump_stats(path)
+                stats.sort_stats("cumulative").print_stats(top)
+                report.append(f"full stats in {path}\n")
+                report.append(out.getvalue())
+        report.append("\n=== lock waits during the profile ===\n")
+        report.append(self.format_lock_stats(locks_after, locks_before))
+        return "".join(report)
+
+    def memory(self, command, top=MEMORY_TOP_LEN, frames=TRACEMALLOC_FRAMES):
+        """
+        Args:
+            command (str): "start", "snapshot" or "stop"
+            top (int): lines to list in a snapshot report
+            frames (int): frames kept per allocation, for "start"
+        Returns:
+            str: the report
+        """
+        with self.memory_lock:
+            if command == "start":
+                if tracemalloc.is_tracing():
+                    return "tracemalloc already started\n"
+                tracemalloc.start(frames)
+                self.snapshot = None
+                return f"tracemalloc started, {frames} frames per allocation\n"
+            if command == "stop":
+                tracemalloc.stop()
+                self.snapshot = None
+                return "tracemalloc stopped\n"
+            if command != "snapshot":
+                raise ValueError(f"Unknown memory command {command}")
+            if not tracemalloc.is_tracing():
+                return "tracemalloc is not started, see /memory/start\n"
+
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ])
+            self.snapshot_count += 1
+            path = f"{self.prefix}_memory_{self.snapshot_count}.snapshot"
+            snapshot.dump(path)
+            current, peak = tracemalloc.get_traced_memory()
+
+            report = [f"snapshot {self.snapshot_count} (in {path}): {current / 1024:.1f} KiB traced, peak {peak / 1024:.1f} KiB\n",
+                "\n=== top lines ===\n"]
+            report += [f"{stat}\n" for stat in snapshot.statistics("lineno")[:top]]
+            if self.snapshot != None:
+                report.append("\n=== growth since the previous snapshot ===\n")
+                report += [f"{stat}\n" for stat in snapshot.compare_to(self.snapshot, "lineno")[:top]]
+            self.snapshot = snapshot
+            return "".join(report)
+
+    def handle_command(self, path):
+        """
+        Args:
+            path (str): the request path, with its query string
+        Returns:
+            tuple: (HTTP status, response text)
+        """
+        url = urlsplit(path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = url.path.strip('/').split('/')
+
+        if parts == ["profile"]:
+            report = self.profile(float(params.get("seconds", 5)), int(params.get("top", PROFILE_TOP_LEN)))
+            if report == None:
+                return 409, "a profile is already being taken, or a thread from the last one hasn't stopped yet\n"
+            return 200, report
+        if len(parts) == 2 and parts[0] == "memory" and parts[1] in ["start", "snapshot", "stop"]:
+            return 200, self.memory(parts[1], int(params.get("top", MEMORY_TOP_LEN)), int(params.get("frames", TRACEMALLOC_FRAMES)))
+        if parts == ["locks"]:
+            return 200, self.format_lock_stats(self.lock_stats())
+        return 404, "unknown command\n"
+
+    def serve(self, port):
+        """
+        Serves the control port on localhost, on a background thread (one thread per request)
+
+        Args:
+            port (int): port to listen on
+        Returns:
+            threading.Thread: the server thread
+        """
+        profiler = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                try:
+                    status, text = profiler.handle_command(self.path)
+                except ValueError as e:
+                    status, text = 400, f"{e}\n"
+                body = text.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((PROFILE_ADDR, port), Handler)
+        self.httpd.daemon_threads = True
+        thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        """
+        Stops serving the control port
+        """
+        if self.httpd != None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+if __name__ == '__main__':
+    port = int(sys.argv[1])
+    path = sys.argv[2] if len(sys.argv) > 2 else "/locks"
+    try:
+        with urlopen(f"http://{PROFILE_ADDR}:{port}{path}") as response:
+            print(response.read().decode(), end="")
+    except HTTPError as e:
+        print(e.read().decode(), end="")
+        sys.exit(1)
@@ -0,0 +1,181 @@
+import threading
+from collections import OrderedDict, deque
+
+MAX_QUEUED_BLOCKS = 1024
+RECENT_HASHES_LEN = 4096
+# Blocks up to this far below our tip still get validated: they may be a competing branch that
+# other peers are on, so they're worth relaying (and counting) rather than being dropped as stale
+STALE_SLACK = 2
+
+class ReceiveQueue:
+    """
+    Bounded queue for blocks received from other peers, sitting between the
+    listener and the thread that validates and adds blocks to the chain.
+
+    Validating a block (SHA-256 plus an RSA signature check per transaction) is the
+    expensive part, so the queue throws away what would be discarded anyway before it
+    gets there:
+        - duplicates, by block hash (queued or recently handed out)
+        - stale blocks, whose id is more than stale_slack below our chain's tip (blocks at
+          or just below the tip compete with ours, they go on to be validated and relayed)
+        - when full, the lowest block (either the new one or the lowest queued one),
+          except for a block extending our tip
+
+    Blocks are handed out highest first, except that the block extending our tip
+    (id == tip + 1) always goes first so we don't mistake a gap for a fork.
+
+    get() blocks until there is a block to process (or the queue is closed), so the
+    consuming thread doesn't have to poll.
+
+    Every item is a dict with the received Block under "payload", like the old rcv_buffer.
+    """
+
+    def __init__(self, maxsize=MAX_QUEUED_BLOCKS, stale_slack=STALE_SLACK):
+        """
+        Args:
+            maxsize (int): maximum number of queued blocks
+            stale_slack (int): how far below our tip a block may be without being dropped as stale
+        """
+        self.maxsize = maxsize
+        self.stale_slack = stale_slack
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.closed = False
+        self.by_id = {}  # block id -> deque of items, in arrival order
+        self.size = 0
+        self.queued_hashes = set()
+        self.recent_hashes = OrderedDict()
+        self.tip_id = -1
+
+        self.enqueued = 0
+        self.dropped_duplicate = 0
+        self.dropped_stale = 0
+        self.dropped_full = 0
+
+    def set_tip(self, tip_id):
+        """
+        Tells the queue the id of the latest block on our chain
+
+        Args:
+            tip_id (int): id of the latest block, -1 for an empty chain
+        """
+        with self.lock:
+            self.tip_id = tip_id
+
+    def _is_stale(self, _id):
+        """
+        Args:
+            _id (int): id of a block
+        Returns:
+            bool: whether the block is too far below our tip to be worth validating (called with the lock held)
+        """
+        return _id < self.tip_id - self.stale_slack
+
+    def _remember(self, block_hash):
+        self.recent_hashes[block_hash] = None
+        if len(self.recent_hashes) > RECENT_HASHES_LEN:
+            self.recent_hashes.popitem(last=False)
+
+    def _pop_from(self, _id):
+        items = self.by_id[_id]
+        item = items.popleft()
+        if len(items) == 0:
+            del self.by_id[_id]
+        self.size -= 1
+        self.queued_hashes.discard(str(item["payload"].hash))
+        return item
+
+    def put(self, item):
+        """
+        Queues a received block, unless it's a duplicate, stale, or the queue is full
+        of higher blocks.
+
+        Args:
+            item (dict): the received block and where it came from
+        Returns:
+            bool: whether the block was queued
+        """
+        block = item["payload"]
+        block_hash = str(block.hash)
+
+        with self.lock:
+            if block_hash in self.queued_hashes or block_hash in self.recent_hashes:
+                self.dropped_duplicate += 1
+                return False
+
+            if self._is_stale(block.id):
+                self.dropped_stale += 1
+                return False
+
+            if self.size >= self.maxsize:
+                # The block extending our tip is never the one dropped
+                next_id = self.tip_id + 1
+                evictable = [_id for _id in self.by_id if _id != next_id]
+                if len(evictable) == 0 or (block.id != next_id and block.id <= min(evictable)):
+                    self.dropped_full += 1
+                    return False
+                self._pop_from(min(evictable))
+                self.dropped_full += 1
+
+            if block.id not in self.by_id:
+                self.by_id[block.id] = deque()
+            self.by_id[block.id].append(item)
+            self.size += 1
+            self.queued_hashes.add(block_hash)
+            self.enqueued += 1
+            self.not_empty.notify()
+            return True
+
+    def close(self):
+        """
+        Wakes up every thread waiting in get(), used on shutdown
+        """
+        with self.lock:
+            self.closed = True
+            self.not_empty.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Takes the next block to process off the queue: the one extending our tip if there is
+        one, the highest one otherwise. Blocks that went stale while queued are dropped.
+        Waits for a block if the queue is empty.
+
+        Args:
+            timeout (float | None): how long to wait at most, None to wait until a block comes in or the queue is closed
+        Returns:
+            dict | None: the item, or None if the wait timed out or the queue was closed
+        """
+        with self.lock:
+            while True:
+                if not self.not_empty.wait_for(lambda: self.size > 0 or self.closed, timeout):
+                    return None
+                if self.closed:
+                    return None
+
+                next_id = self.tip_id + 1
+                _id = next_id if next_id in self.by_id else max(self.by_id)
+                item = self._pop_from(_id)
+                self._remember(str(item["payload"].hash))
+
+                if self._is_stale(_id):
+                    self.dropped_stale += 1
+                    continue
+                return item
+
+    def __len__(self):
+        with self.lock:
+            return self.size
+
+    def stats(self):
+        """
+        Returns:
+            dict: current queue depth and how many blocks were queued/dropped (and why)
+        """
+        with self.lock:
+            return {
+                "depth": self.size,
+                "enqueued": self.enqueued,
+                "dropped_duplicate": self.dropped_duplicate,
+                "dropped_stale": self.dropped_stale,
+                "dropped_full": self.dropped_full
+            }
@@ -0,0 +1,141 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+from logger import Logger
+
+"""
+Local HTTP/JSON read API for a peer's polls, served from its PollIndex (see poll_index.py).
+
+Endpoints (GET only):
+    /height                   {"height": id of the tip block (-1 for an empty chain), "tip_hash": ...}
+    /polls                    list of polls: {"poll_id", "poll_name", "options", "block_id"}
+    /polls/{poll ID}          the poll, 404 if it's not on the chain
+    /polls/{poll ID}/results  {option: vote count}, 404 if the poll is not on the chain
+    /txns/{signature hex}     {"status": "confirmed", "block_id", "confirmations"}, {"status": "pending"}
+                              for one of the peer's own transactions that's waiting to be mined, or {"status": "unknown"}
+
+Every response carries an ETag made of the chain's height and tip hash, so it changes exactly when
+the chain does. Clients sending it back in If-None-Match get a 304 until then. Serialized responses
+are cached per path for the current tip, so repeated reads don't even re-encode the JSON.
+"""
+
+READ_API_ADDR = "127.0.0.1"
+# At most this many responses are cached per chain tip, so lookups of random paths can't grow the cache without bound
+RESPONSE_CACHE_LEN = 1024
+
+class ReadApiServer:
+    """
+    Serves the read API on its own threads (one per connection), next to the peer's other threads
+    """
+
+    def __init__(self, poll_index, port, log=None, is_txn_pending=None):
+        """
+        Args:
+            poll_index (PollIndex): the index to serve from
+            port (int): port to listen on (on localhost only)
+            log (Logger | None): where to log, a Logger on stdout if None
+            is_txn_pending (function | None): called with a signature hex, whether the transaction is waiting to be mined
+        """
+        self.poll_index = poll_index
+        self.is_txn_pending = is_txn_pending
+        self.log = log if log != None else Logger()
+        # (ETag of the view the responses were built from, {path: (status, body bytes)}), replaced when
+        # the chain changes. Keeping the ETag rather than the view lets old views go (see poll_index.py).
+        self.response_cache = (None, {})
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.handle_get(self)
+
+            def log_message(self, format, *args):
+                # Thousands of reads per second would flood the peer's log
+                pass
+
+        self.httpd = ThreadingHTTPServer((READ_API_ADDR, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+
+    def start(self):
+        self.log.info("start", "read API listening on %s:%d", READ_API_ADDR, self.httpd.server_address[1])
+        self.thread.start()
+
+    def close(self):
+        """
+        Stops serving and closes the listening socket
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def build_response(self, path, view):
+        """
+        Args:
+            path (str): the request path, without the query string
+            view (dict): the index view to answer from
+        Returns:
+            tuple: (HTTP status, JSON serializable body)
+        """
+        parts = [unquote(part) for part in path.strip('/').split('/')]
+
+        if parts == ["height"]:
+            return 200, {"height": view["height"], "tip_hash": view["tip_hash"]}
+        if parts == ["polls"]:
+            return 200, list(view["polls"].values())
+        if len(parts) in [2, 3] and parts[0] == "polls":
+            poll = view["polls"].get(parts[1])
+            if poll == None:
+                return 404, {"error": "unknown poll"}
+            if len(parts) == 2:
+                return 200, poll
+            if parts[2] == "results":
+                return 200, view["results"][parts[1]]
+        if len(parts) == 2 and parts[0] == "txns":
+            block_id = view["txns"].get(parts[1].lower())
+            if block_id == None:
+                if self.is_txn_pending != None and self.is_txn_pending(parts[1].lower()):
+                    return 200, {"status": "pending"}
+                return 200, {"status": "unknown"}
+            return 200, {"status": "confirmed", "block_id": block_id, "confirmations": view["height"] - block_id + 1}
+        return 404, {"error": "unknown endpoint"}
+
+    def handle_get(self, handler):
+        """
+        Answers a GET request from the current view of the index
+
+        Args:
+            handler (BaseHTTPRequestHandler): the request
+        """
+        view = self.poll_index.get_view()
+        etag = f'"{view["height"]}-{view["tip_hash"]}"'
+        path = handler.path.split('?', 1)[0]
+
+        cache_etag, cache = self.response_cache
+        if cache_etag != etag:
+            # The chain changed, everything cached is stale
+            cache = {}
+            self.response_cache = (etag, cache)
+
+        cached = cache.get(path)
+        if cached == None:
+            status, body = self.build_response(path, view)
+            cached = (status, json.dumps(body).encode())
+            # A transaction can become pending, or stop being pending, without the chain changing
+            if len(cache) < RESPONSE_CACHE_LEN and not (path.startswith("/txns/") and "block_id" not in body):
+                cache[path] = cached
+        status, body_bytes = cached
+
+        if status == 200 and handler.headers.get("If-None-Match") == etag:
+            handler.send_response(304)
+            handler.send_header("ETag", etag)
+            handler.end_headers()
+            return
+
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body_bytes)))
+        handler.send_header("ETag", etag)
+        handler.end_headers()
+        handler.wfile.write(body_bytes)
@@ -0,0 +1,555 @@
+import asyncio
+import contextlib
+import io
+import json
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+import app
+from logger import WARNING
+from peer import Peer
+from peer_load import rate_schedule, wait_for_directory, wait_for_poll, LOAD_POLL_OPTIONS
+from tracker import Tracker
+from tracker_load import percentile
+
+"""
+In-process network simulator: one tracker and N peers in this process, with the peers talking to
+each other over an in-memory network instead of TCP.
+
+The peers are the real Peer class and speak the real protocol (PeerTransport only gets a different
+network, see TcpNetwork), so a scenario exercises the same gossip, chain download and fork
+resolution code as a deployment. The tracker is the real one too, on loopback.
+
+The network can add latency (plus jitter) to every message, limit each peer's upload bandwidth,
+drop connections at random, and partition the peers into two groups for a while. While the
+scenario runs, every peer's chain is watched to see when each block reached each peer.
+
+Reported: confirmation latency (from a transaction being due until its block was on every peer's
+chain), block propagation (time until a block reached 50%, 90% and all of the peers), the fork rate
+(blocks that didn't end up on the final chain, and fork resolutions) and the time it took the peers
+to converge on one chain after the last transaction.
+
+Usage:
+    python3 simulator.py {tracker port} {first listening port} {num peers} {difficulty} {txns per sec} {duration secs} [{scenario file}]
+
+The scenario file is a json file, every key optional:
+    {
+        "latency": 0.02,          one-way latency of every message, seconds
+        "jitter": 0.005,          up to this much is added to the latency, at random
+        "bandwidth": 1000000,     each peer's upload, bytes/second (null: unlimited)
+        "drop_rate": 0.01,        fraction of connections that fail
+        "partitions": [{"start": 1.0, "end": 3.0, "split": 0.5}],
+                                  from start to end seconds into the load, the first split of the
+                                  peers can't reach the others (heal before the load ends, the
+                                  sides only notice each other's chains when new blocks come in)
+        "peer_config": {...},     config keys for every peer, as in a peer's config file
+        "arrival": "poisson",     or "constant"
+        "convergence_timeout": 30,
+        "seed": 1
+    }
+
+The peers' listening ports are only IDs here (nothing listens on them), their logs are written to
+{port}_log.txt as usual.
+"""
+
+SIM_ADDR = "127.0.0.1"
+# How often the peers' chains are checked for new blocks, this is the resolution of the propagation times
+MONITOR_INTERVAL = 0.01
+CONVERGENCE_TIMEOUT = 30.0
+DELIVERY_SLACK = 0.001
+SHUTDOWN_GRACE = 0.5
+# On top of the scenario's peer_config. Heartbeats are off since a single core running 100+ peers
+# can starve a peer long enough for the tracker to evict it, and only warnings are logged.
+SIM_PEER_CONFIG = {"heartbeat_interval": None, "log_level": "warning"}
+
+class SimServer:
+    """
+    What SimNetwork.start_server() returns, a peer "listening" on the in-memory network
+    """
+
+    def __init__(self, network, port):
+        self.network = network
+        self.port = port
+
+    def close(self):
+        self.network.remove_server(self.port)
+
+class SimWriter:
+    """
+    The writing end of a simulated connection, with the parts of asyncio.StreamWriter PeerTransport uses
+    """
+
+    def __init__(self, pipe, peername):
+        self.pipe = pipe
+        self.peername = peername
+
+    def write(self, data):
+        self.pipe.send(bytes(data))
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.pipe.send(None)
+
+    def get_extra_info(self, name, default=None):
+        return self.peername if name == "peername" else default
+
+class SimPipe:
+    """
+    One direction of a simulated connection. Written bytes are fed to a StreamReader on the
+    receiving peer's event loop once the network says they arrive, in the order they were written.
+    """
+
+    def __init__(self, network, src_port, loop, reader):
+        """
+        Args:
+            network (SimNetwork): decides when bytes arrive
+            src_port (int): listening port of the sending peer, whose upload the bytes go over
+            loop (asyncio.AbstractEventLoop): the receiving peer's event loop
+            reader (asyncio.StreamReader): the receiving end
+        """
+        self.network = network
+        self.src_port = src_port
+        self.loop = loop
+        self.reader = reader
+        self.lock = threading.Lock()
+        self.chunks = deque()  # (time.monotonic() the chunk arrives, bytes or None for the end of the stream)
+        self.last_arrival = 0.0
+        self.closed = False
+        self.timer = None  # only touched on the receiving loop
+
+    def send(self, data):
+        """
+        Args:
+            data (bytes | None): bytes to send, None to close the stream
+        """
+        size = len(data) if data != None else 0
+        arrival = self.network.arrival_time(self.src_port, size)
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = data == None
+            # Later chunks never overtake earlier ones
+            self.last_arrival = max(arrival, self.last_arrival)
+            self.chunks.append((self.last_arrival, data))
+        try:
+            self.loop.call_soon_threadsafe(self.schedule)
+        except RuntimeError:
+            # The receiving peer was shut down
+            pass
+
+    def schedule(self):
+        """
+        Runs on the receiving loop, sets a timer for the next chunk to arrive
+        """
+        if self.timer != None:
+            return
+        with self.lock:
+            if len(self.chunks) == 0:
+                return
+            arrival = self.chunks[0][0]
+        # The event loop's clock is time.monotonic()
+        self.timer = self.loop.call_at(arrival, self.deliver)
+
+    def deliver(self):
+        """
+        Runs on the receiving loop, hands every chunk that has arrived to the reader
+        """
+        self.timer = None
+        # The loop may run the timer a hair early (its clock resolution)
+        now = time.monotonic() + DELIVERY_SLACK
+        while True:
+            with self.lock:
+                if len(self.chunks) == 0 or self.chunks[0][0] > now:
+                    break
+                _, data = self.chunks.popleft()
+            if data == None:
+                self.reader.feed_eof()
+            else:
+                self.reader.feed_data(data)
+        self.schedule()
+
+class SimNetwork:
+    """
+    In-memory network for PeerTransport (see TcpNetwork), with configurable latency, upload bandwidth,
+    dropped connections and partitions. Peers are addressed by their listening port.
+    """
+
+    def __init__(self, seed=None):
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.servers = {}  # listening port -> (the peer's event loop, its connection handler)
+        self.latency = 0.0
+        self.jitter = 0.0
+        self.bandwidth = None
+        self.drop_rate = 0.0
+        self.groups = None  # listening port -> partition group, None while the network isn't partitioned
+        self.upload_free = {}  # listening port -> time.monotonic() the peer's upload is done with what it's sending
+
+        self.connections = 0
+        self.refused = 0  # dropped or partitioned away
+        self.bytes_sent = 0
+
+    def set_conditions(self, latency=0.0, jitter=0.0, bandwidth=None, drop_rate=0.0):
+        """
+        Args:
+            latency (float): one-way latency of every message, seconds
+            jitter (float): up to this much is added to the latency, at random
+            bandwidth (float | None): each peer's upload in bytes/second, None for unlimited
+            drop_rate (float): fraction of connections that fail
+        """
+        with self.lock:
+            self.latency = latency
+            self.jitter = jitter
+            self.bandwidth = bandwidth
+            self.drop_rate = drop_rate
+
+    def partition(self, groups):
+        """
+        Args:
+            groups (int[][]): listening ports of the peers in each group, peers in different groups can't connect
+        """
+        with self.lock:
+            self.groups = {port: i for i, ports in enumerate(groups) for port in ports}
+
+    def heal(self):
+        with self.lock:
+            self.groups = None
+
+    def close(self):
+        """
+        Refuses every new connection from now on, so the peers can be shut down once what's in flight has arrived
+        """
+        with self.lock:
+            self.servers = {}
+
+    def remove_server(self, port):
+        with self.lock:
+            self.servers.pop(port, None)
+
+    def arrival_time(self, src_port, size):
+        """
+        Args:
+            src_port (int): listening port of the sending peer
+            size (int): bytes sent
+        Returns:
+            float: time.monotonic() the bytes arrive at the other end
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.bytes_sent += size
+            sent = now
+            if self.bandwidth != None:
+                # Queued behind whatever the peer is already uploading
+                sent = max(now, self.upload_free.get(src_port, now)) + size / self.bandwidth
+                self.upload_free[src_port] = sent
+            return sent + self.latency + self.rng.uniform(0, self.jitter)
+
+    async def start_server(self, handler, listening_sock, listening_port, backlog):
+        with self.lock:
+            self.servers[listening_port] = (asyncio.get_running_loop(), handler)
+        return SimServer(self, listening_port)
+
+    async def open_connection(self, addr, port, local_port):
+        with self.lock:
+            self.connections += 1
+            server = self.servers.get(port)
+            partitioned = self.groups != None and self.groups.get(port) != self.groups.get(local_port)
+            dropped = self.rng.random() < self.drop_rate
+            if server == None or partitioned or dropped:
+                self.refused += 1
+        if server == None or partitioned or dropped:
+            raise ConnectionRefusedError(f"{addr}:{port} is unreachable")
+
+        local_loop = asyncio.get_running_loop()
+        remote_loop, handler = server
+        local_reader = asyncio.StreamReader(loop=local_loop)
+        remote_reader = asyncio.StreamReader(loop=remote_loop)
+        local_writer = SimWriter(SimPipe(self, local_port, remote_loop, remote_reader), (SIM_ADDR, port))
+        remote_writer = SimWriter(SimPipe(self, port, local_loop, local_reader), (SIM_ADDR, local_port))
+        remote_loop.call_soon_threadsafe(lambda: remote_loop.create_task(handler(remote_reader, remote_writer)))
+        return local_reader, local_writer
+
+class ChainMonitor:
+    """
+    Watches the peers' chains (through their poll index views, so without any lock) and records
+    when each block first showed up on each peer's chain
+    """
+
+    def __init__(self, peers):
+        self.peers = peers
+        self.seen = [{} for _ in peers]  # per peer: block hash -> time.monotonic() it was on the peer's chain
+        self.first_seen = {}  # block hash -> time.monotonic() it was first on any peer's chain
+        self.views = [None for _ in peers]
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.watch)
+
+    def watch(self):
+        while not self.done.wait(MONITOR_INTERVAL):
+            self.check()
+
+    def check(self):
+        now = time.monotonic()
+        for i, peer in enumerate(self.peers):
+            view = peer.poll_index.get_view()
+            if view is self.views[i]:
+                continue
+            self.views[i] = view
+            # New blocks are at the end of the chain (after a fork switch, from the fork on)
+            for block in reversed(peer.blockchain.chain):
+                block_hash = str(block.hash)
+                if block_hash in self.seen[i]:
+                    break
+                self.saw_block(i, block, block_hash, now)
+
+    def saw_block(self, i, block, block_hash, now):
+        """
+        Records a block that just showed up on a peer's chain
+
+        Args:
+            i (int): index of the peer
+            block (Block): the block
+            block_hash (str): the block's hash
+            now (float): time.monotonic() of the check
+        """
+        self.seen[i][block_hash] = now
+        self.first_seen.setdefault(block_hash, now)
+
+    def converged(self):
+        """
+        Returns:
+            bool: whether every peer has the same tip
+        """
+        views = [peer.poll_index.get_view() for peer in self.peers]
+        return all(view["tip_hash"] == views[0]["tip_hash"] for view in views)
+
+class Simulator:
+    """
+    Runs a scenario: starts the tracker and the peers, submits transactions, then collects the stats
+    """
+
+    def __init__(self, tracker_port, first_port, num_peers, difficulty, scenario=None):
+        """
+        Args:
+            tracker_port (int): port for the tracker (on loopback)
+            first_port (int): the peers' listening ports (IDs) are first_port, first_port + 1, ...
+            num_peers (int): number of peers
+            difficulty (int): mining difficulty
+            scenario (dict | None): network conditions, partitions and peer configs, see the module docstring
+        """
+        self.scenario = scenario if scenario != None else {}
+        self.num_peers = num_peers
+        self.difficulty = difficulty
+        self.first_port = first_port
+        self.network = SimNetwork(self.scenario.get("seed"))
+
+        self.tracker = Tracker(tracker_port)
+        self.tracker.log.level = WARNING
+        self.tracker_port = tracker_port
+        self.tracker_thread = threading.Thread(target=self.tracker.listen_for_connections, daemon=True)
+        self.peers = []
+        self.monitor = None
+
+    def start(self):
+        """
+        Starts the tracker and the peers, and waits until every peer knows every other one (or has a
+        full sample of them, with peer_sample_size set) and has the load poll. The network conditions
+        only apply after that, so setting up stays quick.
+
+        Returns:
+            str: the load poll's ID
+        """
+        self.tracker_thread.start()
+        time.sleep(0.2)
+
+        peer_config = dict(SIM_PEER_CONFIG)
+        peer_config.update(self.scenario.get("peer_config", {}))
+        for i in range(self.num_peers):
+            peer = Peer(SIM_ADDR, self.tracker_port, self.first_port + i, self.difficulty, network=self.network)
+            peer.set_configs(peer_config)
+            peer.send_join_message()
+            self.peers.append(peer)
+
+        if not wait_for_directory(self.peers):
+            raise RuntimeError("Not every peer heard about the others from the tracker")
+        # A gossiped block misses a few peers now and then (they catch up with the next one), the
+        # load poll is sent to everyone so every vote is valid everywhere
+        gossip_fanout = self.peers[0].gossip_fanout
+        for peer in self.peers:
+            peer.gossip_fanout = None
+        poll = app.create_poll(self.peers[0], "load", LOAD_POLL_OPTIONS)
+        if not wait_for_poll(self.peers, poll.data["poll_id"]):
+            raise RuntimeError("The load poll didn't make it onto every peer's chain")
+        for peer in self.peers:
+            peer.gossip_fanout = gossip_fanout
+
+        self.network.set_conditions(self.scenario.get("latency", 0.0), self.scenario.get("jitter", 0.0),
+            self.scenario.get("bandwidth"), self.scenario.get("drop_rate", 0.0))
+        self.monitor = ChainMonitor(self.peers)
+        self.monitor.check()
+        self.monitor.thread.start()
+        return poll.data["poll_id"]
+
+    def schedule_partitions(self, start):
+        """
+        Args:
+            start (float): time.monotonic() the load started, partition times are relative to it
+        Returns:
+            threading.Timer[]: the timers that partition and heal the network
+        """
+        timers = []
+        ports = [peer.listening_port for peer in self.peers]
+        for partition in self.scenario.get("partitions", []):
+            split = max(1, int(len(ports) * partition.get("split", 0.5)))
+            groups = [ports[:split], ports[split:]]
+            timers.append(threading.Timer(max(0.0, start + partition["start"] - time.monotonic()), self.network.partition, [groups]))
+            timers.append(threading.Timer(max(0.0, start + partition["end"] - time.monotonic()), self.network.heal))
+        for timer in timers:
+            timer.start()
+        return timers
+
+    def run(self, poll_id, rate, duration):
+        """
+        Submits votes at rate per second for duration seconds, then waits for the peers to converge
+
+        Args:
+            poll_id (str): the poll to vote on
+            rate (float): transactions per second, across the peers
+            duration (float): seconds to submit for
+        Returns:
+            dict: the results, see report()
+        """
+        events = rate_schedule(self.num_peers, rate, duration, self.scenario.get("arrival", "poisson"), self.scenario.get("seed", 0))
+        start = time.monotonic()
+        timers = self.schedule_partitions(start)
+
+        due = {}  # signature hex -> time.monotonic() it was due
+        i = 0
+        while i < len(events):
+            delay = start + events[i][0] - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            now = time.monotonic() - start
+            batches = {}
+            while i < len(events) and events[i][0] <= now:
+                offset, idx, line = events[i]
+                batches.setdefault(idx, []).append((start + offset, app.vote_data(poll_id, line.split(' ')[2])))
+                i += 1
+            for idx, batch in batches.items():
+                txns = self.peers[idx].create_txns([data_dict for _, data_dict in batch])
+                for (txn_due, _), txn in zip(batch, txns):
+                    due[txn.signature.hex()] = txn_due
+
+        for timer in timers:
+            timer.join()
+        load_end = time.monotonic()
+
+        # Converged once every peer has the same tip and nothing is left to mine
+        converged_at = None
+        deadline = load_end + self.scenario.get("convergence_timeout", CONVERGENCE_TIMEOUT)
+        while time.monotonic() < deadline:
+            if self.monitor.converged() and all(len(peer.txns) == 0 and len(peer.pending_txns) == 0 for peer in self.peers):
+                converged_at = time.monotonic()
+                break
+            time.sleep(MONITOR_INTERVAL)
+        self.monitor.done.set()
+        self.monitor.thread.join()
+        self.monitor.check()
+
+        return self.report(due, start, load_end, converged_at)
+
+    def report(self, due, start, load_end, converged_at):
+        """
+        Returns:
+            dict: confirmation latency and block propagation percentiles (seconds), fork and
+                convergence stats, and what the network did
+        """
+        monitor = self.monitor
+        final_chain = self.peers[0].get_chain()
+        final_hashes = set(str(block.hash) for block in final_chain)
+        view = self.peers[0].poll_index.get_view()
+
+        # A block reached everyone once it was on every peer's chain
+        reached_all = {}
+        spread = {50: [], 90: [], 100: []}
+        for block_hash, first in monitor.first_seen.items():
+            if block_hash not in final_hashes:
+                continue
+            delays = sorted(seen[block_hash] - first for seen in monitor.seen if block_hash in seen)
+            if len(delays) == len(self.peers):
+                reached_all[block_hash] = first + delays[-1]
+                for pct in spread:
+                    spread[pct].append(percentile(delays, pct))
+
+        confirm_latencies = []
+        for sig, txn_due in due.items():
+            block_id = view["txns"].get(sig)
+            if block_id != None and block_id < len(final_chain) and str(final_chain[block_id].hash) in reached_all:
+                confirm_latencies.append(reached_all[str(final_chain[block_id].hash)] - txn_due)
+        confirm_latencies.sort()
+
+        orphaned = len([block_hash for block_hash in monitor.first_seen if block_hash not in final_hashes])
+        forks = {result: sum(peer.forks_counter.get((result,)) for peer in self.peers)
+            for result in ["switched", "not_longer", "tip_changed", "failed"]}
+
+        def summary(values):
+            values = sorted(values)
+            return {"count": len(values), "p50": percentile(values, 50), "p90": percentile(values, 90),
+                "p99": percentile(values, 99), "max": percentile(values, 100)}
+
+        return {
+            "peers": len(self.peers),
+            "txns": len(due),
+            "confirmed": len(confirm_latencies),
+            # In blocks that were dropped by a fork switch (their transactions aren't mined again), or never mined
+            "lost": len(due) - len(confirm_latencies),
+            "confirm_latency": summary(confirm_latencies),
+            "propagation_50pct": summary(spread[50]),
+            "propagation_90pct": summary(spread[90]),
+            "propagation_100pct": summary(spread[100]),
+            "blocks": len(monitor.first_seen),
+            "orphaned_blocks": orphaned,
+            "fork_rate": orphaned / len(monitor.first_seen) if len(monitor.first_seen) > 0 else 0.0,
+            "fork_resolutions": forks,
+            "converged": converged_at != None,
+            "peers_on_final_tip": len([peer for peer in self.peers if peer.poll_index.get_view()["tip_hash"] == view["tip_hash"]]),
+            "convergence_time": converged_at - load_end if converged_at != None else None,
+            "elapsed": time.monotonic() - start,
+            "network": {"connections": self.network.connections, "refused": self.network.refused, "bytes": self.network.bytes_sent},
+        }
+
+    def stop(self):
+        # Let the connections in flight finish first, so no peer is shut down in the middle of one
+        self.network.close()
+        time.sleep(self.network.latency + self.network.jitter + SHUTDOWN_GRACE)
+        # app.shutdown narrates every step, which is noise times the number of peers
+        with contextlib.redirect_stdout(io.StringIO()):
+            for peer in self.peers:
+                app.shutdown(peer)
+            self.tracker.log.close()
+
+if __name__ == '__main__':
+    tracker_port = int(sys.argv[1])
+    first_port = int(sys.argv[2])
+    num_peers = int(sys.argv[3])
+    difficulty = int(sys.argv[4])
+    rate = float(sys.argv[5])
+    duration = float(sys.argv[6])
+    scenario = None
+    if len(sys.argv) > 7:
+        with open(sys.argv[7], 'r') as f:
+            scenario = json.load(f)
+
+    sim = Simulator(tracker_port, first_port, num_peers, difficulty, scenario)
+    setup_start = time.monotonic()
+    try:
+        poll_id = sim.start()
+        print(f"Started {num_peers} peers in {time.monotonic() - setup_start:.2f}s")
+        results = sim.run(poll_id, rate, duration)
+        print(json.dumps(results, indent=4))
+    finally:
+        sim.stop()
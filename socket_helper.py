@@ -1,4 +1,7 @@
 
+DEFAULT_READ_SIZE = 4096
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
 class SocketHelper():
     """
     Note: derived from SocketHelper() in bwz2104's hw1
@@ -6,84 +9,143 @@ class SocketHelper():
     The core socket logic for recieving messages with our self-made protocol.
     Makes the overall project logic a lot simpler as long as get_header and get_data
     are implemented correctly since it'll handle cases such as two messages being
-    combined in one packet via keeping self.rem_buf as state.
+    combined in one packet via keeping unparsed bytes in the read buffer as state.
+
+    Data is read with recv_into straight into one growable bytearray, and messages are
+    handed out as memoryview slices of it, so a large message is copied once (off the
+    socket) instead of once per recv. A frame larger than max_frame_size is refused so the
+    other side can't make us buffer an unbounded amount of data.
+
+    Only the peers' tracker connections (TrackerClient) read through this now, where it
+    matters for the directory snapshots and peer lists, which grow with the network. Peer to
+    peer traffic goes through the asyncio transport (peer_transport.py), whose StreamReader
+    does its own buffering.
 
     Client and server both recieve messages so their own respective socket helpers
     inherit this and implement their own specific behaviors on top.
     """
 
-    def __init__(self, socket):
+    def __init__(self, socket, read_size=DEFAULT_READ_SIZE, max_frame_size=MAX_FRAME_SIZE):
+        """
+        Args:
+            socket (socket): the connected socket to read from
+            read_size (int): how many bytes to ask for per recv
+            max_frame_size (int): largest line/message (in bytes) we are willing to buffer
+        """
         self.socket = socket
-        self.rem_buf = None
-
-    def get_data_until_newline(self):
+        self.read_size = read_size
+        self.max_frame_size = max_frame_size
+        self.buf = bytearray(read_size)
+        # Unparsed data lives in self.buf[self.start:self.end]
+        self.start = 0
+        self.end = 0
+
+    def _recv(self, want):
         """
-        Retrieves data until it sees a newline delimiter.
+        Receives more data into the buffer, making room for at least want bytes
+        (or read_size, whichever is larger) first.
+
+        Args:
+            want (int): number of bytes the caller is still missing
+        Returns:
+            bool: False if the socket disconnected
         """
-        curr_buf = b''
-        while True:
-            tried_to_recv = False
-            rec_buf = None
+        unread = self.end - self.start
+        target = max(want, self.read_size)
 
-            # Read the unparsed buf from previous receives
-            if self.rem_buf != None:
-                rec_buf = self.rem_buf
-                self.rem_buf = None
+        if len(self.buf) - self.end < target:
+            if len(self.buf) - unread >= target:
+                # Enough space overall, shift the unparsed bytes to the front
+                self.buf[0:unread] = self.buf[self.start:self.end]
             else:
-                tried_to_recv = True
-                rec_buf = self.socket.recv(2048)
+                # Allocate a new buffer rather than resizing, so views handed out
+                # earlier don't block the resize
+                new_buf = bytearray(max(2 * len(self.buf), unread + target))
+                new_buf[0:unread] = self.buf[self.start:self.end]
+                self.buf = new_buf
+            self.start = 0
+            self.end = unread
 
-            # Means the socket disconnected
-            if tried_to_recv and not rec_buf:
-                return None
+        with memoryview(self.buf) as view:
+            n_bytes = self.socket.recv_into(view[self.end:self.end + target])
+
+        # Means the socket disconnected
+        if n_bytes == 0:
+            return False
 
-            idx = rec_buf.find(b'\n')
-            buf_len = len(curr_buf)
-            curr_buf += rec_buf
+        self.end += n_bytes
+        return True
 
+    def read_line_view(self):
+        """
+        Retrieves data until it sees a newline delimiter, without the delimiter.
+        The returned view is only valid until the next read on this helper.
+
+        Returns:
+            memoryview | None: the line, or None if the socket disconnected
+        """
+        searched = 0
+        while True:
+            idx = self.buf.find(b'\n', self.start + searched, self.end)
             if idx != -1:
                 break
 
-        buf_idx = idx + buf_len
-        if idx < len(rec_buf) - 1:
-            self.rem_buf = rec_buf[idx+1:]
-        # Don't want to include the newline so don't include buf_idx
-        header = curr_buf[:buf_idx]
-        return header
+            searched = self.end - self.start
+            if searched > self.max_frame_size:
+                raise ValueError(f"Line exceeds max frame size of {self.max_frame_size} bytes")
 
-    def get_n_bytes_of_data(self, n_bytes):
-        """
-        Recieves n_bytes of data
+            if not self._recv(0):
+                return None
 
-        arguments:
-        n_bytes -- number of bytes in data
+        line = memoryview(self.buf)[self.start:idx]
+        self.start = idx + 1
+        if self.start == self.end:
+            self.start = self.end = 0
+        return line
+
+    def read_exact_view(self, n_bytes):
         """
-        curr_buf = b''
-        msg_len = 0
-        while True:
-            tried_to_recv = False
-            rec_buf = None
+        Retrieves exactly n_bytes of data.
+        The returned view is only valid until the next read on this helper.
 
-            # Read the unparsed buf from previous receives
-            if self.rem_buf != None:
-                rec_buf = self.rem_buf
-                self.rem_buf = None
-            else:
-                tried_to_recv = True
-                rec_buf = self.socket.recv(4096)
+        Args:
+            n_bytes (int): number of bytes in data
+        Returns:
+            memoryview | None: the data, or None if the socket disconnected
+        """
+        if n_bytes > self.max_frame_size:
+            raise ValueError(f"Message of {n_bytes} bytes exceeds max frame size of {self.max_frame_size} bytes")
 
-            # Means the socket disconnected
-            if tried_to_recv and not rec_buf:
+        while self.end - self.start < n_bytes:
+            if not self._recv(n_bytes - (self.end - self.start)):
                 return None
 
-            msg_len += len(rec_buf)
-            curr_buf += rec_buf
+        data = memoryview(self.buf)[self.start:self.start + n_bytes]
+        self.start += n_bytes
+        if self.start == self.end:
+            self.start = self.end = 0
+        return data
 
-            if msg_len >= n_bytes:
-                break
+    def get_data_until_newline(self):
+        """
+        Retrieves data until it sees a newline delimiter.
 
-        if msg_len > n_bytes:
-            self.rem_buf = curr_buf[n_bytes:]
+        Returns:
+            bytes | None: the line (without the newline), or None if the socket disconnected
+        """
+        line = self.read_line_view()
+        if line == None:
+            return None
+        return bytes(line)
 
-        data = curr_buf[:n_bytes]
-        return data
\ No newline at end of file
+    def get_n_bytes_of_data(self, n_bytes):
+        """
+        Recieves n_bytes of data
+
+        arguments:
+        n_bytes -- number of bytes in data
+        """
+        data = self.read_exact_view(n_bytes)
+        if data == None:
+            return None
+        return bytes(data)
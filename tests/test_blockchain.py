@@ -0,0 +1,61 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blockchain import Blockchain, find_fork_point, prefer_chain
+from transaction import PEM_PREFIX, key_fingerprint
+
+class FakeTxn:
+    def __init__(self, sender):
+        self.sender = sender
+
+    def sender_is_fingerprint(self):
+        return not self.sender.startswith(PEM_PREFIX)
+
+class FakeBlock:
+    def __init__(self, _id, sender):
+        self.id = _id
+        self.txns = [FakeTxn(sender)]
+        self.hash = f"hash{_id}"
+
+def key(i):
+    return PEM_PREFIX + f"key{i}".encode()
+
+class BlockchainTest(unittest.TestCase):
+
+    def setUp(self):
+        # Keys registered by blocks 0, 2 and 4, the others refer to key 0 by fingerprint
+        self.blocks = [FakeBlock(i, key(i) if i % 2 == 0 else key_fingerprint(key(0))) for i in range(6)]
+        self.blockchain = Blockchain(self.blocks[:])
+
+    def test_copy_keeps_key_registry(self):
+        copy = self.blockchain.copy()
+        self.assertEqual(copy.keys, self.blockchain.keys)
+        self.assertIsNot(copy.keys, self.blockchain.keys)
+        self.assertEqual(copy.chain, self.blockchain.chain)
+
+    def test_prefix_copy_only_has_prefix_keys(self):
+        copy = self.blockchain.copy(3)
+        self.assertEqual(len(copy.chain), 3)
+        self.assertEqual(copy.keys, Blockchain(self.blocks[:3]).keys)
+        self.assertNotIn(key_fingerprint(key(4)), copy.keys)
+
+    def test_find_fork_point(self):
+        locator = [(7, "other"), (4, "hash4"), (0, "hash0")]
+        self.assertEqual(find_fork_point(self.blocks, locator), 4)
+        self.assertEqual(find_fork_point(self.blocks, [(3, "other")]), -1)
+
+    def test_prefer_chain(self):
+        other = self.blocks[:5] + [FakeBlock(5, key(1))]
+        other[5].hash = "hash0"
+        self.assertTrue(prefer_chain(self.blocks + [FakeBlock(6, key(1))], other))
+        self.assertFalse(prefer_chain(self.blocks[:5], other))
+        # Same length, the lower tip hash wins
+        self.assertTrue(prefer_chain(other, self.blocks))
+        self.assertFalse(prefer_chain(self.blocks, other))
+        self.assertFalse(prefer_chain(self.blocks, self.blocks))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from poll_index import PollIndex
+
+class FakeTxn:
+    def __init__(self, signature, data):
+        self.signature = signature
+        self.data = data
+
+class FakeBlock:
+    def __init__(self, _id, txns):
+        self.id = _id
+        self.txns = txns
+        self.hash = f"hash{_id}"
+
+def vote_block(_id, tag=b""):
+    return FakeBlock(_id, [FakeTxn(tag + str(_id).encode(), {"transaction_type": "vote", "poll_id": "p", "vote": "a"})])
+
+class PollIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = PollIndex()
+        self.chain = [FakeBlock(0, [FakeTxn(b"g", {"transaction_type": "create_poll", "poll_id": "p", "poll_name": "x", "options": ["a"]})])]
+        for i in range(1, 6):
+            self.chain.append(vote_block(i))
+        self.index.update(self.chain)
+
+    def test_old_views_unchanged_by_fork_switch(self):
+        before = self.index.get_view()
+        fork_chain = self.chain[:4] + [vote_block(4, b"f"), vote_block(5, b"f"), vote_block(6, b"f")]
+        self.index.update(fork_chain)
+        after = self.index.get_view()
+
+        self.assertEqual(before["txns"].get(b"5".hex()), 5)
+        self.assertNotIn(b"f5".hex(), before["txns"])
+        self.assertNotIn(b"5".hex(), after["txns"])
+        self.assertEqual(after["txns"][b"f5".hex()], 5)
+        self.assertEqual(after["txns"][b"3".hex()], 3)
+        self.assertEqual(len(before["txns"]), 6)
+        self.assertEqual(len(after["txns"]), 7)
+        self.assertEqual(before["results"]["p"]["a"], 5)
+        self.assertEqual(after["results"]["p"]["a"], 6)
+
+    def test_txn_mined_again_after_fork_switch(self):
+        before = self.index.get_view()
+        fork_chain = self.chain[:5] + [FakeBlock(5, [FakeTxn(b"other", {})]), FakeBlock(6, [FakeTxn(b"5", {})])]
+        self.index.update(fork_chain)
+
+        self.assertEqual(self.index.get_view()["txns"][b"5".hex()], 6)
+        self.assertEqual(before["txns"][b"5".hex()], 5)
+
+    def test_later_blocks_not_in_earlier_view(self):
+        before = self.index.get_view()
+        self.chain.append(vote_block(6))
+        self.index.update(self.chain)
+
+        self.assertNotIn(b"6".hex(), before["txns"])
+        self.assertEqual(self.index.get_view()["txns"][b"6".hex()], 6)
+        self.assertEqual(before["height"], 5)
+
+    def test_dropped_placements_pruned_once_old_views_are_gone(self):
+        before = self.index.get_view()
+        self.index.update(self.chain[:4] + [vote_block(4, b"f"), vote_block(5, b"f")])
+        self.chain = self.index.blocks[:]
+
+        # The view from before the fork switch can still find the dropped transaction
+        self.assertIn(b"5".hex(), self.index.placements)
+        self.assertEqual(before["txns"][b"5".hex()], 5)
+
+        del before
+        self.chain.append(vote_block(6, b"f"))
+        self.index.update(self.chain)
+        self.assertNotIn(b"5".hex(), self.index.placements)
+        self.assertNotIn(b"4".hex(), self.index.placements)
+        self.assertEqual(self.index.get_view()["txns"][b"f5".hex()], 5)
+        self.assertEqual(self.index.get_view()["txns"][b"3".hex()], 3)
+
+    def test_views_share_what_didnt_change(self):
+        before = self.index.get_view()
+        self.chain.append(vote_block(6))
+        self.index.update(self.chain)
+        after = self.index.get_view()
+
+        self.assertIs(after["polls"], before["polls"])
+        self.assertIsNot(after["results"], before["results"])
+        self.assertEqual(before["results"]["p"]["a"], 5)
+        self.assertEqual(after["results"]["p"]["a"], 6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from profiler import TimedLock
+
+class TimedLockTest(unittest.TestCase):
+
+    def test_condition_checks_not_counted(self):
+        lock = TimedLock()
+        cond = threading.Condition(lock)
+        with cond:
+            for _ in range(10):
+                cond.notify()
+        self.assertEqual(lock.stats()["acquisitions"], 1)
+        self.assertEqual(lock.stats()["contended"], 0)
+
+    def test_condition_owner_is_the_holder(self):
+        lock = TimedLock()
+        cond = threading.Condition(lock)
+        with self.assertRaises(RuntimeError):
+            cond.notify()
+
+        lock.acquire()
+        errors = []
+        def notify_without_lock():
+            try:
+                cond.notify()
+            except RuntimeError as e:
+                errors.append(e)
+        thread = threading.Thread(target=notify_without_lock)
+        thread.start()
+        thread.join()
+        lock.release()
+        # Another thread holding the lock doesn't make this one its owner
+        self.assertEqual(len(errors), 1)
+
+    def test_condition_wait_and_notify(self):
+        lock = TimedLock()
+        cond = threading.Condition(lock)
+        ready = []
+        def waiter():
+            with cond:
+                cond.wait_for(lambda: len(ready) > 0, 5)
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        with cond:
+            ready.append(True)
+            cond.notify()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(lock.locked())
+        # The waiter's acquire, ours, and the waiter's acquire after waking up (if it had to wait)
+        self.assertGreaterEqual(lock.stats()["acquisitions"], 2)
+        self.assertLessEqual(lock.stats()["acquisitions"], 3)
+
+if __name__ == '__main__':
+    unittest.main()
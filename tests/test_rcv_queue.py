@@ -0,0 +1,48 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rcv_queue import ReceiveQueue
+
+class FakeBlock:
+    def __init__(self, _id, block_hash):
+        self.id = _id
+        self.hash = block_hash
+
+def item(_id, block_hash=None):
+    return {"payload": FakeBlock(_id, block_hash if block_hash != None else f"hash{_id}")}
+
+class ReceiveQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = ReceiveQueue(stale_slack=2)
+        self.queue.set_tip(10)
+
+    def test_blocks_at_or_just_below_tip_queued(self):
+        self.assertTrue(self.queue.put(item(10)))
+        self.assertTrue(self.queue.put(item(8)))
+        self.assertFalse(self.queue.put(item(7)))
+        self.assertEqual(self.queue.stats()["dropped_stale"], 1)
+
+    def test_duplicates_dropped(self):
+        self.assertTrue(self.queue.put(item(10)))
+        self.assertFalse(self.queue.put(item(10)))
+        self.assertEqual(self.queue.get(0)["payload"].id, 10)
+        self.assertFalse(self.queue.put(item(10)))
+        self.assertEqual(self.queue.stats()["dropped_duplicate"], 2)
+
+    def test_block_extending_tip_first_then_highest(self):
+        for _id in [9, 13, 11, 12]:
+            self.queue.put(item(_id))
+        self.assertEqual([self.queue.get(0)["payload"].id for _ in range(4)], [11, 13, 12, 9])
+
+    def test_blocks_going_stale_while_queued_dropped(self):
+        self.queue.put(item(9))
+        self.queue.set_tip(12)
+        self.assertEqual(self.queue.get(0), None)
+        self.assertEqual(self.queue.stats()["dropped_stale"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import socket
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simulator import Simulator
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class SimulatorTest(unittest.TestCase):
+
+    def setUp(self):
+        # The peers write their logs to the working directory
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_gossip_converges(self):
+        # Default gossip_fanout, with enough latency that blocks mined at the same height race each other
+        sim = Simulator(free_port(), 47500, 10, 3, {"latency": 0.01, "seed": 1, "convergence_timeout": 20})
+        try:
+            results = sim.run(sim.start(), 10, 2)
+        finally:
+            sim.stop()
+
+        self.assertTrue(results["converged"])
+        self.assertEqual(results["peers_on_final_tip"], 10)
+        self.assertGreater(results["confirmed"], 0)
+
+    def test_sampled_peers_start(self):
+        # Sampled peers don't keep the tracker's directory, start() has to wait for their samples instead
+        scenario = {"seed": 1, "convergence_timeout": 20, "peer_config": {"peer_sample_size": 4}}
+        sim = Simulator(free_port(), 47600, 8, 3, scenario)
+        try:
+            results = sim.run(sim.start(), 8, 1)
+        finally:
+            sim.stop()
+
+        self.assertTrue(results["converged"])
+        self.assertEqual(results["peers_on_final_tip"], 8)
+
+if __name__ == '__main__':
+    unittest.main()
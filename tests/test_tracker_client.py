@@ -0,0 +1,36 @@
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tracker_client import TrackerClient
+
+class TrackerClientTest(unittest.TestCase):
+
+    def setUp(self):
+        # A tracker that accepts the connection and never answers
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(1)
+        self.client = TrackerClient("127.0.0.1", self.server.getsockname()[1], lambda header, body: None)
+        self.conn, _ = self.server.accept()
+
+    def tearDown(self):
+        self.client.socket.close()
+        self.conn.close()
+        self.server.close()
+        self.client.log.close()
+
+    def test_timed_out_request_not_left_pending(self):
+        self.assertEqual(self.client.request("PING", "PONG", timeout=0.05), None)
+        self.assertEqual(self.client.pending, {})
+
+    def test_request_async_returns_id(self):
+        request_id, future = self.client.request_async("PING")
+        self.assertIs(self.client.pending[request_id], future)
+        self.assertEqual(self.conn.recv(64), f"REQ {request_id} PING\n".encode())
+
+if __name__ == '__main__':
+    unittest.main()
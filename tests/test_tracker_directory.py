@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from peer_directory import PeerDirectory
+from tracker import PeerConn, Tracker
+
+class FakeWriter:
+    """
+    Collects what the tracker writes to a peer's connection
+    """
+
+    def __init__(self):
+        self.msgs = []
+
+    def write(self, data):
+        self.msgs.append(data.decode())
+
+    def close(self):
+        pass
+
+class TrackerDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tracker = Tracker(0)
+        # Pushes are triggered by hand below instead of from the event loop
+        self.tracker.push_scheduled = True
+        self.peers = []
+        self.directories = []
+        for i in range(3):
+            peer = PeerConn()
+            peer.writer = FakeWriter()
+            peer.addr = ("127.0.0.1", 40000 + i)
+            peer.listening_port = str(5555 + i)
+            peer.pub_id = f"peer{i}".encode()
+            peer.heartbeat_interval = 1.0
+            self.tracker.add_peer(peer)
+            self.peers.append(peer)
+
+        for peer in self.peers:
+            directory = PeerDirectory()
+            self.apply(directory, self.tracker.serialize_directory(-1, peer.member_id).decode())
+            self.tracker.subscribers[peer] = self.tracker.version
+            self.directories.append(directory)
+
+    def tearDown(self):
+        self.tracker.tracker_sock.close()
+        self.tracker.log.close()
+
+    def apply(self, directory, msg):
+        header, body = msg.split("\n")[:2]
+        self.assertTrue(directory.apply(header, body))
+
+    def push(self):
+        for peer in self.peers:
+            peer.writer.msgs = []
+        self.tracker.push_changes()
+        self.tracker.push_scheduled = True
+        for peer, directory in zip(self.peers, self.directories):
+            for msg in peer.writer.msgs:
+                self.apply(directory, msg)
+
+    def own_node(self, i):
+        return ("127.0.0.1", int(self.peers[i].listening_port))
+
+    def test_suspect_and_revived_peer_not_in_own_directory(self):
+        suspect = self.peers[0]
+        suspect.last_seen = time.monotonic() - 10 * suspect.heartbeat_interval
+        self.tracker.suspect_misses = 2
+        self.tracker.miss_threshold = 100
+        self.tracker.check_heartbeats()
+        self.assertTrue(suspect.suspect)
+        self.push()
+        self.assertNotIn(self.own_node(0), self.directories[1].nodes())
+
+        self.tracker.heard_from(suspect)
+        self.assertFalse(suspect.suspect)
+        self.push()
+
+        # The others see it again, it never sees itself
+        self.assertIn(self.own_node(0), self.directories[1].nodes())
+        self.assertIn(self.own_node(0), self.directories[2].nodes())
+        self.assertNotIn(self.own_node(0), self.directories[0].nodes())
+        self.assertEqual(sorted(self.directories[0].nodes()), [self.own_node(1), self.own_node(2)])
+        for msg in suspect.writer.msgs:
+            self.assertNotIn(f"{suspect.member_id}:", msg.split("\n")[1])
+        self.assertEqual(self.directories[0].version, self.tracker.version)
+
+if __name__ == '__main__':
+    unittest.main()
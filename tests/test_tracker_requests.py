@@ -0,0 +1,73 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tracker import Tracker
+
+class FakeWriter:
+    """
+    Collects what the tracker writes to a peer's connection
+    """
+
+    def __init__(self):
+        self.data = b""
+        self.closed = False
+
+    def get_extra_info(self, name):
+        return ("127.0.0.1", 40000)
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+class TrackerRequestsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tracker = Tracker(0)
+        # Pushes to other peers aren't part of these tests
+        self.tracker.push_scheduled = True
+
+    def tearDown(self):
+        self.tracker.tracker_sock.close()
+        self.tracker.log.close()
+
+    def serve(self, data):
+        """
+        Runs a connection that joins and then sends data, until the tracker is done with it
+
+        Returns:
+            FakeWriter: what the tracker sent back
+        """
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_data(b"JOIN\n5555\nID 5\npeer0" + data)
+            reader.feed_eof()
+            writer = FakeWriter()
+            await self.tracker.process_peer_requests(reader, writer)
+            return writer
+        return asyncio.run(run())
+
+    def test_short_headers_get_an_error(self):
+        for header in [b"PING\n", b"LIST\n", b"SAMPLE 3\n", b"SYNC\n", b"REQ 1\n", b"REQ 1 GET-PEER\n"]:
+            writer = self.serve(header + b"STATS\n")
+            self.assertTrue(writer.closed)
+            # The peer list from joining, then the error instead of the STATS response
+            self.assertIn(b"\nERROR\nMalformed request", writer.data, header)
+            self.assertNotIn(b"STATS", writer.data, header)
+            self.assertEqual(len(self.tracker.active_peers), 0)
+
+    def test_well_formed_request_is_answered(self):
+        writer = self.serve(b"REQ 7 STATS\n")
+        self.assertIn(b"RESP 7 STATS\n", writer.data)
+        self.assertNotIn(b"ERROR", writer.data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import json
+import sys
+
+from tracker_load import percentile
+
+"""
+Merges the peers' block traces ({port}_trace.jsonl, see block_trace.py) into per-block propagation
+timelines and finds the slowest hops.
+
+A hop is a block going from one peer (the sender) to another (the receiver), split into stages:
+    broadcast   sender: from the block being on its chain (mined or added) until it was sent to the
+                receiver (the broadcast worker's queue, connecting and writing, see broadcast_block_to_all_peers)
+    transfer    from the send completing until the receiver's transport handed the block over (with
+                gossip this includes fetching the announced block)
+    queue       receiver: waiting in the rcv buffer until poll_from_rcv_buffer picked the block up
+    validate    receiver: checking the block's hash and signatures
+    add         receiver: waiting for the blockchain lock and adding the block
+The receiver's first received event names the sender, hops from untraced senders (or with an unknown
+sender) only have the receiver's stages.
+
+Usage:
+    python3 trace_collector.py {report file} {trace file} [{trace file} ...] [wall]
+
+Writes the timelines, the hops and a summary to the report file (json) and prints the summary and
+the slowest hops. Timestamps are compared on the monotonic clock, which is only the same for peers on
+one machine, with "wall" the wall clock times are used instead.
+"""
+
+SLOWEST_HOPS_LEN = 10
+STAGES = ("broadcast", "transfer", "queue", "validate", "add")
+
+def read_traces(paths):
+    """
+    Args:
+        paths (str[]): trace files
+    Returns:
+        dict: block hash -> events of every peer for the block, in time order
+    """
+    blocks = {}
+    for path in paths:
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if len(line) == 0:
+                    continue
+                event = json.loads(line)
+                if "hash" in event:
+                    blocks.setdefault(event["hash"], []).append(event)
+    for events in blocks.values():
+        events.sort(key=lambda event: event["t"])
+    return blocks
+
+def first_event(events, peer, name, after=None, **fields):
+    """
+    Args:
+        events (dict[]): a block's events in time order
+        peer (int): the peer whose event we want
+        name (str): the event, e.g. "received"
+        after (float | None): only events at or after this time
+        fields: fields the event has to have, e.g. to=50002
+    Returns:
+        dict | None: the first matching event
+    """
+    for event in events:
+        if event["peer"] == peer and event["event"] == name and (after == None or event["clock"] >= after) \
+                and all(event.get(key) == value for key, value in fields.items()):
+            return event
+    return None
+
+def block_timeline(events):
+    """
+    Args:
+        events (dict[]): a block's events in time order, each with its "clock" time
+    Returns:
+        tuple: (timeline dict, hop dicts) of the block. Times in the timeline are seconds from its origin.
+    """
+    mined = [event for event in events if event["event"] == "mined"]
+    origin = mined[0] if len(mined) > 0 else events[0]
+    start = origin["clock"]
+
+    peers = {}
+    for event in events:
+        peer_times = peers.setdefault(event["peer"], {})
+        if event["event"] in ["mined", "received", "validated", "added", "relayed"] and event["event"] not in peer_times:
+            peer_times[event["event"]] = event["clock"] - start
+    added = sorted(peer_times["added"] for peer_times in peers.values() if "added" in peer_times)
+    if "mined" in peers.get(origin["peer"], {}):
+        added = sorted(added + [0.0])
+
+    hops = []
+    for peer in peers:
+        received = first_event(events, peer, "received", queued=True)
+        if received == None:
+            continue
+        hop = {"hash": origin["hash"], "id": origin["id"], "sender": received.get("sender"), "receiver": peer}
+        for stage in STAGES:
+            hop[stage] = None
+
+        # The sender's side, if it's traced
+        sender = received.get("sender")
+        available = first_event(events, sender, "mined")
+        if available == None:
+            available = first_event(events, sender, "added")
+        sent = None
+        if available != None:
+            sent = first_event(events, sender, "sent", available["clock"], to=peer, error=None)
+        if sent != None:
+            hop["broadcast"] = sent["clock"] - available["clock"]
+            hop["transfer"] = received["clock"] - sent["clock"]
+
+        validated = first_event(events, peer, "validated", received["clock"])
+        if validated != None:
+            hop["validate"] = validated["verify_s"]
+            hop["queue"] = validated["clock"] - validated["verify_s"] - received["clock"]
+            hop["valid"] = validated["valid"]
+            added_event = first_event(events, peer, "added", validated["clock"])
+            if added_event != None:
+                hop["add"] = added_event["clock"] - validated["clock"]
+        hop["total"] = sum(hop[stage] for stage in STAGES if hop[stage] != None)
+        hops.append(hop)
+
+    timeline = {
+        "hash": origin["hash"],
+        "id": origin["id"],
+        "origin": origin["peer"],
+        "mined": len(mined) > 0,
+        "peers": peers,
+        "reached": len(added),
+        "added_50pct": percentile(added, 50) if len(added) > 0 else None,
+        "added_90pct": percentile(added, 90) if len(added) > 0 else None,
+        "added_100pct": added[-1] if len(added) > 0 else None,
+        "send_errors": len([event for event in events if event["event"] == "sent" and "error" in event]),
+    }
+    return timeline, hops
+
+def collect(paths, clock="t"):
+    """
+    Args:
+        paths (str[]): trace files
+        clock (str): "t" to compare the monotonic timestamps, "wall" for the wall clock ones
+    Returns:
+        dict: per-block timelines, every hop, and a summary of the stages and block spread
+    """
+    blocks = read_traces(paths)
+    timelines = []
+    hops = []
+    for events in blocks.values():
+        for event in events:
+            event["clock"] = event[clock]
+        timeline, block_hops = block_timeline(events)
+        timelines.append(timeline)
+        hops.extend(block_hops)
+    timelines.sort(key=lambda timeline: (timeline["id"], timeline["hash"]))
+
+    def summary(values):
+        values = sorted(values)
+        return {"count": len(values), "p50": percentile(values, 50), "p90": percentile(values, 90),
+            "p99": percentile(values, 99), "max": percentile(values, 100)}
+
+    stages = {stage: summary([hop[stage] for hop in hops if hop[stage] != None]) for stage in STAGES + ("total",)}
+    spread = summary([timeline["added_100pct"] for timeline in timelines if timeline["mined"] and timeline["added_100pct"] != None])
+    hops.sort(key=lambda hop: hop["total"], reverse=True)
+    return {
+        "blocks": len(timelines),
+        "hops": len(hops),
+        "stages": stages,
+        "block_spread": spread,
+        "send_errors": sum(timeline["send_errors"] for timeline in timelines),
+        "invalid": len([hop for hop in hops if hop.get("valid") == False]),
+        "slowest_hops": hops[:SLOWEST_HOPS_LEN],
+        "timelines": timelines,
+        "all_hops": hops,
+    }
+
+def print_report(report):
+    print(f"{report['blocks']} blocks, {report['hops']} hops, {report['send_errors']} failed sends, {report['invalid']} invalid blocks received")
+    print(f"{'stage':<10} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for stage, stats in list(report["stages"].items()) + [("spread", report["block_spread"])]:
+        print(f"{stage:<10} {stats['count']:>7} {stats['p50'] * 1000:>9.2f} {stats['p90'] * 1000:>9.2f} {stats['p99'] * 1000:>9.2f} {stats['max'] * 1000:>9.2f}")
+    print("(spread: from a block being mined until it was on every traced peer's chain)")
+
+    print("slowest hops:")
+    for hop in report["slowest_hops"]:
+        stages = ", ".join(f"{stage} {hop[stage] * 1000:.2f}" for stage in STAGES if hop[stage] != None)
+        print(f"    block {hop['id']} {hop['sender']} -> {hop['receiver']}: {hop['total'] * 1000:.2f}ms ({stages})")
+
+if __name__ == '__main__':
+    report_file = sys.argv[1]
+    clock = "t"
+    paths = []
+    for arg in sys.argv[2:]:
+        if arg == "wall":
+            clock = "wall"
+        else:
+            paths.append(arg)
+
+    report = collect(paths, clock)
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=4)
+    print_report(report)
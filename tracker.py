@@ -1,222 +1,640 @@
+import asyncio
+import json
+import random
 import socket
-import threading
 import sys
-from socket_helper import SocketHelper
-
-MAX_QUEUED_CONNECTIONS = 5
-
-active_peers = {}
-active_peers_lock = threading.Lock()
+import time
+from collections import deque
+
+from peer_directory import FULL_SNAPSHOT, SAMPLE_FRESH, directory_header, member_item, item_member_id, weighted_sample
+from metrics import MetricsRegistry, METRICS_ADDR, METRICS_FILE_INTERVAL
+from logger import Logger, DEBUG, INFO
+
+MAX_QUEUED_CONNECTIONS = 4096
+MAX_ID_LEN = 64 * 1024
+# A LIST response has one entry per peer, so it can get long with many peers
+STREAM_LIMIT = 16 * 1024 * 1024
+# How many directory changes we keep to answer "changes since version V", older versions get a full snapshot
+DIRECTORY_LOG_LEN = 4096
+# Changes are pushed to subscribed peers in batches, at most this long after they happen
+PUSH_DELAY = 0.05
+# A peer that sends heartbeats is marked suspect after missing this many of them, and evicted after
+# missing HEARTBEAT_MISS_THRESHOLD of them
+HEARTBEAT_SUSPECT_MISSES = 2
+HEARTBEAT_MISS_THRESHOLD = 4
+HEARTBEAT_CHECK_INTERVAL = 0.5
+# Request types counted separately in the metrics, anything else is counted as "other"
+REQUEST_TYPES = ["JOIN", "PING", "STATS", "LEAVE", "LIST", "SAMPLE", "GET-PEER", "SYNC"]
+# How many space separated fields each request's header has at least, the request type included
+REQUEST_FIELDS = {"PING": 3, "LIST": 2, "SAMPLE": 4, "GET-PEER": 2, "SYNC": 2}
 
 """
 This is the implementation for the tracker,
 which is responsible for handling peer registration
-and keeping track of all the peers in the network
+and keeping track of all the peers in the network.
+
+Every peer keeps one persistent connection to the tracker. Connections are served by
+a single asyncio event loop (one coroutine per connection instead of one OS thread),
+so the tracker can hold thousands of peers on one core. All the state is only ever
+touched from the event loop, so it doesn't need a lock either.
+
+Membership is versioned (see peer_directory.py): every JOIN/LEAVE bumps the directory
+version and is logged, peers SYNC once and then get the changes pushed to them over their
+tracker connection, so they don't need to LIST before every broadcast.
+
+Peers send heartbeats ("PING {seq} {interval}"), so a peer that hangs or gets partitioned is
+noticed without waiting for its socket to close: it is marked suspect (left out of LIST and
+of everyone's directory) after a couple of missed heartbeats, and evicted after a few more.
+
+Metrics (requests per type, membership, see metrics.py) can be served in the Prometheus text
+format on a local port and/or written to a file. Both are done from the event loop too.
 """
 
-def delete_peer(peer_id):
+def raise_fd_limit():
     """
-    Deletes a peer from the list of trackd peers
+    Raises the soft limit on open files to the hard limit, since every peer connection
+    takes a file descriptor. Does nothing where the resource module isn't available.
 
-    Args:
-        peer_id (bytes): public ID of the peer
+    Returns:
+        int | None: the new soft limit, None if it couldn't be changed
     """
-    active_peers_lock.acquire()
-    del active_peers[peer_id]
-    active_peers_lock.release()
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    return soft
 
-def serialize_active_peers(peer_pub_id):
+class PeerConn:
+    """
+    Helper class to keep track of peer connection information
     """
-    Serializes all the active peers in the network except
-    for the requesting peer.
+    def __init__(self):
+        self.writer = None
+        self.addr = None
+        self.listening_port = None
+        self.pub_id = None
+        self.member_id = None
+        # Set once the peer sends heartbeats, we only check liveness of peers that do
+        self.heartbeat_interval = None
+        self.last_seen = time.monotonic()
+        self.suspect = False
 
-    Args:
-        peer_pub_id (bytes): public ID of the peer to be excluded
-    Returns:
-        str: serialized string of active peers
+class Tracker:
+    """
+    Main tracker class to handle tracker logic
     """
-    active_peers_lock.acquire()
+    def __init__(self, tracker_port, verbose=False, suspect_misses=HEARTBEAT_SUSPECT_MISSES,
+        miss_threshold=HEARTBEAT_MISS_THRESHOLD, metrics_port=None, metrics_file=None):
+        """
+        Args:
+            tracker_port (int): port to listen for peers on
+            verbose (bool): whether to log every request served (not just joins and leaves)
+            suspect_misses (int): missed heartbeats after which a peer is marked suspect
+            miss_threshold (int): missed heartbeats after which a peer is evicted
+            metrics_port (int | None): port to serve the metrics on (on localhost only)
+            metrics_file (str | None): file to write the metrics to every METRICS_FILE_INTERVAL seconds
+        """
+        self.verbose = verbose
+        # Printed to stdout by a background thread, so the event loop never waits on the terminal
+        self.log = Logger(level=DEBUG if verbose else INFO, prefix="")
+        self.suspect_misses = suspect_misses
+        self.miss_threshold = miss_threshold
+        self.suspect_count = 0
+        self.eviction_count = 0
+        self.active_peers = {}
+        # "{IP address},{Port}" for every active peer, kept so LIST doesn't rebuild them
+        self.peer_entries = {}
+
+        self.version = 0
+        self.next_member_id = 0
+        self.changes = deque(maxlen=DIRECTORY_LOG_LEN)  # (version, change item)
+        self.subscribers = {}  # PeerConn -> directory version it has
+        self.push_scheduled = False
+        self.tracker_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tracker_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tracker_sock.bind(('', tracker_port))
 
-    res = ['PEERS', '\n']
+        self.metrics_port = metrics_port
+        self.metrics_file = metrics_file
+        self.metrics = MetricsRegistry()
+        self.requests_counter = self.metrics.counter("tracker_requests_total", "Requests served, by type", ["type"])
+        self.metrics.gauge("tracker_peers", "Registered peers, by whether they're suspect", ["suspect"], function=self.count_peers)
+        self.metrics.gauge("tracker_subscribers", "Peers that get directory changes pushed", function=lambda: len(self.subscribers))
+        self.metrics.gauge("tracker_directory_version", "Version of the peer directory", function=lambda: self.version)
+        self.metrics.counter("tracker_suspects_total", "Times a peer was marked suspect", function=lambda: self.suspect_count)
+        self.metrics.counter("tracker_evictions_total", "Peers evicted for missing heartbeats", function=lambda: self.eviction_count)
+
+    def add_peer(self, peer):
+        """
+        Adds a peer to the list of tracked peers
 
-    exist_active_peers = False
-    for peer_id in active_peers:
-        if peer_id == peer_pub_id:
-            continue
-        peer = active_peers[peer_id]
-        exist_active_peers = True
-        res.append(peer.addr[0]) # IP address
-        res.append(',')
-        res.append(peer.listening_port)
-        res.append(' ')
+        Args:
+            peer (PeerConn): peer connection information
+        """
+        # A peer re-registering under the same ID replaces its old registration
+        old_peer = self.active_peers.get(peer.pub_id)
+        if old_peer != None:
+            self.delete_peer(old_peer)
+
+        peer.member_id = self.next_member_id
+        self.next_member_id += 1
+        entry = "".join([peer.addr[0], ",", peer.listening_port])
+        self.active_peers[peer.pub_id] = peer
+        self.peer_entries[peer.pub_id] = entry
+        self.record_change("+" + member_item(peer.member_id, entry))
+
+    def heard_from(self, peer):
+        """
+        Records that a peer is alive, clearing its suspect mark if it had one
 
-    if exist_active_peers:
-        res[-1] = '\n'
-    else:
-        res.append('\n')
+        Args:
+            peer (PeerConn): peer connection information
+        """
+        peer.last_seen = time.monotonic()
+        if peer.suspect and self.active_peers.get(peer.pub_id) is peer:
+            peer.suspect = False
+            self.log.info("heard_from", "Peer at %s is alive again", peer.addr)
+            self.record_change("+" + member_item(peer.member_id, self.peer_entries[peer.pub_id]))
 
-    active_peers_lock.release()
+    def check_heartbeats(self):
+        """
+        Marks peers that missed suspect_misses heartbeats as suspect and evicts the ones that
+        missed miss_threshold of them
+        """
+        now = time.monotonic()
+        for peer in list(self.active_peers.values()):
+            if peer.heartbeat_interval == None:
+                continue
+
+            missed = (now - peer.last_seen) / peer.heartbeat_interval
+            if missed >= self.miss_threshold:
+                self.log.warning("check_heartbeats", "Evicting peer at %s: missed %d heartbeats", peer.addr, int(missed))
+                self.eviction_count += 1
+                self.delete_peer(peer)
+                peer.writer.close()
+            elif missed >= self.suspect_misses and not peer.suspect:
+                self.log.warning("check_heartbeats", "Peer at %s is suspect: missed %d heartbeats", peer.addr, int(missed))
+                peer.suspect = True
+                self.suspect_count += 1
+                self.record_change("~" + member_item(peer.member_id, self.peer_entries[peer.pub_id]))
+
+    async def check_heartbeats_periodically(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_CHECK_INTERVAL)
+            self.check_heartbeats()
 
-    print(res)
+    def get_stats(self):
+        """
+        Returns:
+            dict: membership and liveness counters
+        """
+        return {
+            "peers": len(self.active_peers),
+            "suspect": sum(1 for peer in self.active_peers.values() if peer.suspect),
+            "subscribers": len(self.subscribers),
+            "directory_version": self.version,
+            "suspect_count": self.suspect_count,
+            "eviction_count": self.eviction_count
+        }
+
+    def count_peers(self):
+        """
+        Returns:
+            dict: number of registered peers by ("true",) if they're suspect, ("false",) otherwise
+        """
+        suspect = sum(1 for peer in self.active_peers.values() if peer.suspect)
+        return {("false",): len(self.active_peers) - suspect, ("true",): suspect}
 
-    return "".join(res)
+    def delete_peer(self, peer):
+        """
+        Deletes a peer from the list of tracked peers, if it's still the one registered
+        under its ID
 
-def process_peer_requests(peer):
-    """
-    Handles a peer's registration logic and requests for other peers
-    in the network.
+        Args:
+            peer (PeerConn): peer connection information
+        """
+        self.subscribers.pop(peer, None)
+        if self.active_peers.get(peer.pub_id) is peer:
+            del self.active_peers[peer.pub_id]
+            del self.peer_entries[peer.pub_id]
+            self.record_change("-" + str(peer.member_id))
 
-    Args:
-        peer (PeerConn): peer connection information
-    """
+    def record_change(self, item):
+        """
+        Bumps the directory version for a JOIN/LEAVE and schedules pushing it to subscribers
 
-    print("Connected to peer at:", peer.addr[0])
-    peer_socket_helper = SocketHelper(peer.socket)
-    # Listen for the join message
-    join_header_bytes = peer_socket_helper.get_data_until_newline()
-
-    # If the node disconnects or breaks protocol, terminate the thread immediately
-    if join_header_bytes == None:
-        return
-
-    # handle LEAVE message at connection, for shutdown logic
-    join_header = join_header_bytes.decode()
-    if join_header == "LEAVE":
-        print(f"Peer at {peer.addr[0]} is leaving the network")
-        peer.socket.close()
-        if hasattr(peer, 'pub_id') and peer.pub_id in active_peers:
-            delete_peer(peer.pub_id)
-        return
-    
-    if join_header != "JOIN":
-        return
-    
-    # Used to tell other peers which port to connect to
-    peer_listening_port = peer_socket_helper.get_data_until_newline().decode()
-    peer.listening_port = peer_listening_port
-
-    print("Peer listening port:",peer.listening_port)
-
-    pub_id_header_bytes = peer_socket_helper.get_data_until_newline()
-
-    if pub_id_header_bytes == None:
-        return
-
-    pub_id_header = pub_id_header_bytes.decode().split(' ')
-    if pub_id_header[0] != "ID":
-        return
-
-    pub_key_len = int(pub_id_header[1])
-
-    peer.pub_id = peer_socket_helper.get_n_bytes_of_data(pub_key_len)
-
-    # Once we recieve the peer ID, add it to the list
-    active_peers_lock.acquire()
-    active_peers[peer.pub_id] = peer
-    active_peers_lock.release()
-    
-    print("Peer ID (bytes):",peer.pub_id)
-
-    active_peers_str = serialize_active_peers(peer.pub_id)
-    active_peers_bytes = active_peers_str.encode()
-    peer.socket.sendall(active_peers_bytes)
-
-    # Listen for request to send list of peers
-    while True:
-        header_bytes = peer_socket_helper.get_data_until_newline()
-        if header_bytes == None:
-            break
-
-        header = header_bytes.decode()
-        header_arr = header.split(' ')
-        if header_arr[0] == "LEAVE":
-            print(f"Peer at {peer.addr[0]} is leaving the network")
-            break
-        elif header_arr[0] == "LIST":
-            print("Serving LIST request")
-
-            pub_id_len = int(header_arr[1])
-
-            peer_pub_id = peer_socket_helper.get_n_bytes_of_data(pub_id_len)
-            if peer_pub_id == None:
-                break
+        Args:
+            item (str): the change, see peer_directory.py
+        """
+        self.version += 1
+        self.changes.append((self.version, item))
+        if not self.push_scheduled and len(self.subscribers) > 0:
+            self.push_scheduled = True
+            asyncio.get_running_loop().call_later(PUSH_DELAY, self.push_changes)
 
-            active_peers_str = serialize_active_peers(peer_pub_id)
+    def has_changes_since(self, since_version):
+        """
+        Args:
+            since_version (int): a directory version
+        Returns:
+            bool: whether the change log still has every change after since_version
+        """
+        oldest = self.changes[0][0] if len(self.changes) > 0 else self.version + 1
+        return since_version >= oldest - 1 and since_version <= self.version
 
-            print("Sending peers:", active_peers_str)
+    def serialize_directory(self, since_version, exclude_member_id=None):
+        """
+        Serializes the changes since a directory version, or a full snapshot if we
+        no longer have all of them
+
+        Args:
+            since_version (int): the version the peer has, FULL_SNAPSHOT for none
+            exclude_member_id (int | None): leave this member out (the requesting peer), peers never
+                keep themselves in their directory
+        Returns:
+            bytes: DIRECTORY message
+        """
+        if not self.has_changes_since(since_version):
+            items = [("~" if peer.suspect else "") + member_item(peer.member_id, self.peer_entries[pub_id])
+                for pub_id, peer in self.active_peers.items() if peer.member_id != exclude_member_id]
+            header = directory_header(FULL_SNAPSHOT, self.version)
+        else:
+            items = []
+            for version, item in reversed(self.changes):
+                if version <= since_version:
+                    break
+                if exclude_member_id == None or item_member_id(item) != exclude_member_id:
+                    items.append(item)
+            items.reverse()
+            header = directory_header(since_version, self.version)
+        return "".join([header, "\n", " ".join(items), "\n"]).encode()
+
+    def push_changes(self):
+        """
+        Pushes the changes each subscribed peer doesn't have yet. Peers are usually all at the
+        same version, so the message is serialized once per version rather than once per peer.
+        Only a peer the changes are about (e.g. it was suspect and is alive again) gets its own
+        message, without those changes.
+        """
+        self.push_scheduled = False
+        msgs = {}
+        changed_members = {}  # version -> IDs of the members that changed since
+        for peer, version in self.subscribers.items():
+            if version == self.version:
+                continue
+            if not self.has_changes_since(version):
+                # Fell too far behind, needs its own snapshot (without itself in it)
+                peer.writer.write(self.serialize_directory(version, peer.member_id))
+                self.subscribers[peer] = self.version
+                continue
+
+            if version not in changed_members:
+                changed_members[version] = set(item_member_id(item) for item_version, item in self.changes if item_version > version)
+            if peer.member_id in changed_members[version]:
+                peer.writer.write(self.serialize_directory(version, peer.member_id))
+            else:
+                if version not in msgs:
+                    msgs[version] = self.serialize_directory(version)
+                peer.writer.write(msgs[version])
+            self.subscribers[peer] = self.version
 
-            active_peers_bytes = active_peers_str.encode()
+    def sample_peers(self, k, weighting, peer_pub_id):
+        """
+        Picks up to k random active peers (not suspect), except for the requesting peer
+
+        Args:
+            k (int): how many peers to pick
+            weighting (str): one of SAMPLE_WEIGHTINGS, with SAMPLE_FRESH peers we heard from recently
+                are more likely to be picked
+            peer_pub_id (bytes): public ID of the peer to be excluded
+        Returns:
+            bytes: serialized sampled peers, in the same format as for LIST
+        """
+        peers = [peer for pub_id, peer in self.active_peers.items() if pub_id != peer_pub_id and not peer.suspect]
+        if weighting == SAMPLE_FRESH:
+            now = time.monotonic()
+            # Weight halves for every second since we last heard from the peer
+            sample = weighted_sample(peers, [2 ** -(now - peer.last_seen) + 1e-9 for peer in peers], k)
+        else:
+            sample = random.sample(peers, min(k, len(peers)))
 
-            # Send list of peers
-            peer.socket.sendall(active_peers_bytes)
-        elif header_arr[0] == "GET-PEER":
-            print("Serving GET-PEER request")
+        entries = [self.peer_entries[peer.pub_id] for peer in sample]
+        return "".join(["PEERS\n", " ".join(entries), "\n"]).encode()
 
-            pub_id_len = int(header_arr[1])
+    def serialize_active_peers(self, peer_pub_id):
+        """
+        Serializes all the active peers in the network except
+        for the requesting peer.
 
-            peer_pub_id = peer_socket_helper.get_n_bytes_of_data(pub_id_len)
-            if peer_pub_id == None:
-                break
+        Args:
+            peer_pub_id (bytes): public ID of the peer to be excluded
+        Returns:
+            bytes: serialized active peers
+        """
+        entries = [entry for peer_id, entry in self.peer_entries.items()
+            if peer_id != peer_pub_id and not self.active_peers[peer_id].suspect]
+        return "".join(["PEERS\n", " ".join(entries), "\n"]).encode()
 
-            msg = ["PEER-PORT", "\n"]
-            active_peers_lock.acquire()
-            if peer_pub_id in active_peers:
-                msg.append(str(active_peers[peer_pub_id].listening_port))
-                msg.append("\n")
-            else:
-                msg.append("-1")
-                msg.append("\n")
-            active_peers_lock.release()
-            peer.socket.sendall("".join(msg).encode())
-            print("Sending ", "".join(msg))
-        else:
-            print("Unrecognized request type")
+    def serialize_peer_port(self, peer_pub_id):
+        """
+        Serializes the listening port of a peer, -1 if the peer isn't known
 
-    # If connection closed, remove peer from list
-    peer.socket.close()
-    if hasattr(peer, 'pub_id'):
-        delete_peer(peer.pub_id)
+        Args:
+            peer_pub_id (bytes): public ID of the peer
+        Returns:
+            bytes: PEER-PORT message
+        """
+        peer = self.active_peers.get(peer_pub_id)
+        port = "-1" if peer == None else str(peer.listening_port)
+        return "".join(["PEER-PORT\n", port, "\n"]).encode()
 
-    print("Disconnected peer at " + str(peer.addr))
-    
-class PeerConn:
-    """
-    Helper class to keep track of peer connection information
-    """
-    def __init__(self):
-        self.socket = None
-        self.addr = None
-        self.listening_port = None
-        self.pub_id = None
+    async def read_line(self, reader):
+        """
+        Reads a line from a peer
 
-class Tracker:
-    """
-    Main tracker class to handle tracker logic
-    """
-    def __init__(self, tracker_port):
-        self.threads = []
-        self.threads_list_lock = threading.Lock()
-        self.tracker_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.tracker_sock.bind(('', tracker_port))
+        Args:
+            reader (asyncio.StreamReader): the peer's stream
+        Returns:
+            str | None: the line without the newline, None if the peer disconnected
+        """
+        try:
+            line = await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError:
+            return None
+        return line[:-1].decode()
 
-    def listen_for_connections(self):
+    async def read_pub_id(self, reader, pub_id_len):
         """
-        Listens for new peers and spins up a thread to process peer requests
-        once it finds a new one
+        Reads a public ID of pub_id_len bytes from a peer
+
+        Args:
+            reader (asyncio.StreamReader): the peer's stream
+            pub_id_len (int): length of the ID in bytes
+        Returns:
+            bytes | None: the ID, None if the peer disconnected
         """
-        print("Started main listening thread.")
-        self.tracker_sock.listen(MAX_QUEUED_CONNECTIONS)
+        if pub_id_len < 0 or pub_id_len > MAX_ID_LEN:
+            raise ValueError(f"Invalid ID length {pub_id_len}")
+        try:
+            return await reader.readexactly(pub_id_len)
+        except asyncio.IncompleteReadError:
+            return None
+
+    def check_fields(self, header_arr, num_fields):
+        """
+        Makes sure a request's header has the fields we're about to read
+
+        Args:
+            header_arr (str[]): the header, split on spaces
+            num_fields (int): how many fields it needs at least
+        """
+        if len(header_arr) < num_fields:
+            raise ValueError(f"Malformed request {' '.join(header_arr)!r}, expected at least {num_fields} fields")
+
+    async def process_peer_requests(self, reader, writer):
+        """
+        Handles a peer's registration logic and requests for other peers
+        in the network.
+
+        Args:
+            reader (asyncio.StreamReader): the peer's stream
+            writer (asyncio.StreamWriter): the peer's stream
+        """
+        peer = PeerConn()
+        peer.addr = writer.get_extra_info("peername")
+        peer.writer = writer
+
+        self.log.info("process_peer_requests", "Connected to peer at: %s", peer.addr[0])
+        try:
+            await self.serve_peer(peer, reader, writer)
+        except ValueError as e:
+            # A malformed request: tell the peer what was wrong with it before dropping it
+            self.log.warning("process_peer_requests", "Dropping peer at %s: %r", peer.addr, e)
+            try:
+                writer.write("".join(["ERROR\n", str(e), "\n"]).encode())
+                await writer.drain()
+            except ConnectionError:
+                pass
+        except (ConnectionError, asyncio.LimitOverrunError) as e:
+            self.log.warning("process_peer_requests", "Dropping peer at %s: %r", peer.addr, e)
+        finally:
+            # If connection closed, remove peer from list
+            writer.close()
+            if peer.pub_id != None:
+                self.delete_peer(peer)
+            self.log.info("process_peer_requests", "Disconnected peer at %s", peer.addr)
+
+    async def serve_peer(self, peer, reader, writer):
+        """
+        Registers a peer, then serves its requests until it leaves or disconnects
+
+        Args:
+            peer (PeerConn): peer connection information
+            reader (asyncio.StreamReader): the peer's stream
+            writer (asyncio.StreamWriter): the peer's stream
+        """
+        # Listen for the join message
+        join_header = await self.read_line(reader)
+
+        # If the node disconnects or breaks protocol, drop the connection immediately
+        if join_header == None:
+            return
+
+        # handle LEAVE message at connection, for shutdown logic
+        if join_header == "LEAVE":
+            self.log.info("serve_peer", "Peer at %s is leaving the network", peer.addr[0])
+            return
+
+        if join_header != "JOIN":
+            return
+
+        # Used to tell other peers which port to connect to
+        listening_port = await self.read_line(reader)
+        if listening_port == None:
+            return
+        peer.listening_port = str(int(listening_port))
+
+        self.log.info("serve_peer", "Peer listening port: %s", peer.listening_port)
+
+        pub_id_header = await self.read_line(reader)
+        if pub_id_header == None:
+            return
+
+        pub_id_header = pub_id_header.split(' ')
+        if pub_id_header[0] != "ID":
+            return
+        self.check_fields(pub_id_header, 2)
+
+        peer.pub_id = await self.read_pub_id(reader, int(pub_id_header[1]))
+        if peer.pub_id == None:
+            return
+        # "ID {no of ID bytes} {k} {weighting}" asks for a sample of k peers instead of all of them
+        join_sample = None
+        if len(pub_id_header) > 3:
+            join_sample = (int(pub_id_header[2]), pub_id_header[3])
+
+        # Once we recieve the peer ID, add it to the list
+        self.add_peer(peer)
+        self.requests_counter.inc(("JOIN",))
+
+        self.log.debug("serve_peer", "Peer ID (bytes): %s", peer.pub_id)
+
+        if join_sample != None:
+            writer.write(self.sample_peers(join_sample[0], join_sample[1], peer.pub_id))
+        else:
+            writer.write(self.serialize_active_peers(peer.pub_id))
+        await writer.drain()
+
+        # Listen for request to send list of peers
         while True:
-            peer_socket, addr = self.tracker_sock.accept()
+            header = await self.read_line(reader)
+            if header == None:
+                break
+            self.heard_from(peer)
+
+            header_arr = header.split(' ')
+            # "REQ {request ID} {request}" gets its response tagged with "RESP {request ID} ", so the
+            # peer can have several requests in flight and match the responses up
+            tag = b""
+            if header_arr[0] == "REQ":
+                self.check_fields(header_arr, 3)
+                tag = "".join(["RESP ", header_arr[1], " "]).encode()
+                header_arr = header_arr[2:]
+            self.requests_counter.inc((header_arr[0] if header_arr[0] in REQUEST_TYPES else "other",))
+            self.check_fields(header_arr, REQUEST_FIELDS.get(header_arr[0], 1))
+
+            if header_arr[0] == "PING":
+                peer.heartbeat_interval = float(header_arr[2])
+                if peer.heartbeat_interval <= 0:
+                    raise ValueError(f"Invalid heartbeat interval {peer.heartbeat_interval}")
+                msg = "".join(["PONG\n", header_arr[1], "\n"]).encode()
+            elif header_arr[0] == "STATS":
+                msg = "".join(["STATS\n", json.dumps(self.get_stats()), "\n"]).encode()
+            elif header_arr[0] == "LEAVE":
+                self.log.info("serve_peer", "Peer at %s is leaving the network", peer.addr[0])
+                break
+            elif header_arr[0] == "LIST":
+                peer_pub_id = await self.read_pub_id(reader, int(header_arr[1]))
+                if peer_pub_id == None:
+                    break
+
+                msg = self.serialize_active_peers(peer_pub_id)
+                self.log.debug("serve_peer", "Sending peers: %s", msg)
+            elif header_arr[0] == "SAMPLE":
+                peer_pub_id = await self.read_pub_id(reader, int(header_arr[3]))
+                if peer_pub_id == None:
+                    break
+
+                msg = self.sample_peers(int(header_arr[1]), header_arr[2], peer_pub_id)
+                self.log.debug("serve_peer", "Sending sampled peers: %s", msg)
+            elif header_arr[0] == "GET-PEER":
+                peer_pub_id = await self.read_pub_id(reader, int(header_arr[1]))
+                if peer_pub_id == None:
+                    break
+
+                msg = self.serialize_peer_port(peer_pub_id)
+                self.log.debug("serve_peer", "Sending %s", msg)
+            elif header_arr[0] == "SYNC":
+                msg = self.serialize_directory(int(header_arr[1]), peer.member_id)
+                self.log.debug("serve_peer", "Sending directory: %s", msg)
+                # From now on, the peer gets changes pushed to it
+                self.subscribers[peer] = self.version
+            else:
+                self.log.warning("serve_peer", "Unrecognized request type %s", header_arr[0])
+                continue
+
+            writer.write(tag + msg)
+            # Only waits if the peer isn't reading its responses fast enough
+            await writer.drain()
+
+    async def serve(self):
+        """
+        Serves peer connections on the event loop until cancelled
+        """
+        self.tracker_sock.listen(MAX_QUEUED_CONNECTIONS)
+        self.tracker_sock.setblocking(False)
+        server = await asyncio.start_server(self.process_peer_requests, sock=self.tracker_sock,
+            limit=STREAM_LIMIT, backlog=MAX_QUEUED_CONNECTIONS)
+        self.heartbeat_task = asyncio.create_task(self.check_heartbeats_periodically())
+        if self.metrics_port != None:
+            self.metrics_server = await asyncio.start_server(self.serve_metrics_request, METRICS_ADDR, self.metrics_port)
+        if self.metrics_file != None:
+            self.metrics_task = asyncio.create_task(self.write_metrics_periodically())
+        async with server:
+            await server.serve_forever()
+
+    async def serve_metrics_request(self, reader, writer):
+        """
+        Answers one HTTP request for the metrics ("GET /metrics")
 
-            peer = PeerConn()
-            peer.addr = addr
-            peer.socket = peer_socket
+        Args:
+            reader (asyncio.StreamReader): the client's stream
+            writer (asyncio.StreamWriter): the client's stream
+        """
+        try:
+            request_line = (await reader.readline()).decode().split(' ')
+            # Skip the headers
+            while (await reader.readline()) not in [b"\r\n", b"\n", b""]:
+                pass
+
+            if len(request_line) >= 2 and request_line[0] == "GET" and request_line[1].split('?', 1)[0] == "/metrics":
+                body = self.metrics.to_prometheus().encode()
+                status = "200 OK"
+            else:
+                body = b"Not found\n"
+                status = "404 Not Found"
+            writer.write("".join(["HTTP/1.0 ", status, "\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: ",
+                str(len(body)), "\r\n\r\n"]).encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def write_metrics_periodically(self):
+        """
+        Writes the metrics to metrics_file every METRICS_FILE_INTERVAL seconds
+        """
+        while True:
+            await asyncio.sleep(METRICS_FILE_INTERVAL)
+            try:
+                self.metrics.write_file(self.metrics_file)
+            except OSError as e:
+                self.log.error("write_metrics_periodically", "Error writing metrics to %s: %s", self.metrics_file, e)
 
-            peer_conn_thread = threading.Thread(target=process_peer_requests, args=(peer,))
-            peer_conn_thread.start()
+    def listen_for_connections(self):
+        """
+        Listens for new peers and serves each one on the event loop
+        """
+        self.log.info("listen_for_connections", "Started main listening thread.")
+        raise_fd_limit()
+        asyncio.run(self.serve())
 
 if __name__ == '__main__':
     tracker_port = sys.argv[1]
-    tracker = Tracker(int(tracker_port))
-    tracker.listen_for_connections()    
\ No newline at end of file
+    verbose = False
+    metrics_port = None
+    metrics_file = None
+    # Optional: "verbose", a port number to serve the metrics on, and/or a file name to write them to
+    for arg in sys.argv[2:]:
+        if arg == "verbose":
+            verbose = True
+        elif arg.isdigit():
+            metrics_port = int(arg)
+        else:
+            metrics_file = arg
+    tracker = Tracker(int(tracker_port), verbose, metrics_port=metrics_port, metrics_file=metrics_file)
+    try:
+        tracker.listen_for_connections()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tracker.log.close()
@@ -0,0 +1,251 @@
+import itertools
+import socket
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from socket_helper import SocketHelper
+from logger import Logger
+from profiler import TimedLock
+
+REQUEST_TIMEOUT = 5.0
+PORT_CACHE_TTL = 30.0
+
+class TrackerClient:
+    """
+    A peer's connection to the tracker.
+
+    Requests are tagged with a request ID ("REQ {request ID} {request}") and the tracker tags
+    its responses the same way ("RESP {request ID} {response}"), so any number of threads can
+    have requests in flight at the same time instead of taking turns on the socket. A single
+    reader thread reads everything the tracker sends: tagged responses complete the matching
+    request's future, everything else (directory pushes, heartbeat replies) goes to on_push.
+
+    Listening ports looked up by peer ID are cached for PORT_CACHE_TTL seconds.
+    """
+
+    def __init__(self, tracker_addr, tracker_port, on_push, log=None):
+        """
+        Args:
+            tracker_addr (str): ip address of the tracker
+            tracker_port (int): the tracker port
+            on_push (function): called with (header, body bytes) for every untagged message from the tracker
+            log (Logger | None): where to log, a Logger on stdout if None
+        """
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.connect((tracker_addr, tracker_port))
+        self.socket_helper = SocketHelper(self.socket)
+        self.on_push = on_push
+        self.log = log if log != None else Logger()
+
+        # Held while writing to the socket, so messages don't interleave. Waits for it are timed (see profiler.py),
+        # they show how long requests to the tracker queue up behind each other.
+        self.send_lock = TimedLock()
+
+        self.pending_lock = threading.Lock()
+        self.pending = {}  # request ID -> Future
+        self.request_ids = itertools.count()
+        self.closed = False
+
+        self.port_cache_lock = threading.Lock()
+        self.port_cache = {}  # peer ID -> (listening port, time.monotonic() it expires)
+        self.port_cache_hits = 0
+        self.port_cache_misses = 0
+
+        self.thread = threading.Thread(target=self.read_from_tracker)
+
+    def register(self, listening_port, pub_id, sample=None):
+        """
+        Registers with the tracker (JOIN and ID messages), then starts the reader thread
+
+        Args:
+            listening_port (int): port other peers can reach us on
+            pub_id (bytes): our public ID
+            sample (tuple | None): (k, weighting) to only get a random sample of k peers back
+        Returns:
+            bytes | None: the serialized active peers, None if the tracker broke protocol
+        """
+        join_msg = "".join(["JOIN\n", str(listening_port), "\n"])
+        id_header = ["ID", " ", str(len(pub_id))]
+        if sample != None:
+            id_header += [" ", str(sample[0]), " ", sample[1]]
+        self.send(join_msg.encode() + "".join(id_header + ["\n"]).encode() + pub_id)
+
+        # Nothing else is in flight yet, so the response can be read right here
+        header_bytes = self.socket_helper.get_data_until_newline()
+        if header_bytes == None or header_bytes.decode() != "PEERS":
+            self.log.error("register", "Invalid header, expected PEERS")
+            return None
+        nodes_bytes = self.socket_helper.get_data_until_newline()
+
+        # From here on, everything the tracker sends is read by the reader thread
+        self.thread.start()
+        return nodes_bytes
+
+    def send(self, msg_bytes):
+        """
+        Sends an untagged message to the tracker (e.g. SYNC, PING, LEAVE)
+
+        Args:
+            msg_bytes (bytes): the serialized message
+        """
+        with self.send_lock:
+            self.socket.sendall(msg_bytes)
+
+    def request_async(self, header, payload=b""):
+        """
+        Sends a request without waiting for the response
+
+        Args:
+            header (str): the request's header line, without the newline
+            payload (bytes): data following the header (e.g. a peer ID)
+        Returns:
+            tuple: (request ID, Future). The future resolves to (response header, response body bytes),
+                or None if the tracker disconnected. The ID is None if the request wasn't sent.
+        """
+        future = Future()
+        with self.pending_lock:
+            if self.closed:
+                future.set_result(None)
+                return None, future
+            request_id = next(self.request_ids)
+            self.pending[request_id] = future
+
+        try:
+            self.send("".join(["REQ ", str(request_id), " ", header, "\n"]).encode() + payload)
+        except OSError:
+            with self.pending_lock:
+                self.pending.pop(request_id, None)
+            future.set_result(None)
+            return None, future
+        return request_id, future
+
+    def request(self, header, expected_header, payload=b"", timeout=REQUEST_TIMEOUT):
+        """
+        Sends a request and waits for its response
+
+        Args:
+            header (str): the request's header line, without the newline
+            expected_header (str): header of the response
+            payload (bytes): data following the header (e.g. a peer ID)
+            timeout (float): how long to wait for the response at most
+        Returns:
+            bytes | None: the body of the response, None if the header doesn't match, the request
+                timed out or the tracker disconnected
+        """
+        request_id, future = self.request_async(header, payload)
+        try:
+            response = future.result(timeout)
+        except FutureTimeoutError:
+            # A late response finds nothing pending and is dropped
+            with self.pending_lock:
+                self.pending.pop(request_id, None)
+            self.log.warning("request", "no response to %s from the tracker", header)
+            return None
+
+        if response == None or response[0] != expected_header:
+            return None
+        return response[1]
+
+    def read_from_tracker(self):
+        """
+        Reads everything the tracker sends us until it disconnects, handing responses to the
+        requests waiting for them and everything else to on_push
+        """
+        try:
+            while True:
+                header_bytes = self.socket_helper.get_data_until_newline()
+                if header_bytes == None:
+                    break
+                body_bytes = self.socket_helper.get_data_until_newline()
+                if body_bytes == None:
+                    break
+
+                header = header_bytes.decode()
+                if header.startswith("RESP "):
+                    _, request_id, header = header.split(' ', 2)
+                    with self.pending_lock:
+                        future = self.pending.pop(int(request_id), None)
+                    if future != None:
+                        future.set_result((header, body_bytes))
+                else:
+                    self.on_push(header, body_bytes)
+        except (OSError, ValueError) as e:
+            if not self.closed:
+                self.log.error("read_from_tracker", "Error reading from tracker: %s", e)
+
+        with self.pending_lock:
+            self.closed = True
+            pending = list(self.pending.values())
+            self.pending.clear()
+        for future in pending:
+            future.set_result(None)
+
+    def get_port(self, pub_id):
+        """
+        Retrieves the listening port of a peer, from the cache if we can and with a GET-PEER
+        round trip otherwise
+
+        Args:
+            pub_id (bytes): public ID of the peer
+        Returns:
+            int | None: listening port of the peer, None if the tracker doesn't know it
+        """
+        now = time.monotonic()
+        with self.port_cache_lock:
+            cached = self.port_cache.get(pub_id)
+            if cached != None and cached[1] > now:
+                self.port_cache_hits += 1
+                return cached[0]
+
+        body = self.request(f"GET-PEER {len(pub_id)}", "PEER-PORT", pub_id)
+        if body == None:
+            self.log.warning("get_port", "Invalid header, expected PEER-PORT")
+            return None
+
+        port = int(body)
+        with self.port_cache_lock:
+            self.port_cache_misses += 1
+            # Unknown peers aren't cached, they may just not have registered yet
+            if port == -1:
+                return None
+            self.port_cache[pub_id] = (port, now + PORT_CACHE_TTL)
+        return port
+
+    def invalidate_port(self, pub_id):
+        """
+        Drops a peer's cached port, e.g. after failing to connect to it
+
+        Args:
+            pub_id (bytes): public ID of the peer
+        """
+        with self.port_cache_lock:
+            self.port_cache.pop(pub_id, None)
+
+    def clear_port_cache(self):
+        """
+        Drops every cached port, e.g. when peers left the network
+        """
+        with self.port_cache_lock:
+            self.port_cache.clear()
+
+    def close(self, leave=True):
+        """
+        Closes the connection, which also stops the reader thread
+
+        Args:
+            leave (bool): whether to tell the tracker we're leaving the network first
+        """
+        if leave:
+            try:
+                self.send("LEAVE\n".encode())
+            except OSError as e:
+                self.log.warning("close", "Failed to send leave message: %s", e)
+
+        with self.pending_lock:
+            self.closed = True
+        # Wakes up the reader thread if it's waiting on the socket
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import random
+import sys
+import time
+
+from tracker import raise_fd_limit, STREAM_LIMIT
+
+"""
+Load generator for the tracker.
+
+Opens num_peers persistent connections to the tracker, registers each one with JOIN/ID
+(like a real peer would), then has every connection send LIST and GET-PEER requests back
+to back for duration seconds. Reports how long the joins took, the requests per second the
+tracker served, and latency percentiles per request type.
+
+Usage: python3 tracker_load.py {tracker addr} {tracker port} {num peers} {duration secs} {LIST ratio}
+
+The LIST ratio (0 to 1, default 0.1) is the fraction of requests that are LIST rather than
+GET-PEER. A LIST response carries every peer, so it gets more expensive as num_peers grows.
+"""
+
+# Fake listening ports handed to the tracker, never connected to
+BASE_LISTENING_PORT = 20000
+CONNECT_BATCH = 500
+
+def percentile(sorted_values, p):
+    """
+    Args:
+        sorted_values (float[]): values in ascending order
+        p (float): percentile, 0 to 100
+    Returns:
+        float: the value at percentile p, 0 if there are no values
+    """
+    if len(sorted_values) == 0:
+        return 0
+    idx = min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))
+    return sorted_values[idx]
+
+class LoadPeer:
+    """
+    A fake peer holding one connection to the tracker
+    """
+    def __init__(self, idx):
+        self.listening_port = BASE_LISTENING_PORT + idx
+        self.pub_id = os.urandom(32)
+        self.reader = None
+        self.writer = None
+
+    async def connect(self, tracker_addr, tracker_port):
+        """
+        Connects and registers with the tracker
+
+        Returns:
+            float: seconds from sending JOIN until the PEERS response came back
+        """
+        self.reader, self.writer = await asyncio.open_connection(tracker_addr, tracker_port, limit=STREAM_LIMIT)
+        start = time.perf_counter()
+        msg = "".join(["JOIN\n", str(self.listening_port), "\n", "ID ", str(len(self.pub_id)), "\n"]).encode()
+        self.writer.write(msg + self.pub_id)
+        await self.read_response("PEERS")
+        return time.perf_counter() - start
+
+    async def read_response(self, expected_header):
+        header = (await self.reader.readuntil(b"\n"))[:-1].decode()
+        if header != expected_header:
+            raise ValueError(f"Invalid header {header}, expected {expected_header}")
+        return await self.reader.readuntil(b"\n")
+
+    async def request(self, req_type, pub_id):
+        """
+        Sends a LIST or GET-PEER request and waits for the response
+
+        Returns:
+            float: round trip time in seconds
+        """
+        start = time.perf_counter()
+        self.writer.write("".join([req_type, " ", str(len(pub_id)), "\n"]).encode() + pub_id)
+        await self.read_response("PEERS" if req_type == "LIST" else "PEER-PORT")
+        return time.perf_counter() - start
+
+    async def leave(self):
+        try:
+            self.writer.write(b"LEAVE\n")
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+
+async def run_peer(peer, peers, deadline, list_ratio, latencies):
+    while time.perf_counter() < deadline:
+        if random.random() < list_ratio:
+            req_type = "LIST"
+            pub_id = peer.pub_id
+        else:
+            req_type = "GET-PEER"
+            pub_id = random.choice(peers).pub_id
+        latencies[req_type].append(await peer.request(req_type, pub_id))
+
+def print_latencies(name, latencies, elapsed):
+    latencies.sort()
+    print(f"{name:<9} {len(latencies):>9} {len(latencies) / elapsed:>10.0f}"
+        f" {percentile(latencies, 50) * 1000:>8.2f} {percentile(latencies, 90) * 1000:>8.2f}"
+        f" {percentile(latencies, 99) * 1000:>8.2f} {percentile(latencies, 100) * 1000:>8.2f}")
+
+async def main(tracker_addr, tracker_port, num_peers, duration, list_ratio):
+    peers = [LoadPeer(i) for i in range(num_peers)]
+
+    start = time.perf_counter()
+    join_latencies = []
+    # Connect in batches so we don't overflow the tracker's listen backlog
+    for i in range(0, num_peers, CONNECT_BATCH):
+        batch = peers[i:i + CONNECT_BATCH]
+        join_latencies += await asyncio.gather(*[peer.connect(tracker_addr, tracker_port) for peer in batch])
+    join_elapsed = time.perf_counter() - start
+    print(f"Registered {num_peers} peers in {join_elapsed:.2f}s")
+
+    latencies = {"LIST": [], "GET-PEER": []}
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*[run_peer(peer, peers, deadline, list_ratio, latencies) for peer in peers])
+    elapsed = time.perf_counter() - start
+
+    print(f"{'request':<9} {'count':>9} {'req/s':>10} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    print_latencies("JOIN", join_latencies, join_elapsed)
+    for req_type in latencies:
+        print_latencies(req_type, latencies[req_type], elapsed)
+    print_latencies("ALL", latencies["LIST"] + latencies["GET-PEER"], elapsed)
+
+    await asyncio.gather(*[peer.leave() for peer in peers])
+
+if __name__ == '__main__':
+    tracker_addr = sys.argv[1]
+    tracker_port = int(sys.argv[2])
+    num_peers = int(sys.argv[3])
+    duration = float(sys.argv[4])
+    list_ratio = float(sys.argv[5]) if len(sys.argv) > 5 else 0.1
+
+    raise_fd_limit()
+    asyncio.run(main(tracker_addr, tracker_port, num_peers, duration, list_ratio))
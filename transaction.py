@@ -1,15 +1,35 @@
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives import serialization
+import hashlib
 import json
 
+SHORT_ID_LEN = 6
+FINGERPRINT_LEN = 16
+PEM_PREFIX = b"-----BEGIN"
+
+def key_fingerprint(public_key_bytes):
+    """
+    Computes the fingerprint of a public key, a short ID for the peer that owns it. It is used
+    instead of the (~450 byte) key to identify the peer to the tracker, and as the sender of a
+    transaction once the key is registered on the chain.
+
+    Args:
+        public_key_bytes (bytes): the PEM serialized public key
+    Returns:
+        bytes: hex of the first FINGERPRINT_LEN bytes of sha256(key)
+    """
+    return hashlib.sha256(public_key_bytes).digest()[:FINGERPRINT_LEN].hex().encode()
+
 class Transaction:
     def __init__(self, sender, timestamp, data, signature=None):
         """
         This is a helper class to manage the details of an individual transaction.
 
         Args:
-            sender (bytes): The byte representation of the public_key of the peer that created this transaction. We need this for verification
+            sender (bytes): The byte representation of the public_key of the peer that created this transaction. We need this for verification.
+                            Once the key is registered on the chain (i.e. it was the sender of a transaction in an earlier block),
+                            this can be the key's fingerprint instead, see key_fingerprint().
             timestamp (float) Time at which transaction was created.
             data (dict): Data for this particular transaction.
             signature (bytes, optional): The signature for this transaction. Defaults to None.
@@ -93,6 +113,35 @@ class Transaction:
             signature=bytes.fromhex(txn_dict["signature"]) if txn_dict["signature"] else None
         )
 
+    def sender_is_fingerprint(self):
+        """
+        Returns:
+            bool: whether the sender is a key fingerprint rather than the full public key
+        """
+        return not self.sender.startswith(PEM_PREFIX)
+
+    def sender_fingerprint(self):
+        """
+        Returns:
+            bytes: fingerprint of the sender's public key
+        """
+        if self.sender_is_fingerprint():
+            return self.sender
+        return key_fingerprint(self.sender)
+
+    def short_id(self, salt):
+        """
+        Computes a short ID for this transaction, used in compact blocks to refer to a
+        transaction the receiver most likely already has. It is salted (with the block hash)
+        so collisions can't be crafted ahead of time for every block.
+
+        Args:
+            salt (bytes): salt for the short ID
+        Returns:
+            str: hex string of the first SHORT_ID_LEN bytes of sha256(salt + transaction bytes)
+        """
+        return hashlib.sha256(salt + self.to_bytes()).digest()[:SHORT_ID_LEN].hex()
+
     def sign(self, private_key):
         """
         Generates a signature from the byte representation of this transaction and updates self.signature
@@ -112,18 +161,28 @@ class Transaction:
             hashes.SHA256()
         )
     
-    def verify(self):
+    def verify(self, public_key_bytes=None):
         """
         Checks if this is a valid transaction by comparing its signature and the signature generated using the public key
 
         Args:
-            public_key: The public key used to verify this transaction
+            public_key_bytes (bytes | None): The public key used to verify this transaction, needed if the sender is a
+                                             fingerprint (looked up in the chain's key registry). Defaults to the sender.
         
         Returns:
             True if valid, False otherwise
         """
-        # converts the byte representation in self.sender into a RSAPublicKey object
-        public_key = serialization.load_pem_public_key(self.sender)
+        if self.sender_is_fingerprint():
+            if public_key_bytes == None or key_fingerprint(public_key_bytes) != self.sender:
+                return False
+        else:
+            public_key_bytes = self.sender
+
+        # converts the byte representation of the key into a RSAPublicKey object
+        try:
+            public_key = serialization.load_pem_public_key(public_key_bytes)
+        except ValueError:
+            return False
         transaction_bytes = self.to_bytes(False)
         # verify raises an InvalidSignature Exception if the verification fails
         try: